@@ -1,6 +1,51 @@
+"""
+    Nothing heavy is imported with the package : the public names below are imported on first use
+        (PEP 562), and config.ini is read the first time a setting is looked up.
+        `from stockfighter.lib.scheduler import get_scheduler` or `stockfighter.api.venue` never load pandas.
+"""
+import importlib
 import os
 BASE_PATH = os.path.dirname(os.path.realpath(__file__))
 
-from .lib import config, StockDataBase
-from .api import GameMaster, MarketBroker
-from .trader import TraderBook
+# public name -> module defining it
+_EXPORTS = {
+    'config': '.lib.configreader',
+    'StockDataBase': '.lib.database',
+    'GameMaster': '.api.gm',
+    'MarketBroker': '.api.marketmaker',
+    'AsyncMarketBroker': '.api.asyncbroker',
+    'MultiMarketBroker': '.api.multibroker',
+    'TraderBook': '.trader.trader',
+    'RiskEngine': '.trader.risk',
+    'RiskLimitExceeded': '.trader.risk',
+    'Strategy': '.trader.strategy',
+    'StrategyRunner': '.trader.strategy',
+    'Backtest': '.trader.backtest',
+}
+_PACKAGES = ('api', 'lib', 'trader', 'helpers', 'sim', 'benchmarks')
+
+__all__ = sorted(_EXPORTS)
+
+
+def lazy_import(package, exports, packages, name):
+    """
+        Module level __getattr__ of a package : imports `name` from its module on first use,
+            and caches it in the package namespace
+    """
+    if name in exports:
+        value = getattr(importlib.import_module(exports[name], package), name)
+    elif name in packages:
+        value = importlib.import_module('.' + name, package)
+    else:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(package, name))
+    globals_ = importlib.import_module(package).__dict__
+    globals_[name] = value
+    return value
+
+
+def __getattr__(name):
+    return lazy_import(__name__, _EXPORTS, _PACKAGES, name)
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_EXPORTS) + list(_PACKAGES))
@@ -1,4 +1,21 @@
-from .gm import GameMaster
-from .venue import StockFighterTrader
-from .marketmaker import MarketBroker
-from .websockets import WebSocketListenerQuotes
+from stockfighter import lazy_import
+
+_EXPORTS = {
+    'GameMaster': '.gm',
+    'StockFighterTrader': '.venue',
+    'MarketBroker': '.marketmaker',
+    'AsyncMarketBroker': '.asyncbroker',
+    'MultiMarketBroker': '.multibroker',
+    'WebSocketListenerQuotes': '.websockets',
+    'TickRecorder': '.tickdata',
+    'SessionReader': '.tickdata',
+    'ReplayBroker': '.replay',
+    'BacktestBroker': '.backtest',
+    'FeedProcess': '.sharedfeed',
+    'SharedMarketData': '.sharedfeed',
+    'connect_gateway': '.sharedfeed',
+}
+
+
+def __getattr__(name):
+    return lazy_import(__name__, _EXPORTS, (), name)
@@ -0,0 +1,201 @@
+import asyncio
+import json
+
+import aiohttp
+
+from stockfighter import config
+from .orders import (ORDER_TYPE, account_orders_path, api_headers, build_order, order_path, parse_order_response,
+                     resolve_target)
+from .decoding import loads
+from .fills import FillLog
+from .store import QuoteStore
+from .urls import api_url, ws_url
+from .websockets import QuoteReader
+
+
+class AsyncMarketBroker(QuoteReader):
+    """
+        asyncio version of MarketBroker.
+            - one aiohttp session (keep-alive connection pool) for every REST call
+            - tickertape and executions websockets run as tasks on the same event loop
+            - order methods are coroutines : dozens of orders can be in flight at once,
+                without a thread per request
+
+        Usage :
+            async with AsyncMarketBroker(gm=GM) as amb:
+                res = await asyncio.gather(*[amb.buy(10, price) for price in prices])
+
+        Public Methods / Attributes (coroutines) :
+            - buy / sell / cancel           : order management
+            - order_status(oid)             : status of one order
+            - all_orders_in_stock()         : list of dicts. All the orders of our account in the stock
+            - order_book()                  : dict. Current order book on the stock
+        Market data, as in MarketBroker (not coroutines) :
+            - get_spread() / get_histo() / current_quote() / get_latest_quote_time()
+            - fills                         : FillLog of the messages received on the executions websocket
+    """
+    _ORDER_TYPE = ORDER_TYPE
+
+    def __init__(self, gm=None, pool_size=None, store=None):
+        # Extracts info from gamemaster
+        self._venue, self._stock, self._account = resolve_target(gm)
+        if gm:
+            self._gm = gm
+            self._db = gm._db
+
+        if pool_size is None:
+            pool_size = config.getint('http', 'pool_size', fallback=20)
+        self._pool_size = pool_size
+        self._headers = api_headers()
+
+        self._API_URL = api_url()
+        self._WS_URL = ws_url()
+
+        QuoteReader.__init__(self, store if store is not None else QuoteStore())
+        self.fills = FillLog()
+        self._session = None
+        self._tasks = []
+
+    """
+        Lifecycle
+    """
+    async def start(self):
+        connector = aiohttp.TCPConnector(limit=self._pool_size)
+        self._session = aiohttp.ClientSession(connector=connector, headers=self._headers)
+
+        if not (await self._get('/heartbeat')).get('ok'):
+            raise Exception('Stockfighter not online')
+        if not (await self._get('/venues/{venue}/heartbeat'.format(venue=self._venue))).get('ok'):
+            raise Exception('Venue {} not online'.format(self._venue))
+
+        url = '{base}/{account}/venues/{venue}/{{channel}}/stocks/{stock}'
+        url = url.format(base=self._WS_URL, account=self._account, venue=self._venue, stock=self._stock)
+        self._tasks = [
+            asyncio.ensure_future(self._listen(url.format(channel='tickertape'), self._on_quote)),
+            asyncio.ensure_future(self._listen(url.format(channel='executions'), self._on_fill)),
+        ]
+        print('Async Market Maker for stock {} initiated'.format(self._stock))
+        return self
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    """
+        Websockets, as tasks
+    """
+    async def _listen(self, url, on_message, retry=1):
+        # Listens forever : reconnects after `retry` seconds when the websocket closes
+        while True:
+            try:
+                async with self._session.ws_connect(url) as webs:
+                    async for msg in webs:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            # a bad message, or a failing handler, does not stop the listener
+                            try:
+                                on_message(msg.data)
+                            except Exception as e:
+                                print('Websocket {} message failed : {}'.format(url, e))
+                        elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print('Websocket {} error : {}'.format(url, e))
+            print("### closed ###")
+            await asyncio.sleep(retry)
+
+    def _on_quote(self, message):
+        self.on_quote_message(self.store, message)
+
+    def _on_fill(self, message):
+        self.fills.append(loads(message))
+
+    """
+        Standard API helpers
+    """
+    async def _get(self, path):
+        async with self._session.get(self._API_URL + path) as res:
+            return await res.json(content_type=None)
+
+    async def _post_json(self, path, data):
+        async with self._session.post(self._API_URL + path, data=json.dumps(data)) as res:
+            return await res.json(content_type=None)
+
+    async def _delete(self, path):
+        async with self._session.delete(self._API_URL + path) as res:
+            return await res.json(content_type=None)
+
+    """
+        Market Data
+    """
+    def get_histo(self):
+        return self.get_data()
+
+    def current_quote(self):
+        return self.get_quote()
+
+    async def order_book(self):
+        return await self._get('/venues/{venue}/stocks/{stock}'.format(venue=self._venue, stock=self._stock))
+
+    """
+        Orders
+    """
+    async def _send_order(self, qty, price, order_type, direction):
+        order = build_order(self._account, self._venue, self._stock, qty, price, order_type, direction)
+
+        if qty > 0:
+            res = await self._post_json(order_path(self._venue, self._stock), order)
+        else:
+            print('Qty passed {} - not sending {} order'.format(qty, direction))
+            res = dict()
+
+        return parse_order_response(res)
+
+    async def buy(self, qty, price=None, order_type='limit'):
+        """
+            Buy this MarketMaker's stock
+            input :
+                qty     : int, how many shares you want to buy
+                price   : int, price x 100
+                order_type : string, limit, market, fill-or-kill, immediate-or-cancel
+        """
+        return await self._send_order(qty, price, order_type, 'buy')
+
+    async def sell(self, qty, price=None, order_type='limit'):
+        """
+            Sell this MarketMaker's stock
+            input :
+                qty     : int, how many shares you want to sell
+                price   : int, price x 100
+                order_type : string, limit, market, fill-or-kill, immediate-or-cancel
+        """
+        return await self._send_order(qty, price, order_type, 'sell')
+
+    async def cancel(self, oid):
+        return await self._delete(order_path(self._venue, self._stock, oid))
+
+    async def order_status(self, oid):
+        res = await self._get(order_path(self._venue, self._stock, oid))
+        if res.get('ok'):
+            return res
+        else:
+            raise Exception('Didnt get proper data from order_status')
+
+    async def all_orders_in_stock(self):
+        res = await self._get(account_orders_path(self._venue, self._account, self._stock))
+        if res.get('ok'):
+            return res.get('orders')
+        else:
+            raise Exception('Didnt get proper data from all_orders_in_stock')
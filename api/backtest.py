@@ -0,0 +1,377 @@
+"""
+    Backtesting : the order side of the MarketBroker interface, simulated against a recorded session
+
+    A BacktestBroker replays the tickertape of a session recorded by TickRecorder, and fills our orders
+        against it instead of sending them :
+        - the clock is the receive time of the quote being replayed, not the wall clock
+        - an order crossing the quote fills at once against its displayed size : the size at the best
+            price for limit, immediate-or-cancel and fill-or-kill orders, the whole depth of the side for
+            market orders (at the best price : the levels behind it are not recorded). Shares taken are
+            not available again until the next quote.
+        - the rest of a limit order rests behind a simulated queue : the shares displayed at its price
+            when it reaches the top of the book. The queue ahead shrinks with the trades printed at its
+            price, and with the displayed size (cancels are assumed to be ahead of us).
+            The order fills once the queue ahead is gone, when a trade prints through its price, when its
+            level disappears after a trade, or when the opposite side of the quote crosses it.
+        - execution messages, in the websocket format, go to the FillLog and the fill subscribers :
+            a TraderBook's ledger and order index are updated as they are live
+    The tickertape only reports the last trade of each quote : the trades in between are not seen.
+"""
+import itertools
+
+from .fills import FillLog
+from .orders import build_order, parse_order_response
+from .replay import _Feed
+from .store import QuoteStore
+from .tickdata import SessionReader
+from .websockets import QuoteReader, ThreadedWebSocket
+from stockfighter.lib.timestamps import to_iso
+
+
+def _snapshot(order):
+    # Copy of an order status, as returned by the order api
+    return dict(order, fills=list(order['fills']))
+
+
+class MemoryDataBase(object):
+    """
+        In memory stand-in for StockDataBase : the orders of a backtest are kept, not persisted
+    """
+    def __init__(self):
+        self.orders = {}
+
+    def save_order(self, order):
+        self.orders[order.get('id')] = order
+
+    def save_order_batch(self, orders):
+        for order in orders:
+            self.save_order(order)
+
+    update_order_batch = save_order_batch
+
+    def iterate_table(self, table):
+        return iter(list(self.orders.values()) if table == 'orders' else [])
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class BacktestBroker(QuoteReader):
+    """
+        MarketBroker stand-in for backtests : market data from a recorded session, orders filled by a
+            queue position model (see the module docstring). Nothing is sent, nothing is stored on disk.
+
+        Usage, through trader.Backtest, or by hand :
+            BB = BacktestBroker(SessionReader.open('TESTEX', 'FOOBAR', 'local'))
+            TB = TraderBook(BB)
+            BB.subscribe_quotes(on_quote)       # on_quote can call TB.buy / TB.sell...
+            BB.run()
+
+        Public Methods / Attributes, as in MarketBroker :
+            - get_spread() / get_histo() / current_quote() / get_latest_quote_time()
+            - subscribe_quotes(callback), subscribe_fills(callback), unsubscribe(callback), _get_fills_ws()
+            - _buy / _sell / _cancel / _submit_many / _cancel_many / _get_order_status / _get_all_orders_in_stock
+            - all_orders_in_stock : always empty, the TraderBook's order index is up to date
+        Backtest :
+            - clock()               : simulated time, nanoseconds since epoch
+            - deliver(recv, msg)    : replays one tickertape message received at `recv`
+            - advance(ns)           : moves the clock forward (timers between two quotes)
+            - run()                 : replays the whole session
+            - mark_price()          : mid of the latest quote (or its last trade price)
+            - cash / volume / executions / orders_sent / quotes : counters of the simulation (cash : price x 100)
+    """
+    def __init__(self, session, account='BACKTEST', store=None):
+        if not isinstance(session, SessionReader):
+            session = SessionReader(session)
+        self._session = session
+        self._venue = session.venue
+        self._stock = session.stock
+        self._account = account
+        self._db = MemoryDataBase()
+        self.all_orders_in_stock = []
+
+        QuoteReader.__init__(self, store if store is not None else QuoteStore())
+        self._fills = FillLog()
+        self._quote_feed = _Feed([])
+        self._fill_feed = _Feed([])
+
+        self._now = 0
+        self._iso = (None, None)
+        self._ids = itertools.count(1)
+        self._orders = {}
+        # oid -> [order, shares ahead of it in the queue (None : its price is not the best yet)]
+        self._resting = {}
+        self._quote = {}
+        self._last_trade = None
+        # shares taken from the displayed ask ('buy') / bid ('sell') since the latest quote
+        self._taken = {'buy': 0, 'sell': 0}
+
+        self.cash = 0
+        self.volume = 0
+        self.executions = 0
+        self.orders_sent = 0
+        self.quotes = 0
+
+    @property
+    def session(self):
+        return self._session
+
+    """
+        Clock
+    """
+    def clock(self):
+        return self._now
+
+    def advance(self, ns):
+        self._now = max(self._now, ns)
+
+    def _timestamp(self):
+        # ISO time of the clock, converted once per tick
+        if self._iso[0] != self._now:
+            self._iso = (self._now, to_iso([self._now])[0])
+        return self._iso[1]
+
+    """
+        Market Data, as in MarketBroker
+    """
+    def get_histo(self):
+        return self.get_data()
+
+    def _get_fills_ws(self):
+        return self._fills
+
+    def subscribe_fills(self, callback):
+        self._fill_feed.subscribers.append(callback)
+        return callback
+
+    def subscribe_quotes(self, callback):
+        self._quote_feed.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        for feed in (self._quote_feed, self._fill_feed):
+            if callback in feed.subscribers:
+                feed.subscribers.remove(callback)
+
+    def current_quote(self):
+        return self.get_quote()
+
+    def mark_price(self):
+        bid, ask = self._quote.get('bid'), self._quote.get('ask')
+        if bid and ask:
+            return (bid + ask) / 2.
+        return self._quote.get('last') or 0
+
+    """
+        Orders
+    """
+    def __submit(self, direction, qty, price, order_type):
+        request = build_order(self._account, self._venue, self._stock, qty, price, order_type, direction)
+        order = {
+            'ok': True, 'symbol': self._stock, 'venue': self._venue, 'direction': direction,
+            'originalQty': request['qty'], 'qty': request['qty'], 'price': request['price'],
+            'orderType': order_type, 'id': next(self._ids), 'account': self._account,
+            'ts': self._timestamp(), 'fills': [], 'totalFilled': 0, 'open': True,
+        }
+        self._orders[order['id']] = order
+        self.orders_sent += 1
+
+        available = self._available(order)
+        filled = 0
+        if order_type != 'fill-or-kill' or available >= order['qty']:
+            filled = min(available, order['qty'])
+            if filled:
+                self._taken[direction] += filled
+                self._trade(order, self._quote.get('ask' if direction == 'buy' else 'bid'), filled)
+        if order['open'] and order_type != 'limit':
+            order['qty'] = 0
+            order['open'] = False
+        if filled:
+            self._publish(order, filled, incoming=True)
+        if order['open']:
+            self._rest(order)
+        return parse_order_response(_snapshot(order))
+
+    def _available(self, order):
+        # Shares of the latest quote the incoming order can take
+        buy = order['direction'] == 'buy'
+        best = self._quote.get('ask' if buy else 'bid')
+        if best is None:
+            return 0
+        if order['orderType'] == 'market':
+            size = self._quote.get('askDepth' if buy else 'bidDepth') or self._quote.get('askSize' if buy else 'bidSize', 0)
+        elif (best <= order['price']) if buy else (best >= order['price']):
+            size = self._quote.get('askSize' if buy else 'bidSize', 0)
+        else:
+            return 0
+        return max(0, size - self._taken[order['direction']])
+
+    def _rest(self, order):
+        buy = order['direction'] == 'buy'
+        best, price = self._quote.get('bid' if buy else 'ask'), order['price']
+        if best is None or (price > best if buy else price < best):
+            ahead = 0
+        elif price == best:
+            ahead = self._quote.get('bidSize' if buy else 'askSize', 0)
+        else:
+            ahead = None
+        self._resting[order['id']] = [order, ahead]
+
+    def _trade(self, order, price, qty):
+        ts = self._timestamp()
+        order['qty'] -= qty
+        order['totalFilled'] += qty
+        order['fills'].append({'price': price, 'qty': qty, 'ts': ts})
+        if not order['qty']:
+            order['open'] = False
+        sign = 1 if order['direction'] == 'buy' else -1
+        self.cash -= sign * qty * price
+        self.volume += qty
+        self.executions += 1
+
+    def _publish(self, order, qty, incoming):
+        # Execution message of the latest fill of the order, the other side being the recorded market
+        fill = order['fills'][-1]
+        complete = not order['open']
+        msg = {
+            'ok': True, 'account': self._account, 'venue': self._venue, 'symbol': self._stock,
+            'order': _snapshot(order),
+            'standingId': None if incoming else order['id'], 'incomingId': order['id'] if incoming else None,
+            'price': fill['price'], 'filled': qty, 'filledAt': fill['ts'],
+            'standingComplete': complete if not incoming else False,
+            'incomingComplete': complete if incoming else False,
+        }
+        self._fills.append(msg)
+        ThreadedWebSocket._dispatch(self._fill_feed, msg)
+
+    def _match_resting(self, traded):
+        quote = self._quote
+        last, last_size = quote.get('last'), quote.get('lastSize', 0)
+        for oid, entry in list(self._resting.items()):
+            order, ahead = entry
+            buy = order['direction'] == 'buy'
+            price, remaining = order['price'], order['qty']
+            same = quote.get('bid' if buy else 'ask')
+            opposite = quote.get('ask' if buy else 'bid')
+
+            level_gone = same is None or (same < price if buy else same > price)
+
+            # the trade takes the queue ahead first, then what is still displayed caps it
+            filled = 0
+            if traded and last is not None:
+                if (last < price if buy else last > price) or (last == price and level_gone):
+                    filled = remaining
+                elif last == price and ahead is not None:
+                    used = min(ahead, last_size)
+                    ahead -= used
+                    filled = last_size - used
+            if level_gone:
+                ahead = 0
+            elif same == price:
+                size = quote.get('bidSize' if buy else 'askSize', 0)
+                ahead = size if ahead is None else min(ahead, size)
+
+            if filled < remaining and opposite is not None and (opposite <= price if buy else opposite >= price):
+                side = order['direction']
+                crossed = min(remaining - filled,
+                              max(0, quote.get('askSize' if buy else 'bidSize', 0) - self._taken[side]))
+                self._taken[side] += crossed
+                filled += crossed
+
+            entry[1] = ahead
+            filled = min(filled, remaining)
+            if filled:
+                self._trade(order, price, filled)
+                if not order['open']:
+                    del self._resting[oid]
+                self._publish(order, filled, incoming=False)
+
+    def _buy(self, qty, price=None, order_type='limit'):
+        """
+            Simulated buy, filled against the replayed quotes
+            input :
+                qty     : int, how many shares you want to buy
+                price   : int, price x 100
+                order_type : string, limit, market, fill-or-kill, immediate-or-cancel
+        """
+        if qty <= 0:
+            print('Qty passed {} - not sending {} order'.format(qty, 'buy'))
+            return None
+        return self.__submit('buy', qty, price, order_type)
+
+    def _sell(self, qty, price=None, order_type='limit'):
+        """
+            Simulated sell, filled against the replayed quotes
+            input :
+                qty     : int, how many shares you want to sell
+                price   : int, price x 100
+                order_type : string, limit, market, fill-or-kill, immediate-or-cancel
+        """
+        if qty <= 0:
+            print('Qty passed {} - not sending {} order'.format(qty, 'sell'))
+            return None
+        return self.__submit('sell', qty, price, order_type)
+
+    def _cancel(self, oid):
+        order = self._orders.get(oid)
+        if order is None:
+            return {'ok': False, 'error': 'Unknown order {}'.format(oid)}
+        if order['open']:
+            order['qty'] = 0
+            order['open'] = False
+            self._resting.pop(oid, None)
+        return _snapshot(order)
+
+    @staticmethod
+    def __outcome(call, *args):
+        try:
+            return call(*args), None
+        except Exception as e:
+            return None, e
+
+    def _submit_many(self, orders):
+        return [self.__outcome(self.__submit, order.get('direction'), order.get('qty'), order.get('price'),
+                               order.get('order_type', 'limit'))
+                for order in orders]
+
+    def _cancel_many(self, oids):
+        return [self.__outcome(self._cancel, oid) for oid in oids]
+
+    def _get_order_status(self, oid):
+        order = self._orders.get(oid)
+        if order is None:
+            raise Exception('Didnt get proper data from get_order_status')
+        return _snapshot(order)
+
+    def _get_all_orders_in_stock(self):
+        return [_snapshot(order) for order in self._orders.values()]
+
+    """
+        Replay
+    """
+    def deliver(self, recv, msg):
+        """
+            Replays a tickertape message : the clock moves to `recv`, resting orders are matched against
+                the new quote, then it is stored and sent to the quote subscribers
+        """
+        if not msg.get('ok'):
+            return
+        quote = msg.get('quote')
+        self.advance(recv)
+        self.quotes += 1
+        self._quote = quote
+        self._taken['buy'] = self._taken['sell'] = 0
+        trade = quote.get('lastTrade')
+        traded = trade is not None and trade != self._last_trade
+        self._last_trade = trade
+        if self._resting:
+            self._match_resting(traded)
+        self.store.append(quote)
+        ThreadedWebSocket._dispatch(self._quote_feed, msg)
+
+    def run(self):
+        for recv, msg in self._session.quotes():
+            self.deliver(recv, msg)
@@ -0,0 +1,157 @@
+"""
+    Decoding of the websocket frames
+
+        - loads : the fastest json decoder available (orjson, ujson, then the standard library),
+                    or the one set in config.ini ([websocket] json), chosen on the first frame
+        - QuoteRecord : compact (__slots__) quote, holding only the fields used by the client
+        - FrameQueue : hands raw frames from the socket thread over to a decoder thread.
+            The socket thread only appends to a deque (atomic, no lock) : decoding, storing
+            and calling the subscribers happen on the decoder thread.
+"""
+import importlib
+import json
+import threading
+from collections import deque
+
+from stockfighter import config
+
+_DECODERS = ('orjson', 'ujson', 'json')
+
+
+def get_decoder(name=None):
+    """
+        Returns (name, loads) of the json decoder to use
+            name : 'orjson', 'ujson', 'json' or 'auto' (first one installed). Defaults to config.ini
+    """
+    if name is None:
+        name = config.get('websocket', 'json', fallback='auto')
+    if name not in _DECODERS + ('auto',):
+        raise Exception('json decoder must be one of : [{}]'.format(', '.join(_DECODERS + ('auto',))))
+    for candidate in (_DECODERS if name == 'auto' else (name,)):
+        try:
+            return candidate, importlib.import_module(candidate).loads
+        except ImportError:
+            if name != 'auto':
+                raise
+    return 'json', json.loads
+
+
+# (name, loads) of the decoder in use : config.ini is read on the first frame, not on import
+_decoder = None
+
+
+def _resolve():
+    global _decoder
+    if _decoder is None:
+        _decoder = get_decoder()
+    return _decoder
+
+
+def decoder_name():
+    return _resolve()[0]
+
+
+def loads(frame):
+    return (_decoder or _resolve())[1](frame)
+
+
+class QuoteRecord(object):
+    """
+        A tickertape quote, with the fields the client uses.
+            Reads like the quote dict it comes from : get(name, default), record[name], name in record.
+            Missing fields are None.
+    """
+    __slots__ = ('symbol', 'venue', 'bid', 'ask', 'bidSize', 'askSize', 'bidDepth', 'askDepth',
+                 'last', 'lastSize', 'lastTrade', 'quoteTime')
+
+    def __init__(self, quote):
+        get = quote.get
+        self.symbol = get('symbol')
+        self.venue = get('venue')
+        self.bid = get('bid')
+        self.ask = get('ask')
+        self.bidSize = get('bidSize')
+        self.askSize = get('askSize')
+        self.bidDepth = get('bidDepth')
+        self.askDepth = get('askDepth')
+        self.last = get('last')
+        self.lastSize = get('lastSize')
+        self.lastTrade = get('lastTrade')
+        self.quoteTime = get('quoteTime')
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+    def __getitem__(self, name):
+        value = getattr(self, name, None)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name):
+        return getattr(self, name, None) is not None
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+
+    def __repr__(self):
+        return 'QuoteRecord({})'.format(self.to_dict())
+
+
+def decode_quote(frame):
+    # Tickertape frame -> message, the quote as a QuoteRecord
+    msg = loads(frame)
+    if msg.get('ok'):
+        msg['quote'] = QuoteRecord(msg.get('quote'))
+    return msg
+
+
+class FrameQueue(object):
+    """
+        Raw frames, from the socket thread to a decoder thread
+            - put(frame)    : called on the socket thread. Appends, wakes the decoder only if it sleeps
+            - the decoder thread calls handle(frame) for every frame, in order
+            - close()       : the decoder thread exits once the queue is drained
+    """
+    def __init__(self, handle, name='decoder'):
+        self._frames = deque()
+        self._handle = handle
+        self._wakeup = threading.Event()
+        self._idle = False
+        self._closed = False
+        self.decoded = 0
+        thrd = threading.Thread(target=self.__loop, name=name)
+        thrd.daemon = True
+        thrd.start()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, frame):
+        self._frames.append(frame)
+        if self._idle:
+            self._wakeup.set()
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+
+    def __loop(self):
+        frames, handle = self._frames, self._handle
+        while True:
+            while frames:
+                frame = frames.popleft()
+                try:
+                    handle(frame)
+                except Exception as e:
+                    print('Could not handle websocket frame : {}'.format(e))
+                self.decoded += 1
+            if self._closed:
+                return
+            # put() appends before it checks _idle : a frame appended before _idle is set is seen here
+            self._idle = True
+            if not frames:
+                self._wakeup.wait()
+            self._wakeup.clear()
+            self._idle = False
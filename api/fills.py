@@ -0,0 +1,59 @@
+import threading
+
+
+class FillLog(object):
+    """
+        Execution messages received on the fills websocket
+            - append(msg) keeps the message, and updates in place the latest state of its order
+            - consumers keep a cursor, and only get the messages received since : O(new fills)
+
+        Public Methods :
+            - append(msg)       : adds an execution message
+            - since(cursor)     : (list of messages received after `cursor`, new cursor)
+            - latest(oid)       : latest execution message of order `oid`, None if unknown
+            - latest_by_order() : dict oid -> latest execution message (copy)
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._messages = []
+        self._latest = {}
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        with self._lock:
+            messages = list(self._messages)
+        return iter(messages)
+
+    def append(self, msg):
+        oid = (msg.get('order') or {}).get('id')
+        with self._lock:
+            self._messages.append(msg)
+            if oid is not None:
+                current = self._latest.get(oid)
+                if current is None or self._newer(msg, current):
+                    self._latest[oid] = msg
+
+    @staticmethod
+    def _newer(msg, current):
+        # Statuses only move forward : more shares filled, then closed, then the latest execution
+        #   (backfilled messages have no incomingId)
+        new, old = msg.get('order'), current.get('order')
+        new_filled, old_filled = new.get('totalFilled') or 0, old.get('totalFilled') or 0
+        if new_filled != old_filled:
+            return new_filled > old_filled
+        if new.get('open') != old.get('open'):
+            return not new.get('open')
+        return (msg.get('incomingId') or 0) >= (current.get('incomingId') or 0)
+
+    def since(self, cursor):
+        with self._lock:
+            return self._messages[cursor:], len(self._messages)
+
+    def latest(self, oid):
+        return self._latest.get(oid)
+
+    def latest_by_order(self):
+        with self._lock:
+            return dict(self._latest)
@@ -0,0 +1,148 @@
+import threading
+
+import numpy as np
+
+from .store import NAT
+
+
+class FrameCache(object):
+    """
+        DataFrame materialized incrementally from a QuoteStore
+            - keeps the last built frame and the store high-water mark
+            - only the quotes appended since the last call are converted
+            - duplicates are only looked for against the tail of the frame (consecutive rows)
+            - when nothing changed, the cached frame is returned as is
+            - the frame is trimmed to the capacity of the store
+            - rows are appended to preallocated arrays (index and columns), the frame is a view on them :
+                a refresh costs O(new rows). Full arrays are replaced by new ones (with room for
+                `capacity` more rows), never overwritten : frames already returned stay valid
+
+        The frame returned is shared between callers : copy it before modifying it.
+            pandas is only imported once a frame is asked for.
+
+        Public Methods :
+            - get(rows) : DataFrame, `rows` is either None (everything) or the number of latest rows
+    """
+    def __init__(self, store, index, columns, drop_missing_index=False, dedupe_on_index=False, derive=None):
+        """
+            store               : QuoteStore
+            index               : name of the time column used as index
+            columns             : list of the other columns
+            drop_missing_index  : skip quotes where the index time is missing
+            dedupe_on_index     : rows are duplicates only if their index is also the same
+            derive              : optional function adding computed columns to each new block of rows
+        """
+        self._store = store
+        self._index = index
+        self._columns = list(columns)
+        self._drop_missing_index = drop_missing_index
+        self._dedupe_on_index = dedupe_on_index
+        self._derive = derive
+        self._mark = 0
+        self._frame = None
+        # Preallocated rows : DatetimeIndex (written through its int64 view), columns of the frame
+        self._times = None
+        self._times_i8 = None
+        self._values = None
+        self._start = 0
+        self._stop = 0
+        self._lock = threading.Lock()
+
+    def get(self, rows=None):
+        with self._lock:
+            if self._frame is None:
+                self._frame = self._build({name: np.empty(0) for name in [self._index] + self._columns})
+            if self._store.total != self._mark:
+                self._refresh()
+            frame = self._frame
+
+        if rows is None:
+            return frame
+        else:
+            return frame.iloc[len(frame) - min(int(rows), len(frame)):]
+
+    def _build(self, cols):
+        import pandas as pd
+        times = cols.pop(self._index).astype(np.int64)
+        index = pd.DatetimeIndex(pd.to_datetime(times, utc=True), name=self._index)
+        df = pd.DataFrame(cols, index=index, columns=self._columns)
+        if self._derive:
+            df = self._derive(df)
+        return df
+
+    def _keep_mask(self, cols):
+        """
+            True for the rows that differ from the row before them.
+            The first new row is compared to the last row of the cached frame.
+        """
+        new = np.column_stack([cols[name].astype(np.float64) for name in self._columns])
+
+        if self._stop > self._start:
+            prev_row = [self._values[name][self._stop - 1] for name in self._columns]
+        else:
+            prev_row = np.full(len(self._columns), np.nan)
+        prev = np.vstack([np.array(prev_row, dtype=np.float64), new[:-1]])
+
+        same = ((new == prev) | (np.isnan(new) & np.isnan(prev))).all(axis=1)
+        if self._dedupe_on_index:
+            # times compared as int64 : as float64, ns since epoch are only exact to 256 ns
+            times = cols[self._index]
+            prev_time = self._times_i8[self._stop - 1] if self._stop > self._start else NAT
+            same &= times == np.concatenate(([prev_time], times[:-1]))
+        keep = ~same
+        if self._stop == self._start:
+            keep[0] = True
+        return keep
+
+    def _allocate(self, new, rows):
+        """
+            New arrays for `rows` more rows than the current frame holds (up to the capacity),
+                the rows of the current frame still within the capacity are copied over
+        """
+        import pandas as pd
+        capacity = self._store.capacity
+        keep = min(self._stop - self._start, capacity - rows)
+        size = min(max(2 * (keep + rows), 1024), 2 * capacity)
+
+        times = pd.DatetimeIndex(np.zeros(size, dtype='datetime64[ns]'), tz='UTC', name=self._index)
+        times_i8 = times.asi8
+        values = {name: np.empty(size, dtype=new[name].dtype) for name in new.columns}
+        if keep > 0:
+            times_i8[:keep] = self._times_i8[self._stop - keep:self._stop]
+            for name, col in values.items():
+                col[:keep] = self._values[name][self._stop - keep:self._stop]
+
+        self._times, self._times_i8, self._values = times, times_i8, values
+        self._start, self._stop = 0, keep
+
+    def _append(self, new):
+        import pandas as pd
+        capacity = self._store.capacity
+        if len(new) > capacity:
+            new = new.iloc[len(new) - capacity:]
+        rows = len(new)
+        if self._times is None or self._stop + rows > len(self._times):
+            self._allocate(new, rows)
+
+        stop = self._stop + rows
+        self._times_i8[self._stop:stop] = new.index.asi8
+        for name, col in self._values.items():
+            col[self._stop:stop] = new[name].to_numpy()
+        self._stop = stop
+        self._start = max(self._start, stop - capacity)
+
+        self._frame = pd.DataFrame({name: col[self._start:stop] for name, col in self._values.items()},
+                                   index=self._times[self._start:stop], columns=list(self._values), copy=False)
+
+    def _refresh(self):
+        cols, self._mark = self._store.since(self._mark, [self._index] + self._columns)
+
+        if self._drop_missing_index:
+            valid = cols[self._index] != NAT
+            cols = {name: col[valid] for name, col in cols.items()}
+
+        if not len(cols[self._index]):
+            return
+
+        keep = self._keep_mask(cols)
+        self._append(self._build({name: col[keep] for name, col in cols.items()}))
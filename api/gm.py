@@ -1,15 +1,14 @@
 import shelve
 import os
-import time
-import threading
 from contextlib import closing
 
-import requests
-
 from stockfighter import config
 from stockfighter import BASE_PATH
+from stockfighter.lib.scheduler import get_scheduler
+from .http import get_session
+from .urls import gm_url
 
-API_KEY = config.get('api', 'APIKEY')
+_NOT_LOADED = object()
 
 
 class GameMaster(object):
@@ -26,40 +25,66 @@ class GameMaster(object):
             - restart   : restart a level with same stock / venue
             - completion : Prints completion (number of days in game). Usefull to get extra data
 
+        The GameMaster url is read from config.ini ([urls] gm)
+        A saved instance is resumed the first time `ready` is read, if no level was started before.
+
     """
-    _URL = 'https://www.stockfighter.io/gm'
     _LEVELS = ['first_steps', 'chock_a_block', 'sell_side']
 
     def __init__(self, db=None):
-        self.ready = None   # Is the instance ready ?
+        self._ready = None
+        self._URL = gm_url()
         self._shelve_path = os.path.join(BASE_PATH, 'lib/gm.db')
         self.headers = {
-            'Cookie' : 'api_key={}'.format(API_KEY)
+            'Cookie' : 'api_key={}'.format(config.get('api', 'APIKEY'))
                        }
-        self._instanceId = self._load_instance_id()
+        self._instance_id = _NOT_LOADED
+        self._job = None
 
         if not db:
             raise Exception('An instance of StockDataBase needs to be passed as argument db')
         else:
             self._db = db
 
-        if self._instanceId:
-            # try to resume
-            self.resume()
-
         ## setting up level info
         self.target_price_l2 = None
         self._live = None
 
+    """
+        Lazy state : the saved instanceId is read on first use, and resumed the first time
+            `ready` is checked (MarketBroker does), not on construction
+    """
+    @property
+    def _instanceId(self):
+        if self._instance_id is _NOT_LOADED:
+            self._instance_id = self._load_instance_id()
+        return self._instance_id
+
+    @_instanceId.setter
+    def _instanceId(self, instanceid):
+        self._instance_id = instanceid
+
+    @property
+    def ready(self):
+        # Is the instance ready ? Resumes the saved instance, if any, when nothing was started yet
+        if self._ready is None and self._instanceId:
+            self._ready = False
+            self.resume()
+        return self._ready
+
+    @ready.setter
+    def ready(self, ready):
+        self._ready = ready
+
     """
         API helpers
     """
     def _post(self, url):
-        resp = requests.post(url, headers=self.headers)
+        resp = get_session().post(url, headers=self.headers)
         return resp.json()
 
     def _get(self, url):
-        resp = requests.get(url, headers=self.headers)
+        resp = get_session().get(url, headers=self.headers)
         return resp.json()
 
     """
@@ -79,15 +104,14 @@ class GameMaster(object):
         Updating the GameMaster to know advancement / get extra data
     """
     def _start_update_thread(self):
-        thrd = threading.Thread(target=self._loop)
-        thrd.daemon = True
-        thrd.start()
+        # Status polled every 5s by the shared scheduler. Starting twice keeps one job
+        if self._job is None:
+            self._job = get_scheduler().add('gm-status', self._update, interval=5, delay=2)
 
-    def _loop(self):
-        time.sleep(2)
-        while True:
-            self._update()
-            time.sleep(5)
+    def _stop_update_thread(self):
+        if self._job is not None:
+            get_scheduler().remove(self._job)
+            self._job = None
 
     def completion(self):
         """
@@ -155,6 +179,7 @@ class GameMaster(object):
         if self._instanceId is not None:
             url = self._URL + '/instances/{instanceId}/stop'.format(instanceId=self._instanceId)
             self._post(url)
+            self._stop_update_thread()
             print('Stopped')
         else:
             raise Exception('Cant stop because there is no recorded instanceId')
@@ -175,5 +200,6 @@ class GameMaster(object):
             resp = self._post(url)
             if self._parse_starting_info(resp):
                 print('Resumed')
+                self._start_update_thread()
         else:
             raise Exception('Cant resume because there is no recorded instanceId')
@@ -0,0 +1,46 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from stockfighter import config
+
+_session = None
+_lock = threading.Lock()
+_throttled_until = 0.
+
+
+def _on_response(response, *args, **kwargs):
+    # Rate limited : every REST poller holds back until Retry-After (or 1s) has passed
+    global _throttled_until
+    if response.status_code == 429:
+        try:
+            retry_after = float(response.headers.get('Retry-After', 1))
+        except ValueError:
+            retry_after = 1.
+        _throttled_until = max(_throttled_until, time.time() + retry_after)
+
+
+def throttled_for():
+    # Seconds before the API accepts requests again, 0 if it is not rate limiting us
+    return max(_throttled_until - time.time(), 0.)
+
+
+def get_session():
+    """
+        requests.Session shared by every object talking to the REST API
+            - keeps connections alive, so orders do not pay a new TCP + TLS handshake each
+            - pool size is read from config.ini ([http] pool_size), defaults to 20
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            pool_size = config.getint('http', 'pool_size', fallback=20)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.hooks['response'].append(_on_response)
+            _session = session
+    return _session
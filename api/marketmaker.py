@@ -1,15 +1,18 @@
 import json
-import time
-import threading
-
-import requests
+from concurrent.futures import ThreadPoolExecutor
 
 from stockfighter import config
+from stockfighter.lib.latency import recorder
+from stockfighter.lib.scheduler import get_scheduler
+from .http import get_session
+from .orders import (ORDER_TYPE, account_orders_path, api_headers, build_order, order_path, parse_order_response,
+                     resolve_target)
+from .supervisor import WebSocketSupervisor
+from .tickdata import TickRecorder
+from .urls import api_url
 from .venue import StockFighterTrader
 from .websockets import WebSocketListenerQuotes, WebSocketListenerFills
 
-API_KEY = config.get('api', 'APIKEY')
-
 
 class MarketBroker(object):
     """
@@ -18,54 +21,80 @@ class MarketBroker(object):
             - MarketMaker expects that the GameMaster instance has already started a level
 
         Public Methods / Attributes:
-            - order_book                : dict. Current Bid Ask on the stock
-            - all_orders_in_stock       : list of dicts. All the orders of our account in the stock
+            - order_book                : OrderBook. Local full depth order book on the stock
+            - all_orders_in_stock       : list of dicts. All the orders of our account in the stock (polled)
+            - stop()                    : stops the polling jobs
             - get_spread()              : method, returning DataFame. Historical Bid / Ask
             - get_latest_quote_time()   : method, returning arrow time.  of the latest quote.
             - get_quote()               : method, returning DataFame. Timeserie of trades
+            - subscribe_fills(callback) : callback is called with every execution message, as it arrives
+            - subscribe_quotes(callback): callback is called with every tickertape message, as it arrives
+            - unsubscribe(callback)     : stops calling a callback given to subscribe_quotes / subscribe_fills
+            - record(root)              : TickRecorder, streams the tickertape and executions to disk
+            - health()                  : dict, connection health of the websockets (see WebSocketSupervisor)
 
         Private Methods :
             - _buy / _sell / _cancel / _post_send_order     : order management
-            -
+            - _submit_many / _cancel_many                   : batches of orders, sent concurrently
 
     """
-    _ORDER_TYPE = ('limit', 'market', 'fill-or-kill', 'immediate-or-cancel')
+    _ORDER_TYPE = ORDER_TYPE
 
-    def __init__(self, gm=None, update=3):
+    def __init__(self, gm=None, update=3, venue=None, stock=None, feed=None, store=None):
+        """
+            venue / stock   : default to the first venue / ticker of the level
+            feed            : VenueFeed. Market data comes from the venue-wide websockets it shares
+                                between brokers (see MultiMarketBroker), instead of per stock websockets
+            store           : where the tickertape quotes are kept, defaults to a QuoteStore
+                                (SharedQuoteStore : readable from other processes, see FeedProcess)
+        """
         # Extracts info from gamemaster
-        if gm and gm.ready:
+        self._venue, self._stock, self._account = resolve_target(gm, venue, stock)
+        if gm:
             self._gm = gm
-            self._venue = gm.venues[0]
-            self._stock = gm.tickers[0]
-            self._account = gm.account
             self._db = gm._db
-        elif gm and not gm.ready:
-            raise Exception('GameMaster Not Ready')
-        else:
-            self._venue = 'TESTEX'
-            self._stock = 'FOOBAR'
-            self._account = 'EXB123456'
 
         # Instanciate a StockFighterTrade. Checks health of sf
         self._sft = StockFighterTrader(self._venue, self._stock)
         # Genetic API data
-        self._headers = {
-            'X-Starfighter-Authorization': API_KEY
-                        }
-        order_url = "https://api.stockfighter.io/ob/api/venues/{venue}/stocks/{stock}/orders"
-        self.__order_url = order_url.format(venue=self._venue, stock=self._stock)
-
-        # Start a websocket listener for quotes
-        self._wsq = WebSocketListenerQuotes(self)
-        # # Creates a websocket connection for fills
-        self._wsf = WebSocketListenerFills(self)
-
-        # Starts polling loop
-        self.all_orders_in_stock = dict()
+        self._headers = api_headers()
+        self._api_url = api_url()
+        self.__order_url = self._api_url + order_path(self._venue, self._stock)
+
+        if feed is None:
+            # Start a websocket listener for quotes
+            self._wsq = WebSocketListenerQuotes(self, data=store)
+            # # Creates a websocket connection for fills
+            self._wsf = WebSocketListenerFills(self)
+        else:
+            self._wsq, self._wsf = feed.channels(self._stock)
+        # The local order book is updated between snapshots by quotes and our fills
+        self.subscribe_quotes(self.__on_quote_for_book)
+        self.subscribe_fills(self._sft.order_book.on_fill)
+        # Order latency instrumentation (no-op unless enabled)
+        self.subscribe_fills(recorder.on_fill)
+
+        # Reconnects the websockets with backoff, and backfills what was missed while disconnected
+        self._supervisor = None
+        if feed is None and config.getboolean('websocket', 'supervise', fallback=True):
+            self._supervisor = WebSocketSupervisor(self)
+            self._supervisor.start()
+
+        # Used to send batches of orders concurrently, over the shared connection pool
+        self._executor = ThreadPoolExecutor(max_workers=config.getint('http', 'pool_size', fallback=20))
+
+        # Polls our orders. While the fills websocket is healthy, executions come through it :
+        #   polling slows down to [scheduler] idle_poll seconds, plus one poll after our own order bursts
+        self.all_orders_in_stock = None
         self.__update = update
-        thrd = threading.Thread(target=self.__loop)
-        thrd.daemon = True
-        thrd.start()
+        self.__idle_update = config.getfloat('scheduler', 'idle_poll', fallback=30)
+        self._feed = feed
+        if feed is None:
+            self.__orders_job = get_scheduler().add('orders-{}-{}'.format(self._venue, self._stock),
+                                                    self.__poll_orders, interval=update)
+        else:
+            # one poll of the whole venue, for every broker of the feed
+            self.__orders_job = feed.orders_job(self, get_scheduler(), update, self.__idle_update)
 
         print('Market Maker for stock {} initiated'.format(self._stock))
 
@@ -73,27 +102,27 @@ class MarketBroker(object):
         Standard API helpers
     """
     def __get_response(self, url):
-        res = requests.get(url, headers=self._headers)
+        res = get_session().get(url, headers=self._headers)
         return res.json()
 
     def __post_json(self, url, data):
-        res = requests.post(url, data=json.dumps(data), headers=self._headers)
+        res = get_session().post(url, data=json.dumps(data), headers=self._headers)
         return res.json()
 
     def __delete(self, url):
-        res = requests.delete(url, headers=self._headers)
+        res = get_session().delete(url, headers=self._headers)
         return res.json()
 
     def __check_websocket_quotes_health(self):
-        if not self._wsq.ws.live:
-            data = self._wsq.ws.data.copy()
-            self._wsq = WebSocketListenerQuotes(self, data)
+        # The supervisor reconnects in the background : this only matters when it is off.
+        #   With a VenueFeed, the connection belongs to the feed and its venue supervisor
+        if not self._wsq.webs.live and self._supervisor is None and self._feed is None:
+            self._wsq.reconnect()
             print('WebSocketListenerQuotes restarted')
 
     def __check_websocket_fills_health(self):
-        if not self._wsf.ws.live:
-            data = self._wsf.ws.data.copy()
-            self._wsf = WebSocketListenerFills(self, data)
+        if not self._wsf.webs.live and self._supervisor is None and self._feed is None:
+            self._wsf.reconnect()
             print('WebSocketListenerFills restarted')
 
     """
@@ -109,15 +138,48 @@ class MarketBroker(object):
 
     @property
     def order_book(self):
+        # OrderBook, local full depth order book
         return self._sft.order_book
 
+    def __on_quote_for_book(self, msg):
+        if msg.get('ok'):
+            self._sft.order_book.on_quote(msg.get('quote'))
+
     # def quote(self):  ## Still usefull ??
     #     return self._sft.get_quote(self._stock)
 
     def _get_fills_ws(self):
-        # Data from the Fills websocket
+        # FillLog of the Fills websocket
         self.__check_websocket_fills_health()
-        return self._wsf.ws.data
+        return self._wsf.webs.data
+
+    def subscribe_fills(self, callback):
+        # callback(msg) is called on every execution message, as soon as it arrives
+        return self._wsf.subscribe(callback)
+
+    def subscribe_quotes(self, callback):
+        # callback(msg) is called on every tickertape message, as soon as it arrives
+        return self._wsq.subscribe(callback)
+
+    def unsubscribe(self, callback):
+        # removes a callback given to subscribe_quotes / subscribe_fills
+        self._wsq.unsubscribe(callback)
+        self._wsf.unsubscribe(callback)
+
+    def health(self):
+        if self._feed is not None:
+            return self._feed.supervisor.health()
+        if self._supervisor is None:
+            return {'quotes': {'connected': self._wsq.webs.live}, 'fills': {'connected': self._wsf.webs.live}}
+        return self._supervisor.health()
+
+    def record(self, root=None):
+        # Records the tickertape and executions of this session to disk, until recorder.close()
+        gm = getattr(self, '_gm', None)
+        recorder = TickRecorder(self._venue, self._stock, gm._instanceId if gm else None, root=root)
+        self.subscribe_quotes(recorder.on_quote)
+        self.subscribe_fills(recorder.on_fill)
+        return recorder
 
     def get_latest_quote_time(self):
         # arrow time of the latest quote
@@ -128,6 +190,11 @@ class MarketBroker(object):
         # Get data on the latest quote
         return self._wsq.get_quote()
 
+    @property
+    def store(self):
+        # QuoteStore of the tickertape quotes
+        return self._wsq.store
+
     """
         Sends buy / sell orders
             - Will parse and store the execution result
@@ -135,34 +202,23 @@ class MarketBroker(object):
     """
 
     def __post_send_order(self, qty, price, order_type, direction):
-        if order_type not in self._ORDER_TYPE:
-            raise Exception('order_type must be on of : [{}]'.format(', '.join(self._ORDER_TYPE)))
-
-        if order_type != 'market' and not price:
-            raise Exception('need a price for order_type {}'.format(order_type))
-
-        order = {
-            'account':   self._account,
-            'venue':     self._venue,
-            'stock':     self._stock,
-            'price':     int(price),
-            'qty':       int(qty),
-            'direction': direction,
-            'orderType': order_type,
-        }
+        token = recorder.start(order_type, direction)
+        order = build_order(self._account, self._venue, self._stock, qty, price, order_type, direction)
 
         if qty > 0:
+            recorder.mark(token, 'sent')
             res = self.__post_json(self.__order_url, order)
+            recorder.mark(token, 'response')
         else:
             print('Qty passed {} - not sending {} order'.format(qty, direction))
             res = dict()
 
-        if res.get('ok'):
-            return res
-        elif res.get('error'):
-            raise Exception('Order did not go through. API returned {}'.format(res.get('error')))
-        else:
-            return None
+        res = parse_order_response(res)
+        if res:
+            self.__orders_changed()
+            if token is not None:
+                recorder.bind(token, res.get('id'), closed=not res.get('open', True))
+        return res
 
     def _buy(self, qty, price=None, order_type='limit'):
         """
@@ -189,40 +245,80 @@ class MarketBroker(object):
             Cancels order of id `oid`.
             Adds the execution result to self.closedorders
         """
-        url = "https://api.stockfighter.io/ob/api/venues/{venue}/stocks/{stock}/orders/{order}"
-        url = url.format(venue=self._venue, stock=self._stock, order=oid)
-        res = self.__delete(url)
+        res = self.__delete(self._api_url + order_path(self._venue, self._stock, oid))
+        recorder.forget(oid)
+        self.__orders_changed()
         return res
 
+    @staticmethod
+    def __outcome(future):
+        # (result, None) if the call went through, (None, exception) otherwise
+        try:
+            return future.result(), None
+        except Exception as e:
+            return None, e
+
+    def _submit_many(self, orders):
+        """
+            Sends several orders concurrently. Latency is the one of the slowest order, not the sum.
+            input :
+                orders  : list of dicts, with keys direction, qty, price & order_type (default limit)
+            returns a list of (response, error) tuples, in the same order as `orders`
+        """
+        futures = [
+            self._executor.submit(self.__post_send_order, order.get('qty'), order.get('price'),
+                                  order.get('order_type', 'limit'), order.get('direction'))
+            for order in orders
+        ]
+        return [self.__outcome(future) for future in futures]
+
+    def _cancel_many(self, oids):
+        """
+            Cancels several orders concurrently
+            returns a list of (response, error) tuples, in the same order as `oids`
+        """
+        futures = [self._executor.submit(self._cancel, oid) for oid in oids]
+        return [self.__outcome(future) for future in futures]
+
     """
-        API calls to get order status. Currently not used as the websocket seems to be providing
-            similar results faster.
+        API calls to get order status. The fills websocket provides similar results faster :
+            REST polling is the fallback when it is down.
     """
-    def __loop(self):
-        self.all_orders_in_stock = None
-        while True:
-            self.all_orders_in_stock = self._get_all_orders_in_stock()
-            time.sleep(self.__update)
+    def __fills_healthy(self):
+        return self._wsf.webs.live and self._wsf.webs.opened
+
+    def __poll_orders(self):
+        self.all_orders_in_stock = self._get_all_orders_in_stock()
+        return self.__idle_update if self.__fills_healthy() else self.__update
+
+    def __orders_changed(self):
+        # Coalesced : a burst of orders / cancels gives a single poll
+        get_scheduler().trigger(self.__orders_job, delay=0.2)
+
+    def stop(self):
+        # Stops the polling jobs of this MarketBroker (websockets stay open)
+        if self._feed is None:
+            get_scheduler().remove(self.__orders_job)
+        self._sft.stop()
+        if self._supervisor is not None:
+            self._supervisor.stop()
 
     def _get_order_status(self, oid):
-        url = "https://api.stockfighter.io/ob/api/venues/{venue}/stocks/{stock}/orders/{oid}"
-        res = self.__get_response(url.format(venue=self._venue, stock=self._stock, oid=oid))
+        res = self.__get_response(self._api_url + order_path(self._venue, self._stock, oid))
         if res.get('ok'):
             return res
         else:
             raise Exception('Didnt get proper data from get_order_status')
 
     def _get_all_orders_in_stock(self):
-        url = "https://api.stockfighter.io/ob/api/venues/{venue}/accounts/{account}/stocks/{stock}/orders"
-        res = self.__get_response(url.format(venue=self._venue, stock=self._stock, account=self._account))
+        res = self.__get_response(self._api_url + account_orders_path(self._venue, self._account, self._stock))
         if res.get('ok'):
             return res.get('orders')
         else:
             raise Exception('Didnt get proper data from get_all_orders_in_stock')
 
     def _get_all_orders(self):
-        url = "https://api.stockfighter.io/ob/api/venues/{venue}/accounts/{account}/orders"
-        res = self.__get_response(url.format(venue=self._venue, account=self._account))
+        res = self.__get_response(self._api_url + account_orders_path(self._venue, self._account))
         if res.get('ok'):
             return res.get('orders')
         else:
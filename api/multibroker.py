@@ -0,0 +1,241 @@
+import itertools
+import queue
+
+from stockfighter.lib.scheduler import get_scheduler
+from .decoding import QuoteRecord, decode_quote
+from .fills import FillLog
+from .marketmaker import MarketBroker
+from .store import QuoteStore
+from .supervisor import WebSocketSupervisor
+from .urls import ws_url
+from .websockets import ThreadedWebSocket, QuoteReader
+
+
+class _SymbolWebs(object):
+    """
+        What a MarketBroker reads on `listener.webs`, for one symbol of a venue-wide websocket :
+            its own data and subscribers, the connection state of the shared websocket
+    """
+    def __init__(self, parent, data):
+        self._parent = parent
+        self.data = data
+        self.subscribers = []
+
+    live = property(lambda self: self._parent.webs.live)
+    opened = property(lambda self: self._parent.webs.opened)
+    messages = property(lambda self: self._parent.webs.messages)
+    last_message = property(lambda self: self._parent.webs.last_message)
+
+
+class _SymbolChannel(object):
+    """
+        One symbol of a venue-wide websocket, with the interface of a per stock listener :
+            webs (data, subscribers, live), subscribe / subscribe_queue / unsubscribe, reconnect
+    """
+    def __init__(self, parent, data):
+        self._parent = parent
+        self.webs = _SymbolWebs(parent, data)
+
+    @property
+    def subscribers(self):
+        return self.webs.subscribers
+
+    def subscribe(self, callback):
+        self.webs.subscribers.append(callback)
+        return callback
+
+    def subscribe_queue(self, maxsize=0):
+        messages = queue.Queue(maxsize)
+        self.subscribe(messages.put)
+        return messages
+
+    def unsubscribe(self, callback):
+        if callback in self.webs.subscribers:
+            self.webs.subscribers.remove(callback)
+
+    def reconnect(self):
+        # The connection is the venue's : the venue supervisor reconnects it
+        pass
+
+
+class SymbolQuotes(_SymbolChannel, QuoteReader):
+    # Quotes of one symbol, demultiplexed from the venue tickertape
+    def __init__(self, parent, store=None):
+        store = store if store is not None else QuoteStore()
+        _SymbolChannel.__init__(self, parent, store)
+        QuoteReader.__init__(self, store)
+
+
+class SymbolFills(_SymbolChannel):
+    # Executions of one symbol, demultiplexed from the venue executions websocket
+    def __init__(self, parent, fills=None):
+        _SymbolChannel.__init__(self, parent, fills if fills is not None else FillLog())
+
+
+class _Router(object):
+    """
+        `webs.data` of a venue-wide websocket : routes each message to the channel of its symbol,
+            and calls that channel's subscribers. Messages of symbols nobody asked for are dropped.
+    """
+    def __init__(self):
+        self.channels = {}
+
+    def route(self, symbol, item, msg):
+        channel = self.channels.get(symbol)
+        if channel is not None:
+            channel.webs.data.append(item)
+            ThreadedWebSocket._dispatch(channel.webs, msg)
+
+    def latest(self, oid):
+        # FillLog.latest, over every symbol (order ids are unique on a venue)
+        for channel in self.channels.values():
+            latest = channel.webs.data.latest(oid)
+            if latest is not None:
+                return latest
+        return None
+
+
+class VenueQuotes(ThreadedWebSocket):
+    """
+        Venue-wide tickertape : one connection for every symbol of the venue
+    """
+    def __init__(self, account, venue):
+        url = '{base}/{account}/venues/{venue}/tickertape'.format(base=ws_url(), account=account, venue=venue)
+        ThreadedWebSocket.__init__(self, url, _Router())
+
+    decode = staticmethod(decode_quote)
+
+    @staticmethod
+    def handle(webs, msg):
+        if msg.get('ok'):
+            quote = msg.get('quote')
+            webs.data.route(quote.get('symbol'), quote, msg)
+        ThreadedWebSocket._dispatch(webs, msg)
+
+
+class VenueFills(ThreadedWebSocket):
+    """
+        Venue-wide executions websocket : one connection for every symbol of the venue
+    """
+    def __init__(self, account, venue):
+        url = '{base}/{account}/venues/{venue}/executions'.format(base=ws_url(), account=account, venue=venue)
+        ThreadedWebSocket.__init__(self, url, _Router())
+
+    @staticmethod
+    def handle(webs, msg):
+        webs.data.route(msg.get('symbol'), msg, msg)
+        ThreadedWebSocket._dispatch(webs, msg)
+
+
+class VenueFeed(object):
+    """
+        Websockets of one venue, shared by the MarketBrokers of its symbols
+            - channels(stock)   : (SymbolQuotes, SymbolFills) of a symbol, used by MarketBroker as _wsq / _wsf
+            - orders_job(mb)    : one scheduler job polls our orders on the whole venue, for every broker
+            - supervisor        : reconnects / backfills the two venue websockets
+    """
+    def __init__(self, account, venue):
+        self._account = account
+        self._venue = venue
+        self._stock = venue     # label of the supervisor job
+        self._wsq = VenueQuotes(account, venue)
+        self._wsf = VenueFills(account, venue)
+        self._brokers = {}
+        self._job = None
+        self.supervisor = _VenueSupervisor(self)
+
+    def channels(self, stock):
+        if stock not in self._wsq.webs.data.channels:
+            self._wsq.webs.data.channels[stock] = SymbolQuotes(self._wsq)
+            self._wsf.webs.data.channels[stock] = SymbolFills(self._wsf)
+        return self._wsq.webs.data.channels[stock], self._wsf.webs.data.channels[stock]
+
+    """
+        What the supervisor and the orders job need, over the whole venue
+    """
+    @property
+    def _sft(self):
+        return next(iter(self._brokers.values()))._sft
+
+    def _get_all_orders_in_stock(self):
+        return next(iter(self._brokers.values()))._get_all_orders()
+
+    def orders_job(self, mb, scheduler, update, idle_update):
+        self._brokers[mb._stock] = mb
+        if self._job is None:
+            def poll():
+                orders = self._get_all_orders_in_stock()
+                for stock, broker in self._brokers.items():
+                    broker.all_orders_in_stock = [order for order in orders if order.get('symbol') == stock]
+                healthy = self._wsf.webs.live and self._wsf.webs.opened
+                return idle_update if healthy else update
+            self._job = scheduler.add('orders-{}'.format(self._venue), poll, interval=update)
+        return self._job
+
+
+class _VenueSupervisor(WebSocketSupervisor):
+    # After a reconnection, fetches the current quote of every symbol of the venue
+    def _backfill_quotes(self, listener):
+        count = 0
+        for stock in list(listener.webs.data.channels):
+            res = self._mb._sft._get_quote(stock)
+            if res.get('ok'):
+                listener.handle(listener.webs, {'ok': True, 'quote': QuoteRecord(res), 'backfill': True})
+                count += 1
+        return count
+
+
+class MultiMarketBroker(object):
+    """
+        MarketBrokers for several symbols / venues, over venue-wide websockets :
+            two websocket connections per venue, whatever the number of symbols. Every broker
+            shares the HTTP connection pool and the scheduler.
+
+        Usage :
+            MMB = MultiMarketBroker(gm=GM)                  # every venue x ticker of the level
+            MMB = MultiMarketBroker(gm=GM, symbols=[('TESTEX', 'FOOBAR'), ('TESTEX', 'BARFOO')])
+            MB = MMB['FOOBAR']                              # or MMB['TESTEX', 'FOOBAR']
+            TB = TraderBook(MB)
+
+        Public Methods / Attributes:
+            - brokers               : dict (venue, stock) -> MarketBroker
+            - feeds                 : dict venue -> VenueFeed
+            - __getitem__(key)      : MarketBroker of a stock (or of a (venue, stock))
+            - health()              : dict venue -> connection health of its websockets
+            - stop()                : stops the polling jobs
+    """
+    def __init__(self, gm=None, symbols=None, update=3):
+        if gm and not gm.ready:
+            raise Exception('GameMaster Not Ready')
+        if symbols is None:
+            symbols = list(itertools.product(gm.venues, gm.tickers)) if gm else [('TESTEX', 'FOOBAR')]
+        account = gm.account if gm else 'EXB123456'
+
+        self.feeds = {}
+        self.brokers = {}
+        for venue, stock in symbols:
+            if venue not in self.feeds:
+                self.feeds[venue] = VenueFeed(account, venue)
+            self.brokers[(venue, stock)] = MarketBroker(gm=gm, update=update, venue=venue, stock=stock,
+                                                        feed=self.feeds[venue])
+        for feed in self.feeds.values():
+            feed.supervisor.start()
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self.brokers[key]
+        matches = [broker for (venue, stock), broker in self.brokers.items() if stock == key]
+        if len(matches) != 1:
+            raise KeyError('{} : {} brokers, pass (venue, stock)'.format(key, len(matches)))
+        return matches[0]
+
+    def health(self):
+        return {venue: feed.supervisor.health() for venue, feed in self.feeds.items()}
+
+    def stop(self):
+        for broker in self.brokers.values():
+            broker.stop()
+        for feed in self.feeds.values():
+            feed.supervisor.stop()
+            if feed._job is not None:
+                get_scheduler().remove(feed._job)
@@ -0,0 +1,178 @@
+import threading
+from bisect import bisect_left, bisect_right
+
+
+class BookSide(object):
+    """
+        One side of the order book
+            - price levels are kept sorted, best first (bisect-indexed)
+            - best price / depth at a price are O(1), cumulative depth is O(log n)
+                (cumulative quantities are rebuilt lazily after an update)
+    """
+    def __init__(self, is_bid):
+        self._sign = -1 if is_bid else 1    # keys are sorted ascending : bids are stored as -price
+        self._keys = []
+        self._qty = {}
+        self._cum = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def clear(self):
+        self._keys = []
+        self._qty = {}
+        self._cum = None
+
+    def set(self, price, qty):
+        # Sets the quantity at a price level. qty <= 0 removes the level
+        key = self._sign * price
+        if qty > 0:
+            if price not in self._qty:
+                self._keys.insert(bisect_left(self._keys, key), key)
+            self._qty[price] = qty
+        elif price in self._qty:
+            del self._qty[price]
+            del self._keys[bisect_left(self._keys, key)]
+        self._cum = None
+
+    def remove_better_than(self, price):
+        # Removes the levels strictly better than `price` (they have been traded through)
+        idx = bisect_left(self._keys, self._sign * price)
+        for key in self._keys[:idx]:
+            del self._qty[self._sign * key]
+        del self._keys[:idx]
+        self._cum = None
+
+    def best(self):
+        return self._sign * self._keys[0] if self._keys else None
+
+    def depth_at(self, price):
+        return self._qty.get(price, 0)
+
+    def cumulative_depth(self, price):
+        # Quantity available at `price` or better
+        if self._cum is None:
+            total, cum = 0, []
+            for key in self._keys:
+                total += self._qty[self._sign * key]
+                cum.append(total)
+            self._cum = cum
+        idx = bisect_right(self._keys, self._sign * price)
+        return self._cum[idx - 1] if idx else 0
+
+    def levels(self):
+        # list of {'price', 'qty'} dicts, best first (same format as the REST order book)
+        return [{'price': self._sign * key, 'qty': self._qty[self._sign * key]} for key in self._keys]
+
+
+class OrderBook(object):
+    """
+        Local full depth order book of one stock
+            - seeded from REST snapshots (StockFighterTrader._order_book)
+            - updated between snapshots from tickertape quotes (best bid / ask and their size)
+                and from our own fills
+            - drift : number of updates since the last snapshot that did not match the local book.
+                next_interval() uses it to decide when the next snapshot is needed
+
+        Public Methods :
+            - best_bid() / best_ask()           : best prices, None if the side is empty
+            - depth_at(price, side)             : quantity at a price level. side is 'bids' or 'asks'
+            - cumulative_depth(price, side)     : quantity at `price` or better
+            - get('bids') / get('asks')         : list of levels, as in the REST order book (best first)
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.bids = BookSide(is_bid=True)
+        self.asks = BookSide(is_bid=False)
+        self.ts = None
+        self.drift = 0
+        self.updates = 0
+
+    def _side(self, side):
+        return self.bids if side in ('bids', 'buy') else self.asks
+
+    """
+        Updates
+    """
+    def load_snapshot(self, snapshot):
+        # snapshot : dict, as returned by the REST order book endpoint
+        with self._lock:
+            for side, levels in ((self.bids, snapshot.get('bids')), (self.asks, snapshot.get('asks'))):
+                side.clear()
+                for level in levels or []:
+                    side.set(level.get('price'), side.depth_at(level.get('price')) + level.get('qty'))
+            self.ts = snapshot.get('ts')
+            self.drift = 0
+            self.updates = 0
+
+    def _apply_best(self, side, price, size):
+        """
+            The quote gives the best price of a side and its size :
+                better levels are gone, and the size of the best level is known
+        """
+        if price is None:
+            if len(side):
+                self.drift += 1
+            side.clear()
+            return
+        if side.depth_at(price) != size:
+            self.drift += 1
+        side.remove_better_than(price)
+        side.set(price, size)
+
+    def on_quote(self, quote):
+        # quote : dict, the `quote` of a tickertape message
+        with self._lock:
+            self._apply_best(self.bids, quote.get('bid'), quote.get('bidSize', 0))
+            self._apply_best(self.asks, quote.get('ask'), quote.get('askSize', 0))
+            self.updates += 1
+
+    def on_fill(self, msg):
+        """
+            msg : execution message of one of our orders.
+                The standing order of the trade lost `filled` shares at the trade price
+        """
+        order = msg.get('order') or {}
+        if order.get('id') is None:
+            return
+        standing = msg.get('standingId') == order.get('id')
+        if standing:
+            side = self._side(order.get('direction'))
+        else:
+            side = self._side('sell' if order.get('direction') == 'buy' else 'buy')
+
+        with self._lock:
+            price = msg.get('price')
+            side.set(price, side.depth_at(price) - (msg.get('filled') or 0))
+            self.updates += 1
+
+    def next_interval(self, min_interval, max_interval):
+        # Seconds before the next snapshot : the more the local book drifted, the sooner
+        return max(min_interval, max_interval / (1. + self.drift))
+
+    """
+        Reads
+    """
+    def best_bid(self):
+        return self.bids.best()
+
+    def best_ask(self):
+        return self.asks.best()
+
+    def depth_at(self, price, side):
+        return self._side(side).depth_at(price)
+
+    def cumulative_depth(self, price, side):
+        with self._lock:
+            return self._side(side).cumulative_depth(price)
+
+    def get(self, key, default=None):
+        # Same access as the dict returned by the REST order book (used by format_order_book)
+        with self._lock:
+            if key == 'bids':
+                return self.bids.levels()
+            elif key == 'asks':
+                return self.asks.levels()
+            elif key == 'ts':
+                return self.ts
+        return default
@@ -0,0 +1,76 @@
+"""
+    What MarketBroker and AsyncMarketBroker share : the venue / stock / account they trade on,
+        the request headers, the order paths, order building and response parsing
+"""
+from stockfighter import config
+
+ORDER_TYPE = ('limit', 'market', 'fill-or-kill', 'immediate-or-cancel')
+DIRECTION = ('buy', 'sell')
+
+
+def build_order(account, venue, stock, qty, price, order_type, direction):
+    """
+        Validates the order and returns the dict to be posted
+            price   : int, price x 100. Can be None for market orders
+    """
+    if order_type not in ORDER_TYPE:
+        raise Exception('order_type must be on of : [{}]'.format(', '.join(ORDER_TYPE)))
+
+    if direction not in DIRECTION:
+        raise Exception('direction must be on of : [{}]'.format(', '.join(DIRECTION)))
+
+    if order_type != 'market' and not price:
+        raise Exception('need a price for order_type {}'.format(order_type))
+
+    return {
+        'account':   account,
+        'venue':     venue,
+        'stock':     stock,
+        'price':     int(price or 0),
+        'qty':       int(qty),
+        'direction': direction,
+        'orderType': order_type,
+    }
+
+
+def parse_order_response(res):
+    # Returns the response if the order went through, raises if the API returned an error
+    if res.get('ok'):
+        return res
+    elif res.get('error'):
+        raise Exception('Order did not go through. API returned {}'.format(res.get('error')))
+    else:
+        return None
+
+
+def resolve_target(gm, venue=None, stock=None):
+    """
+        (venue, stock, account) of a broker : the level of a ready GameMaster (its first venue / ticker
+            unless given), the test exchange without a GameMaster
+    """
+    if gm and gm.ready:
+        return venue or gm.venues[0], stock or gm.tickers[0], gm.account
+    elif gm and not gm.ready:
+        raise Exception('GameMaster Not Ready')
+    else:
+        return venue or 'TESTEX', stock or 'FOOBAR', 'EXB123456'
+
+
+def api_headers():
+    return {
+        'X-Starfighter-Authorization': config.get('api', 'APIKEY')
+    }
+
+
+# Paths of the order endpoints, relative to the api url
+def order_path(venue, stock, oid=None):
+    # orders of a stock (POST), or one order (GET status / DELETE)
+    path = '/venues/{venue}/stocks/{stock}/orders'.format(venue=venue, stock=stock)
+    return path if oid is None else '{}/{}'.format(path, oid)
+
+
+def account_orders_path(venue, account, stock=None):
+    # all the orders of an account on a venue, or in one stock
+    if stock is None:
+        return '/venues/{venue}/accounts/{account}/orders'.format(venue=venue, account=account)
+    return '/venues/{venue}/accounts/{account}/stocks/{stock}/orders'.format(venue=venue, account=account, stock=stock)
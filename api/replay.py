@@ -0,0 +1,134 @@
+import threading
+import time
+
+from .fills import FillLog
+from .orderbook import OrderBook
+from .store import QuoteStore
+from .tickdata import SessionReader
+from .websockets import QuoteReader, ThreadedWebSocket
+
+
+class ReplayBroker(QuoteReader):
+    """
+        Feeds a recorded session (see TickRecorder) back through the market data side of the
+            MarketBroker interface, for strategy research.
+            - tickertape and execution messages are replayed in the order they were received,
+                `speed` times faster than recorded (speed=None : as fast as possible)
+            - subscribers, the quote store, the FillLog and the local order book are updated
+                as they would be by the websockets
+            - orders can not be sent : _buy / _sell / _cancel raise
+
+        Usage :
+            RB = ReplayBroker(SessionReader.open('TESTEX', 'FOOBAR', 'local'), speed=10)
+            RB.subscribe_quotes(strategy.on_quote)
+            RB.start()
+            RB.wait()
+
+        Public Methods / Attributes, as in MarketBroker :
+            - get_spread() / get_histo() / current_quote() / get_latest_quote_time()
+            - order_book, subscribe_quotes(callback), subscribe_fills(callback), unsubscribe(callback), _get_fills_ws()
+        Replay :
+            - start() / stop() / wait(timeout) / run()  : run() replays on the calling thread
+            - done                                      : threading.Event, set at the end of the session
+    """
+    def __init__(self, session, speed=1., store=None):
+        if not isinstance(session, SessionReader):
+            session = SessionReader(session)
+        self._session = session
+        self._venue = session.venue
+        self._stock = session.stock
+        self.speed = speed
+        self.done = threading.Event()
+        self.all_orders_in_stock = []
+
+        QuoteReader.__init__(self, store if store is not None else QuoteStore())
+        self._fills = FillLog()
+        self._order_book = OrderBook()
+        self._quote_feed = _Feed([self.__on_quote_for_book])
+        self._fill_feed = _Feed([self._order_book.on_fill])
+        self._stopped = False
+        self._thread = None
+
+    """
+        Market Data, as in MarketBroker
+    """
+    def get_histo(self):
+        return self.get_data()
+
+    @property
+    def order_book(self):
+        return self._order_book
+
+    def __on_quote_for_book(self, msg):
+        if msg.get('ok'):
+            self._order_book.on_quote(msg.get('quote'))
+
+    def _get_fills_ws(self):
+        return self._fills
+
+    def subscribe_fills(self, callback):
+        self._fill_feed.subscribers.append(callback)
+        return callback
+
+    def subscribe_quotes(self, callback):
+        self._quote_feed.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        for feed in (self._quote_feed, self._fill_feed):
+            if callback in feed.subscribers:
+                feed.subscribers.remove(callback)
+
+    def current_quote(self):
+        return self.get_quote()
+
+    """
+        Orders
+    """
+    def __read_only(self, *args, **kwargs):
+        raise Exception('ReplayBroker replays recorded market data, it can not send orders')
+
+    _buy = _sell = _cancel = _submit_many = _cancel_many = __read_only
+
+    """
+        Replay
+    """
+    def __deliver(self, kind, msg):
+        if kind == 'quote':
+            self.store.append(msg.get('quote'))
+            ThreadedWebSocket._dispatch(self._quote_feed, msg)
+        else:
+            self._fills.append(msg)
+            ThreadedWebSocket._dispatch(self._fill_feed, msg)
+
+    def run(self):
+        start_wall, start_recv = None, None
+        for recv, kind, msg in self._session.messages():
+            if self._stopped:
+                break
+            if self.speed:
+                if start_wall is None:
+                    start_wall, start_recv = time.perf_counter(), recv
+                delay = (recv - start_recv) / 1e9 / self.speed - (time.perf_counter() - start_wall)
+                if delay > 0:
+                    time.sleep(delay)
+            self.__deliver(kind, msg)
+        self.done.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stopped = True
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+
+class _Feed(object):
+    # Stands for the websocket app in ThreadedWebSocket._dispatch : holds the subscribers
+    def __init__(self, subscribers):
+        self.subscribers = subscribers
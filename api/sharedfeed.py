@@ -0,0 +1,417 @@
+"""
+    Multi-process deployment : one feed process, any number of strategy processes
+
+    The feed process runs the MarketBroker (websockets, supervisor, polling) and the TraderBook :
+        - tickertape quotes are written to a SharedQuoteStore, execution messages to a SharedFillRing :
+            ring buffers in shared memory (multiprocessing.shared_memory), one writer, lock-free readers
+        - orders go through the OrderGateway : the feed process' TraderBook, served to other processes
+            (multiprocessing.managers). Every process shares one ledger, one risk engine, one database.
+
+    Strategy processes attach to the rings read-only, and read them without copying them (arrays()), or
+        through the MarketBroker market data interface (SharedMarketData) : analytics run on their own
+        cores, and never hold the feed process' GIL.
+
+    Usage :
+        # main process, once the level is started (GM.start) :
+        feed = FeedProcess()
+        feed.start()
+        # strategy processes, given feed.info (a picklable dict) :
+        md = SharedMarketData(feed.info)
+        md.subscribe_quotes(on_quote)
+        md.start()
+        gateway = connect_gateway(feed.info)
+        gateway.buy(10, 5000)
+"""
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing import shared_memory, resource_tracker
+from multiprocessing.managers import BaseManager
+
+import numpy as np
+
+from stockfighter import config
+from stockfighter.lib.timestamps import one_to_ns, now_ns, to_iso
+from .store import QuoteStore
+from .websockets import QuoteReader
+
+
+class SharedRing(object):
+    """
+        Ring buffer of numeric rows in shared memory, one array per field
+            - one writer (the process that created it), readers in any process, no lock :
+                a row is written, then the `total` counter of the header is moved past it
+            - readers copy the rows they want, then check `total` again : rows overwritten
+                meanwhile by the writer are dropped
+            - arrays() gives zero copy (read-only) views, for analytics on the whole ring
+
+        Public Methods / Attributes:
+            - append_row(values)    : writer only, values in the order of the fields
+            - since(mark, names)    : (columns, new_mark) of the rows appended after `mark`
+            - columns(names, rows)  : chronological copies of the last `rows` rows
+            - arrays()              : (dict name -> view on the ring, total). Row n is at n % capacity
+            - total / capacity / name
+            - close() / unlink()
+    """
+    _HEADER = 2     # total, capacity
+
+    def __init__(self, fields, capacity=None, name=None, create=True):
+        self._fields = tuple(fields)
+        self._names = [field for field, _ in self._fields]
+        if create:
+            size = 8 * (self._HEADER + int(capacity) * len(self._fields))
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self._shm = self._attach(name)
+        self._owner = create
+
+        self._header = np.ndarray(self._HEADER, dtype=np.int64, buffer=self._shm.buf)
+        if create:
+            self._header[:] = (0, int(capacity))
+        self.capacity = int(self._header[1])
+        self._cols = {}
+        for i, (field, dtype) in enumerate(self._fields):
+            offset = 8 * (self._HEADER + i * self.capacity)
+            col = np.ndarray(self.capacity, dtype=dtype, buffer=self._shm.buf, offset=offset)
+            if not create:
+                col.setflags(write=False)
+            self._cols[field] = col
+        self._col_list = [self._cols[field] for field in self._names]
+
+    @staticmethod
+    def _attach(name):
+        # Readers must not register the ring with the resource tracker : it would unlink it when they exit
+        try:
+            return shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13 has no track argument
+            register = resource_tracker.register
+            resource_tracker.register = lambda *args: None
+            try:
+                return shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def total(self):
+        return int(self._header[0])
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def append_row(self, values):
+        total = int(self._header[0])
+        pos = total % self.capacity
+        for col, value in zip(self._col_list, values):
+            col[pos] = value
+        self._header[0] = total + 1
+
+    def _read(self, start, stop, names):
+        """
+            Copies rows [start, stop). Returns (columns, first row kept) : the rows the writer
+                may have overwritten during the copy are dropped, with the one it may be writing
+                (row total - capacity, whose slot receives row total)
+        """
+        idx = np.arange(start, stop) % self.capacity
+        cols = {name: self._cols[name][idx] for name in names}
+        lost = self.total + 1 - self.capacity - start
+        if lost > 0:
+            cols = {name: col[lost:] for name, col in cols.items()}
+            start += lost
+        return cols, start
+
+    def since(self, mark, names=None):
+        names = self._names if names is None else names
+        total = self.total
+        cols, _ = self._read(max(mark, total - self.capacity), total, names)
+        return cols, total
+
+    def columns(self, names=None, rows=None):
+        names = self._names if names is None else names
+        total = self.total
+        count = len(self) if rows is None else min(int(rows), len(self))
+        cols, _ = self._read(total - count, total, names)
+        return cols
+
+    def arrays(self):
+        return dict(self._cols), self.total
+
+    def close(self):
+        self._header = self._cols = self._col_list = None
+        self._shm.close()
+
+    def unlink(self):
+        if self._owner:
+            self._shm.unlink()
+
+
+class SharedQuoteStore(SharedRing):
+    """
+        QuoteStore in shared memory : what a WebSocketListenerQuotes writes to, and a QuoteReader reads,
+            in another process. Times are converted to ns on append (the ring only holds numbers).
+
+        Public Methods / Attributes, as QuoteStore :
+            - append(quote) / columns(names, rows) / since(mark, names) / latest() / total / capacity
+    """
+    _FIELDS = QuoteStore._FIELDS
+
+    def __init__(self, capacity=None, name=None, create=True):
+        if create and capacity is None:
+            capacity = config.getint('store', 'capacity', fallback=100000)
+        SharedRing.__init__(self, self._FIELDS, capacity, name, create)
+
+    def append(self, quote):
+        get = quote.get
+        self.append_row((
+            one_to_ns(get('quoteTime')), get('bid', np.nan), get('ask', np.nan), get('bidSize', 0),
+            get('askSize', 0), get('last', np.nan), get('lastSize', 0), one_to_ns(get('lastTrade')),
+        ))
+
+    def latest(self):
+        total = self.total
+        if not total:
+            return None
+        cols, start = self._read(total - 1, total, self._names)
+        if start >= total:
+            return None
+        return {name: col[0].item() for name, col in cols.items()}
+
+
+class SharedFillRing(SharedRing):
+    """
+        Execution messages in shared memory, as numbers : enough for a PositionLedger / OrderIndex
+            - append(msg)           : writer, stores an execution message
+            - messages(mark)        : (execution messages appended after `mark`, new_mark), rebuilt as dicts
+    """
+    _FIELDS = (
+        ('recv', np.int64), ('id', np.int64), ('direction', np.int64), ('orderPrice', np.int64),
+        ('originalQty', np.int64), ('totalFilled', np.int64), ('open', np.int64),
+        ('price', np.int64), ('filled', np.int64), ('filledAt', np.int64),
+    )
+
+    def __init__(self, capacity=None, name=None, create=True, venue=None, stock=None):
+        SharedRing.__init__(self, self._FIELDS, capacity or 100000, name, create)
+        self.venue = venue
+        self.stock = stock
+
+    def append(self, msg):
+        order = msg.get('order') or {}
+        if order.get('id') is None:
+            return
+        self.append_row((
+            now_ns(), order.get('id'), 1 if order.get('direction') == 'buy' else -1, order.get('price') or 0,
+            order.get('originalQty') or 0, order.get('totalFilled') or 0, 1 if order.get('open') else 0,
+            msg.get('price') or 0, msg.get('filled') or 0, one_to_ns(msg.get('filledAt')),
+        ))
+
+    def messages(self, mark):
+        cols, mark = self.since(mark)
+        filled_at = to_iso(cols['filledAt'])
+        messages = []
+        for i in range(len(cols['id'])):
+            order = {
+                'id': int(cols['id'][i]), 'direction': 'buy' if cols['direction'][i] > 0 else 'sell',
+                'price': int(cols['orderPrice'][i]), 'originalQty': int(cols['originalQty'][i]),
+                'totalFilled': int(cols['totalFilled'][i]), 'open': bool(cols['open'][i]),
+                'venue': self.venue, 'symbol': self.stock,
+            }
+            messages.append({
+                'ok': True, 'venue': self.venue, 'symbol': self.stock, 'order': order,
+                'price': int(cols['price'][i]), 'filled': int(cols['filled'][i]), 'filledAt': filled_at[i],
+            })
+        return messages, mark
+
+
+class SharedMarketData(QuoteReader):
+    """
+        Market data side of the MarketBroker interface, in a strategy process, over the rings of a FeedProcess
+            - get_spread() / get_histo() / current_quote() / get_latest_quote_time() : QuoteReader, over the ring
+            - subscribe_quotes(callback) / subscribe_fills(callback) / unsubscribe(callback) : called from a
+                thread polling the rings every `poll` seconds. Quote messages hold times in ns.
+            - start() / stop()
+    """
+    def __init__(self, info, poll=0.0005):
+        QuoteReader.__init__(self, SharedQuoteStore(name=info['quotes'], create=False))
+        self._fills = SharedFillRing(name=info['fills'], create=False, venue=info['venue'], stock=info['stock'])
+        self._venue = info['venue']
+        self._stock = info['stock']
+        self.poll = poll
+        self._quote_subscribers = []
+        self._fill_subscribers = []
+        self._running = False
+        self._thread = None
+
+    def get_histo(self):
+        return self.get_data()
+
+    def current_quote(self):
+        return self.get_quote()
+
+    def subscribe_quotes(self, callback):
+        self._quote_subscribers.append(callback)
+        return callback
+
+    def subscribe_fills(self, callback):
+        self._fill_subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        for subscribers in (self._quote_subscribers, self._fill_subscribers):
+            if callback in subscribers:
+                subscribers.remove(callback)
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self._thread = threading.Thread(target=self.__loop, name='shared-feed')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    @staticmethod
+    def _dispatch(subscribers, msg):
+        for callback in list(subscribers):
+            try:
+                callback(msg)
+            except Exception as e:
+                print('Shared feed subscriber {} failed : {}'.format(callback, e))
+
+    def __loop(self):
+        store, fills = self.store, self._fills
+        quote_mark, fill_mark = store.total, fills.total
+        while self._running:
+            idle = True
+            if store.total != quote_mark:
+                idle = False
+                cols, quote_mark = store.since(quote_mark)
+                if self._quote_subscribers:
+                    names = list(cols)
+                    for row in zip(*(cols[name].tolist() for name in names)):
+                        self._dispatch(self._quote_subscribers, {'ok': True, 'quote': dict(zip(names, row))})
+            if fills.total != fill_mark:
+                idle = False
+                messages, fill_mark = fills.messages(fill_mark)
+                for msg in messages:
+                    self._dispatch(self._fill_subscribers, msg)
+            if idle:
+                time.sleep(self.poll)
+
+
+"""
+    Order gateway : the TraderBook of the feed process, served to the strategy processes
+"""
+_traderbook = None
+
+
+def _get_traderbook():
+    return _traderbook
+
+
+class OrderGateway(BaseManager):
+    pass
+
+
+OrderGateway.register('traderbook', callable=_get_traderbook, exposed=(
+    'buy', 'sell', 'cancel', 'submit_many', 'cancel_many', 'cancel_all', 'flush_old_orders',
+    'get_own_book', 'get_order', 'kill',
+))
+
+
+def connect_gateway(info):
+    """
+        Proxy of the feed process' TraderBook : buy / sell / cancel / submit_many / cancel_many / cancel_all /
+            flush_old_orders / get_own_book / get_order / kill. RiskLimitExceeded is raised as in the feed process.
+    """
+    manager = OrderGateway(address=tuple(info['gateway']), authkey=info['authkey'])
+    manager.connect()
+    return manager.traderbook()
+
+
+def _feed_main(conn, stop, capacity, fills_capacity, authkey):
+    # Body of the feed process
+    global _traderbook
+    from stockfighter import GameMaster, MarketBroker, StockDataBase, TraderBook
+
+    store = fills = None
+    ready = False
+    try:
+        gm = GameMaster(db=StockDataBase())
+        if not gm.ready:
+            conn.send({'error': 'GameMaster Not Ready : start a level before the feed process'})
+            return
+        store = SharedQuoteStore(capacity=capacity)
+        fills = SharedFillRing(capacity=fills_capacity, venue=gm.venues[0], stock=gm.tickers[0])
+        mb = MarketBroker(gm=gm, store=store)
+        mb.subscribe_fills(fills.append)
+        _traderbook = TraderBook(mb)
+
+        server = OrderGateway(address=('127.0.0.1', 0), authkey=authkey).get_server()
+        thrd = threading.Thread(target=server.serve_forever, name='order-gateway')
+        thrd.daemon = True
+        thrd.start()
+        conn.send({
+            'quotes': store.name, 'fills': fills.name, 'gateway': server.address, 'authkey': authkey,
+            'venue': mb._venue, 'stock': mb._stock, 'account': mb._account, 'pid': os.getpid(),
+        })
+        ready = True
+        stop.wait()
+        mb.stop()
+    except Exception as e:
+        # The parent is waiting for the info : it fails now, with the cause
+        if not ready:
+            conn.send({'error': 'Feed process failed to start : {!r}'.format(e)})
+        raise
+    finally:
+        for ring in (store, fills):
+            if ring is not None:
+                ring.unlink()
+
+
+class FeedProcess(object):
+    """
+        Starts the feed process : MarketBroker + TraderBook, quotes and fills to shared memory, order gateway.
+            The level must have been started (or be resumable) by a GameMaster.
+
+        Public Methods / Attributes:
+            - start(timeout)    : returns info, once the feed process is ready
+            - info              : dict to give the strategy processes (SharedMarketData, connect_gateway)
+            - stop()
+    """
+    def __init__(self, capacity=None, fills_capacity=100000):
+        self.capacity = capacity or config.getint('store', 'capacity', fallback=100000)
+        self.fills_capacity = fills_capacity
+        # spawned : the feed process does not inherit this process' threads
+        self._ctx = multiprocessing.get_context('spawn')
+        self._stop = self._ctx.Event()
+        self._process = None
+        self.info = None
+
+    def start(self, timeout=60):
+        parent, child = self._ctx.Pipe()
+        self._process = self._ctx.Process(target=_feed_main, name='stockfighter-feed', args=(
+            child, self._stop, self.capacity, self.fills_capacity, os.urandom(16)))
+        self._process.daemon = True
+        self._process.start()
+        if not parent.poll(timeout):
+            self.stop()
+            raise Exception('Feed process not ready after {} seconds'.format(timeout))
+        info = parent.recv()
+        if 'error' in info:
+            self.stop()
+            raise Exception(info['error'])
+        self.info = info
+        return info
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._process is not None:
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
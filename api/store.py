@@ -0,0 +1,152 @@
+import os
+import threading
+
+import numpy as np
+
+from stockfighter import config
+from stockfighter import BASE_PATH
+from stockfighter.lib.timestamps import NAT, to_ns
+
+
+class QuoteStore(object):
+    """
+        Bounded, preallocated columnar store of tickertape quotes
+            - one numpy array per field, written in place as a ring buffer
+            - append is O(1) : it only writes one slot per column
+            - times are stored raw (ISO strings) on append, and converted in batches to int64
+                nanoseconds since epoch the first time they are read
+            - prices / sizes are stored as numbers
+            - when full, the overflow policy decides what happens to the oldest quotes :
+                - 'drop'  : they are overwritten
+                - 'spill' : they are written to disk (one .npz file per chunk) before being overwritten
+
+        Public Methods / Attributes:
+            - append(quote)         : stores a quote dict, as sent by the tickertape websocket
+            - columns(names, rows)  : dict of chronological numpy arrays, last `rows` quotes
+            - since(mark, names)    : columns of the quotes appended after high-water mark `mark`
+            - latest()              : dict of the latest quote, None if empty
+            - total                 : number of quotes ever appended (also counts dropped / spilled ones)
+            - capacity              : number of quotes kept in memory
+    """
+    _FIELDS = (
+        ('quoteTime', np.int64),
+        ('bid', np.float64),
+        ('ask', np.float64),
+        ('bidSize', np.int64),
+        ('askSize', np.int64),
+        ('last', np.float64),
+        ('lastSize', np.int64),
+        ('lastTrade', np.int64),
+    )
+    _TIMES = ('quoteTime', 'lastTrade')
+    _OVERFLOW = ('drop', 'spill')
+
+    def __init__(self, capacity=None, overflow=None, spill_dir=None):
+        if capacity is None:
+            capacity = config.getint('store', 'capacity', fallback=100000)
+        if overflow is None:
+            overflow = config.get('store', 'overflow', fallback='drop')
+        if overflow not in self._OVERFLOW:
+            raise Exception('overflow must be one of : [{}]'.format(', '.join(self._OVERFLOW)))
+        if spill_dir is None:
+            spill_dir = config.get('store', 'spill_dir', fallback=os.path.join(BASE_PATH, 'lib/spill'))
+
+        self.capacity = int(capacity)
+        self.overflow = overflow
+        self.spill_dir = spill_dir
+        self._spill_chunk = max(self.capacity // 4, 1)
+        self._spilled = 0   # index (in total count) up to which quotes have been written to disk
+        self.total = 0
+        self._parsed = 0    # index (in total count) up to which raw times have been converted
+        self._lock = threading.Lock()
+        self._cols = {name: np.empty(self.capacity, dtype=dtype) for name, dtype in self._FIELDS}
+        self._raw = {name: np.empty(self.capacity, dtype=object) for name in self._TIMES}
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def append(self, quote):
+        with self._lock:
+            if self.overflow == 'spill' and self.total - self._spilled >= self.capacity:
+                self._spill()
+            if self.total - self._parsed >= self.capacity:
+                # raw times about to be overwritten before anyone read them
+                self._parse_times()
+
+            pos = self.total % self.capacity
+            cols = self._cols
+            self._raw['quoteTime'][pos] = quote.get('quoteTime')
+            self._raw['lastTrade'][pos] = quote.get('lastTrade')
+            cols['bid'][pos] = quote.get('bid', np.nan)
+            cols['ask'][pos] = quote.get('ask', np.nan)
+            cols['last'][pos] = quote.get('last', np.nan)
+            cols['bidSize'][pos] = quote.get('bidSize', 0)
+            cols['askSize'][pos] = quote.get('askSize', 0)
+            cols['lastSize'][pos] = quote.get('lastSize', 0)
+            self.total += 1
+
+    def _parse_times(self):
+        """
+            Converts, in one batch, the raw times appended since the last conversion.
+            Called with the lock held.
+        """
+        start = max(self._parsed, self.total - len(self))
+        if start < self.total:
+            idx = self._indices(start, self.total)
+            for name in self._TIMES:
+                self._cols[name][idx] = to_ns(self._raw[name][idx])
+                self._raw[name][idx] = None
+        self._parsed = self.total
+
+    def _spill(self):
+        """
+            Writes the oldest chunk of quotes to disk, so that it can be overwritten.
+            Called with the lock held.
+        """
+        self._parse_times()
+        start, stop = self._spilled, self._spilled + self._spill_chunk
+        idx = self._indices(start, stop)
+        if not os.path.isdir(self.spill_dir):
+            os.makedirs(self.spill_dir)
+        fname = os.path.join(self.spill_dir, 'quotes_{:012d}.npz'.format(start))
+        np.savez(fname, **{name: col[idx] for name, col in self._cols.items()})
+        self._spilled = stop
+
+    def _indices(self, start, stop):
+        # Positions in the ring of the quotes numbered [start, stop)
+        return np.arange(start, stop) % self.capacity
+
+    def columns(self, names=None, rows=None):
+        """
+            Returns a dict of chronological arrays (copies) for the last `rows` quotes
+                names   : iterable of field names, defaults to all fields
+                rows    : int, defaults to every quote held in memory
+        """
+        if names is None:
+            names = [name for name, _ in self._FIELDS]
+        with self._lock:
+            self._parse_times()
+            count = len(self) if rows is None else min(int(rows), len(self))
+            idx = self._indices(self.total - count, self.total)
+            return {name: self._cols[name][idx] for name in names}
+
+    def since(self, mark, names=None):
+        """
+            Returns (columns, new_mark) for the quotes appended after the high-water mark `mark`
+                - quotes already overwritten in the ring are skipped
+        """
+        if names is None:
+            names = [name for name, _ in self._FIELDS]
+        with self._lock:
+            self._parse_times()
+            start = max(mark, self.total - len(self))
+            idx = self._indices(start, self.total)
+            return {name: self._cols[name][idx] for name in names}, self.total
+
+    def latest(self):
+        with self._lock:
+            if not self.total:
+                return None
+            self._parse_times()
+            pos = (self.total - 1) % self.capacity
+            return {name: self._cols[name][pos].item() for name, _ in self._FIELDS}
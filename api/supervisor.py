@@ -0,0 +1,165 @@
+import time
+
+from stockfighter import config
+from stockfighter.lib.scheduler import get_scheduler
+from .decoding import QuoteRecord
+
+
+class WebSocketSupervisor(object):
+    """
+        Watches the tickertape and executions websockets of a MarketBroker (a job of the shared scheduler)
+            - liveness comes from the websocket heartbeats (pings, see ThreadedWebSocket)
+            - a dead connection is reopened with exponential backoff (`backoff` seconds,
+                doubling up to `max_backoff`), keeping its data and subscribers
+            - once reconnected :
+                - executions : the fills missed meanwhile are rebuilt from the orders' statuses
+                    (_get_all_orders_in_stock), and go through the websocket's handle :
+                    the FillLog, the ledger and every subscriber see them, flagged `backfill`
+                - tickertape : the current quote is fetched from the REST api
+            - silences of the tickertape longer than `gap_after` seconds are counted as gaps
+
+        Public Methods :
+            - start() / stop()
+            - check()   : one pass over both websockets (what the job does every `interval` seconds)
+            - health()  : dict channel -> connection health metrics
+    """
+    def __init__(self, mb, interval=None, backoff=None, max_backoff=None, gap_after=None):
+        self._mb = mb
+        self.interval = interval or config.getfloat('websocket', 'supervise_interval', fallback=1)
+        self.backoff = backoff or config.getfloat('websocket', 'backoff', fallback=1)
+        self.max_backoff = max_backoff or config.getfloat('websocket', 'max_backoff', fallback=30)
+        self.gap_after = gap_after or config.getfloat('websocket', 'gap_after', fallback=5)
+        self._channels = (('quotes', '_wsq', self._backfill_quotes), ('fills', '_wsf', self._backfill_fills))
+        self._state = {name: {
+            'attempts': 0, 'next_attempt': 0, 'reconnects': 0, 'connected_at': time.time(),
+            'down_since': None, 'downtime': 0., 'pending_backfill': False, 'backfilled': 0,
+            'gaps': 0, 'in_gap': False, 'messages': 0,
+        } for name, _, _ in self._channels}
+        self._job = None
+
+    def start(self):
+        if self._job is None:
+            self._job = get_scheduler().add('ws-supervisor-{}'.format(self._mb._stock), self.check,
+                                            interval=self.interval, rest=False)
+
+    def stop(self):
+        if self._job is not None:
+            get_scheduler().remove(self._job)
+            self._job = None
+
+    def check(self):
+        for name, attr, backfill in self._channels:
+            self._check(name, getattr(self._mb, attr), backfill)
+
+    def _check(self, name, listener, backfill):
+        state, webs, now = self._state[name], listener.webs, time.time()
+        if webs.live:
+            if not webs.opened:
+                return
+            if state['down_since'] is not None:
+                state['downtime'] += now - state['down_since']
+                state['down_since'] = None
+            if state['pending_backfill']:
+                state['pending_backfill'] = False
+                state['backfilled'] += backfill(listener)
+            if state['attempts'] and now - state['connected_at'] > self.max_backoff:
+                # connection held long enough : the next failure starts from the shortest backoff
+                state['attempts'] = 0
+            if name == 'quotes' and webs.last_message:
+                silent = now - webs.last_message > self.gap_after
+                if silent and not state['in_gap']:
+                    state['gaps'] += 1
+                state['in_gap'] = silent
+            return
+
+        if state['down_since'] is None:
+            state['down_since'] = now
+        if now < state['next_attempt']:
+            return
+        state['next_attempt'] = now + min(self.backoff * 2 ** state['attempts'], self.max_backoff)
+        state['attempts'] += 1
+        state['reconnects'] += 1
+        state['messages'] += webs.messages
+        state['connected_at'] = now
+        state['pending_backfill'] = True
+        listener.reconnect()
+        print('Websocket {} reconnecting (attempt {})'.format(name, state['attempts']))
+
+    """
+        Backfill, after a reconnection
+    """
+    def _backfill_quotes(self, listener):
+        res = self._mb._sft._get_quote(self._mb._stock)
+        if not res.get('ok'):
+            return 0
+        listener.handle(listener.webs, {'ok': True, 'quote': QuoteRecord(res), 'backfill': True})
+        return 1
+
+    @staticmethod
+    def _missed_fills(order, known):
+        """
+            Execution messages for the fills of `order` (a REST order status) past the first
+                `known` shares filled. An order closed since, without new fills, gets one message
+                with nothing filled.
+        """
+        messages, cumulative = [], 0
+        fills = order.get('fills') or []
+        for i, fill in enumerate(fills):
+            cumulative += fill.get('qty')
+            if cumulative <= known:
+                continue
+            last = i == len(fills) - 1
+            qty = min(fill.get('qty'), cumulative - known)
+            status = dict(order, totalFilled=cumulative, qty=order.get('originalQty') - cumulative,
+                          open=order.get('open') if last else True)
+            messages.append({
+                'ok': True, 'account': order.get('account'), 'venue': order.get('venue'),
+                'symbol': order.get('symbol'), 'order': status, 'price': fill.get('price'),
+                'filled': qty, 'filledAt': fill.get('ts'), 'standingComplete': not status['open'],
+                'incomingComplete': None, 'standingId': None, 'incomingId': None, 'backfill': True,
+            })
+        if not messages and not order.get('open'):
+            messages.append({
+                'ok': True, 'account': order.get('account'), 'venue': order.get('venue'),
+                'symbol': order.get('symbol'), 'order': order, 'price': order.get('price'), 'filled': 0,
+                'filledAt': None, 'standingComplete': True, 'incomingComplete': None,
+                'standingId': None, 'incomingId': None, 'backfill': True,
+            })
+        return messages
+
+    def _backfill_fills(self, listener):
+        fills = listener.webs.data
+        count = 0
+        for order in self._mb._get_all_orders_in_stock():
+            latest = fills.latest(order.get('id'))
+            known = latest.get('order', {}) if latest else {}
+            if latest is None and not order.get('totalFilled'):
+                # never filled, and not seen on the websocket : nothing missed
+                continue
+            if known.get('totalFilled', 0) >= order.get('totalFilled', 0) and known.get('open', True) == order.get('open'):
+                continue
+            if not known.get('open', True):
+                continue
+            for msg in self._missed_fills(order, known.get('totalFilled', 0)):
+                listener.handle(listener.webs, msg)
+                count += 1
+        return count
+
+    """
+        Metrics
+    """
+    def health(self):
+        now = time.time()
+        health = {}
+        for name, attr, _ in self._channels:
+            state, webs = self._state[name], getattr(self._mb, attr).webs
+            health[name] = {
+                'connected': bool(webs.live and webs.opened),
+                'reconnects': state['reconnects'],
+                'messages': state['messages'] + webs.messages,
+                'last_message_age': now - webs.last_message if webs.last_message else None,
+                'downtime': state['downtime'] + (now - state['down_since'] if state['down_since'] else 0),
+                'backfilled': state['backfilled'],
+                'gaps': state['gaps'],
+            }
+        return health
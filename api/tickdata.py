@@ -0,0 +1,256 @@
+"""
+    Tick data capture, to append-only columnar files
+
+    Layout of a session (one per venue / stock / instance) :
+        <root>/<venue>/<stock>/<instance>/
+            quotes/000000/<field>.npy       one .npy file per column and per chunk : memory-mappable
+            quotes/000001/<field>.npy
+            ...
+            executions/000000.jsonl.gz      execution messages, one json per line, gzipped per chunk
+            ...
+        Every row also keeps `recv`, the time (ns since epoch) it was received : replays follow it.
+"""
+import gzip
+import json
+import os
+import threading
+
+import numpy as np
+
+from stockfighter import config
+from stockfighter import BASE_PATH
+from stockfighter.lib.timestamps import to_ns, to_iso, now_ns
+
+
+def default_root():
+    return config.get('recorder', 'path', fallback=os.path.join(BASE_PATH, 'lib/ticks'))
+
+
+class TickRecorder(object):
+    """
+        Streams tickertape and execution messages to disk, in chunks.
+            Quotes are buffered in preallocated columns, and written as one .npy file per column
+            every `chunk_size` quotes. Executions are written as gzipped json lines.
+
+        Usage, on a MarketBroker :
+            recorder = MB.record()         # or TickRecorder(venue, stock, instance), then subscribe
+            ...
+            recorder.close()
+
+        Public Methods / Attributes:
+            - on_quote(msg) / on_fill(msg)  : subscribers of the tickertape / executions websockets
+            - flush()                       : writes the buffered messages, as a (smaller) chunk
+            - close()                       : flushes. Also called at exit of the context manager
+            - path                          : directory of the session
+    """
+    _FIELDS = (
+        ('recv', np.int64),
+        ('quoteTime', np.int64),
+        ('bid', np.float64),
+        ('ask', np.float64),
+        ('bidSize', np.int64),
+        ('askSize', np.int64),
+        ('bidDepth', np.int64),
+        ('askDepth', np.int64),
+        ('last', np.float64),
+        ('lastSize', np.int64),
+        ('lastTrade', np.int64),
+    )
+    _TIMES = ('quoteTime', 'lastTrade')
+
+    def __init__(self, venue, stock, instance=None, root=None, chunk_size=None):
+        if root is None:
+            root = default_root()
+        if chunk_size is None:
+            chunk_size = config.getint('recorder', 'chunk_size', fallback=50000)
+
+        self.venue = venue
+        self.stock = stock
+        self.path = os.path.join(root, venue, stock, str(instance if instance is not None else 'local'))
+        self._chunk_size = int(chunk_size)
+        self._lock = threading.Lock()
+        self._quote_chunk = self._next_chunk(os.path.join(self.path, 'quotes'))
+        self._fill_chunk = self._next_chunk(os.path.join(self.path, 'executions'))
+        self._cols = {name: np.empty(self._chunk_size, dtype=dtype) for name, dtype in self._FIELDS}
+        self._raw = {name: np.empty(self._chunk_size, dtype=object) for name in self._TIMES}
+        self._n = 0
+        self._fills = []
+
+    @staticmethod
+    def _next_chunk(directory):
+        # Appends to a previous recording of the same session : numbering goes on after existing chunks
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+            return 0
+        chunks = [int(name.split('.')[0]) for name in os.listdir(directory) if name.split('.')[0].isdigit()]
+        return max(chunks) + 1 if chunks else 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    """
+        Subscribers
+    """
+    def on_quote(self, msg):
+        if not msg.get('ok'):
+            return
+        quote = msg.get('quote')
+        with self._lock:
+            pos, cols = self._n, self._cols
+            cols['recv'][pos] = now_ns()
+            self._raw['quoteTime'][pos] = quote.get('quoteTime')
+            self._raw['lastTrade'][pos] = quote.get('lastTrade')
+            cols['bid'][pos] = quote.get('bid', np.nan)
+            cols['ask'][pos] = quote.get('ask', np.nan)
+            cols['bidSize'][pos] = quote.get('bidSize', 0)
+            cols['askSize'][pos] = quote.get('askSize', 0)
+            cols['bidDepth'][pos] = quote.get('bidDepth', 0)
+            cols['askDepth'][pos] = quote.get('askDepth', 0)
+            cols['last'][pos] = quote.get('last', np.nan)
+            cols['lastSize'][pos] = quote.get('lastSize', 0)
+            self._n += 1
+            if self._n == self._chunk_size:
+                self._write_quotes()
+
+    def on_fill(self, msg):
+        with self._lock:
+            self._fills.append(json.dumps({'recv': now_ns(), 'msg': msg}))
+            if len(self._fills) == self._chunk_size:
+                self._write_fills()
+
+    """
+        Writers (called with the lock held)
+    """
+    def _write_quotes(self):
+        if not self._n:
+            return
+        directory = os.path.join(self.path, 'quotes', '{:06d}'.format(self._quote_chunk))
+        os.makedirs(directory)
+        for name in self._TIMES:
+            self._cols[name][:self._n] = to_ns(self._raw[name][:self._n])
+        for name, _ in self._FIELDS:
+            np.save(os.path.join(directory, name + '.npy'), self._cols[name][:self._n])
+        self._quote_chunk += 1
+        self._n = 0
+
+    def _write_fills(self):
+        if not self._fills:
+            return
+        path = os.path.join(self.path, 'executions', '{:06d}.jsonl.gz'.format(self._fill_chunk))
+        with gzip.open(path, 'wt') as f:
+            f.write('\n'.join(self._fills) + '\n')
+        self._fill_chunk += 1
+        self._fills = []
+
+    def flush(self):
+        with self._lock:
+            self._write_quotes()
+            self._write_fills()
+
+    def close(self):
+        self.flush()
+
+
+class SessionReader(object):
+    """
+        Reads a session written by a TickRecorder. Quote chunks are memory-mapped : nothing is
+            loaded until it is read.
+
+        Public Methods :
+            - sessions(root)            : static, list of (venue, stock, instance) recorded under root
+            - open(venue, stock, instance, root) : class method, SessionReader of that session
+            - quote_chunks(names)       : iterator of dicts of memory-mapped columns, one per chunk
+            - columns(names)            : dict of columns over the whole session (concatenated)
+            - quotes()                  : iterator of (recv, tickertape message), in order
+            - executions()              : iterator of (recv, execution message), in order
+            - messages()                : iterator of (recv, 'quote' / 'fill', message), both merged in order
+            - to_frame()                : DataFrame of the quotes, indexed on quoteTime
+    """
+    def __init__(self, path):
+        if not os.path.isdir(path):
+            raise Exception('No recorded session at {}'.format(path))
+        self.path = path
+        parts = os.path.normpath(path).split(os.sep)
+        self.venue, self.stock, self.instance = parts[-3:]
+
+    @classmethod
+    def open(cls, venue, stock, instance='local', root=None):
+        return cls(os.path.join(root or default_root(), venue, stock, str(instance)))
+
+    @staticmethod
+    def sessions(root=None):
+        root = root or default_root()
+        found = []
+        if not os.path.isdir(root):
+            return found
+        for venue in sorted(os.listdir(root)):
+            for stock in sorted(os.listdir(os.path.join(root, venue))):
+                for instance in sorted(os.listdir(os.path.join(root, venue, stock))):
+                    found.append((venue, stock, instance))
+        return found
+
+    def _chunks(self, kind):
+        directory = os.path.join(self.path, kind)
+        if not os.path.isdir(directory):
+            return []
+        return [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+
+    def quote_chunks(self, names=None):
+        names = names or [name for name, _ in TickRecorder._FIELDS]
+        for directory in self._chunks('quotes'):
+            yield {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r') for name in names}
+
+    def columns(self, names=None):
+        names = names or [name for name, _ in TickRecorder._FIELDS]
+        chunks = list(self.quote_chunks(names))
+        if not chunks:
+            return {name: np.empty(0, dtype=dict(TickRecorder._FIELDS)[name]) for name in names}
+        return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in names}
+
+    def quotes(self):
+        # Rebuilds the tickertape messages, as sent by the websocket
+        #   (columns are turned into lists once per chunk : indexing numpy arrays row by row is slow)
+        values = [name for name, _ in TickRecorder._FIELDS[2:] if name not in TickRecorder._TIMES]
+        for chunk in self.quote_chunks():
+            times = [(name, to_iso(chunk[name]).tolist()) for name in TickRecorder._TIMES]
+            columns = [(name, chunk[name].tolist()) for name in values]
+            for i, recv in enumerate(chunk['recv'].tolist()):
+                quote = {'symbol': self.stock, 'venue': self.venue}
+                for name, column in columns:
+                    value = column[i]
+                    if value == value:     # NaN : the field was missing
+                        quote[name] = int(value)
+                for name, column in times:
+                    if column[i] is not None:
+                        quote[name] = column[i]
+                yield recv, {'ok': True, 'quote': quote}
+
+    def executions(self):
+        for path in self._chunks('executions'):
+            with gzip.open(path, 'rt') as f:
+                for line in f:
+                    row = json.loads(line)
+                    yield row['recv'], row['msg']
+
+    def messages(self):
+        # Both streams are in recv order : merging them only needs the head of each
+        quotes, fills = self.quotes(), self.executions()
+        quote, fill = next(quotes, None), next(fills, None)
+        while quote is not None or fill is not None:
+            if fill is None or (quote is not None and quote[0] <= fill[0]):
+                yield quote[0], 'quote', quote[1]
+                quote = next(quotes, None)
+            else:
+                yield fill[0], 'fill', fill[1]
+                fill = next(fills, None)
+
+    def to_frame(self):
+        # NAT is pandas' own missing value : it becomes NaT
+        import pandas as pd
+        cols = self.columns()
+        index = pd.to_datetime(cols.pop('quoteTime'), utc=True)
+        cols['lastTrade'] = pd.to_datetime(cols['lastTrade'], utc=True)
+        return pd.DataFrame(cols, index=index)
@@ -0,0 +1,30 @@
+"""
+    Base urls of the Stockfighter APIs, read from config.ini ([urls] section).
+        Point them to a local exchange simulator (stockfighter.sim) to work offline.
+"""
+from stockfighter import config
+
+_DEFAULTS = {
+    'api': 'https://api.stockfighter.io/ob/api',
+    'ws': 'wss://api.stockfighter.io/ob/api/ws',
+    'gm': 'https://www.stockfighter.io/gm',
+}
+
+
+def _url(key):
+    return config.get('urls', key, fallback=_DEFAULTS[key]).rstrip('/')
+
+
+def api_url():
+    # REST api of the venues
+    return _url('api')
+
+
+def ws_url():
+    # websockets (tickertape / executions)
+    return _url('ws')
+
+
+def gm_url():
+    # GameMaster api
+    return _url('gm')
@@ -1,13 +1,21 @@
-import requests
-import threading
 import time
 
+from stockfighter.lib.scheduler import get_scheduler
+
+from .http import get_session
+from .orderbook import OrderBook
+from .urls import api_url
+
 
 class StockFighterTrader(object):
     """
         - Checks health of API on construction
         - Used for API calls that do not need authentication
-        - Polls the order book by default every 3 seconds
+        - Keeps a local OrderBook, seeded from REST snapshots of the order book.
+            Between snapshots, the owner feeds it quotes / fills. Snapshots are taken every
+            `update` seconds at the latest, sooner when the local book drifted from the quotes
+            (but not more often than every `update` / 4 seconds). Polling is a job of the shared
+            scheduler, stop() removes it.
     """
 
     def __init__(self, venue, stock, update=3):
@@ -18,41 +26,49 @@ class StockFighterTrader(object):
             raise Exception('Venue {} not online'.format(venue))
 
         self._stock = stock
-        self.order_book = None
+        self.order_book = OrderBook()
         self._update = update
-        thrd = threading.Thread(target=self._loop)
-        thrd.daemon = True
-        thrd.start()
+        self._last_snapshot = 0
+        self._job = get_scheduler().add('order-book-{}-{}'.format(venue, stock), self._refresh_book,
+                                        interval=update / 4.)
 
         print('StockFighterTrader initiated')
 
-    def _loop(self):
-        while True:
-            self.order_book = self._order_book(self._stock)
-            time.sleep(self._update)
+    def _refresh_book(self):
+        # checks the drift every self._update / 4 seconds, snapshots at most every self._update seconds
+        step = self._update / 4.
+        if time.time() - self._last_snapshot < self.order_book.next_interval(step, self._update):
+            return
+        snapshot = self._order_book(self._stock)
+        if snapshot.get('ok'):
+            self.order_book.load_snapshot(snapshot)
+        self._last_snapshot = time.time()
+
+    def stop(self):
+        get_scheduler().remove(self._job)
 
     @staticmethod
     def _get_response(url):
-        resp = requests.get(url)
+        resp = get_session().get(url)
         return resp.json()
 
     def _isonline(self):
-        url = 'https://api.stockfighter.io/ob/api/heartbeat'
+        url = '{base}/heartbeat'.format(base=api_url())
         res = self._get_response(url)
         return res['ok']
 
     def _venue_online(self, venue):
-        url = "https://api.stockfighter.io/ob/api/venues/{venue}/heartbeat".format(**{'venue': venue})
+        url = "{base}/venues/{venue}/heartbeat".format(**{'base': api_url(), 'venue': venue})
         res = self._get_response(url)
         return res['ok']
 
     def _get_quote(self, ticker):
-        url = "https://api.stockfighter.io/ob/api/venues/{venue}/stocks/{stock}/quote".format(venue=self.venue, stock=ticker)
+        url = "{base}/venues/{venue}/stocks/{stock}/quote".format(base=api_url(), venue=self.venue, stock=ticker)
         res = self._get_response(url)
         return res
 
     def _order_book(self, ticker):
-        url = "https://api.stockfighter.io/ob/api/venues/{venue}/stocks/{stock}".format(venue=self.venue, stock=ticker)
+        url = "{base}/venues/{venue}/stocks/{stock}".format(base=api_url(), venue=self.venue, stock=ticker)
         res = self._get_response(url)
         return res
 
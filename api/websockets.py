@@ -1,9 +1,15 @@
-import json
+import queue
 import threading
+import time
 
 import websocket
-import arrow
-import pandas as pd
+
+from stockfighter import config
+from .decoding import FrameQueue, decode_quote, loads
+from .store import QuoteStore, NAT
+from .frames import FrameCache
+from .fills import FillLog
+from .urls import ws_url
 
 
 class ThreadedWebSocket(object):
@@ -12,121 +18,210 @@ class ThreadedWebSocket(object):
         - Runs it into a thread
         - Create child class. The __init__ method of the child must send the url of the websocket
             to the parent's __init__ method
+        - Callbacks registered with subscribe(callback) are called with every parsed message,
+            as soon as it arrives.
+        - Frames are decoded by decode(frame), then handle(webs, msg) stores / dispatches them.
+            With [websocket] decoder_thread (default), both run on a decoder thread : the socket
+            thread only queues the raw frames (see FrameQueue).
+        - The connection is pinged every [websocket] heartbeat seconds : `webs.live` turns False
+            when the server stops answering. reconnect() opens a new connection, with the same
+            data and subscribers (see WebSocketSupervisor).
     """
-    def __init__(self, url, data):
+    def __init__(self, url, data, subscribers=None):
+        self.subscribers = subscribers if subscribers is not None else []
+        self._url = url
+        self._heartbeat = config.getfloat('websocket', 'heartbeat', fallback=10)
+        self._frames = None
+        if config.getboolean('websocket', 'decoder_thread', fallback=True):
+            self._frames = FrameQueue(lambda frame: self.handle(self.webs, self.decode(frame)))
         self._create_thread(url, data)
 
     def _create_thread(self, url, data):
-        webs = websocket.WebSocketApp(url, on_message = self.on_message, on_close = self.on_close)
-        webs.data = []
-        wst = threading.Thread(target=webs.run_forever)
+        webs = websocket.WebSocketApp(url, on_message = self.on_message, on_close = self.on_close,
+                                      on_open = self.on_open)
+        webs.data = data
+        webs.subscribers = self.subscribers
+        webs.decode = self.decode
+        webs.handle = self.handle
+        webs.frames = self._frames
+        webs.opened = False
+        webs.messages = 0
+        webs.last_message = None
+        wst = threading.Thread(target=self._run, args=(webs, self._heartbeat))
         wst.daemon = True
         wst.start()
         self.webs = webs
         self.webs.live = True
 
+    @staticmethod
+    def _run(webs, heartbeat):
+        if heartbeat:
+            webs.run_forever(ping_interval=heartbeat, ping_timeout=heartbeat / 2.)
+        else:
+            webs.run_forever()
+        # run_forever returns on errors too, not only on close
+        webs.live = False
+
+    def reconnect(self):
+        # New connection, same data and subscribers : nothing is copied
+        self.webs.keep_running = False
+        self._create_thread(self._url, self.webs.data)
+
+    def subscribe(self, callback):
+        # callback(msg) is called for every message. Returns the callback, to unsubscribe it later
+        self.subscribers.append(callback)
+        return callback
+
+    def subscribe_queue(self, maxsize=0):
+        # Every message is also put in the queue returned
+        messages = queue.Queue(maxsize)
+        self.subscribe(messages.put)
+        return messages
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    @staticmethod
+    def _dispatch(webs, msg):
+        for callback in list(webs.subscribers):
+            try:
+                callback(msg)
+            except Exception as e:
+                print('Websocket subscriber {} failed : {}'.format(callback, e))
+
+    @staticmethod
+    def decode(frame):
+        return loads(frame)
+
+    @staticmethod
+    def handle(webs, msg):
+        webs.data.append(msg)
+        ThreadedWebSocket._dispatch(webs, msg)
+
     @staticmethod
     def on_message(webs, message):
-        webs.data.append(json.loads(message))
+        webs.messages += 1
+        webs.last_message = time.time()
+        if webs.frames is not None:
+            webs.frames.put(message)
+        else:
+            webs.handle(webs, webs.decode(message))
 
     @staticmethod
-    def on_close(webs):
+    def on_open(webs):
+        webs.opened = True
+
+    @staticmethod
+    def on_close(webs, *args):
+        # websocket-client >= 0.58 also passes the close status code and reason
         webs.live = False
         print("### closed ###")
 
 
-class WebSocketListenerQuotes(ThreadedWebSocket):
+class QuoteReader(object):
     """
+        Read side of a QuoteStore. Quotes are kept in a QuoteStore (bounded columnar ring buffer),
+            not in a list of dicts
+
         Public methods :
             - get_latest_quote_time : datetime of the latest quote
+            - get_quote             : Serie of the latest quote, named after its quoteTime
             - get_spread            : dataframe (timeserie) of the bid / ask.
                                     removes dates where we have only bids or asks
             - get_data              : dataframe (timeserie) of trades.
+            Both dataframes are cached and shared : copy them before modifying them.
     """
-    def __init__(self, mm, data=None):
-        if data is None:
-            data = []
+    def __init__(self, store):
+        self._store = store
+        # DataFrames are materialized incrementally, from the quotes received since the last call
+        self._spread_frame = FrameCache(store, 'quoteTime', ['ask', 'askSize', 'bid', 'bidSize'],
+                                        derive=self._add_spread)
+        self._histo_frame = FrameCache(store, 'lastTrade', ['last', 'lastSize'],
+                                       drop_missing_index=True, dedupe_on_index=True)
+
+    @property
+    def store(self):
+        return self._store
 
-        url = 'wss://api.stockfighter.io/ob/api/ws/{account}/venues/{venue}/tickertape/stocks/{stock}'
-        url = url.format(account=mm._account, venue=mm._venue, stock=mm._stock)
-        ThreadedWebSocket.__init__(self, url, data)
+    @staticmethod
+    def on_quote_message(store, message):
+        # Parses a tickertape message and stores the quote. Returns the parsed message
+        msg = decode_quote(message)
+        if msg.get('ok'):
+            store.append(msg.get('quote'))
+        return msg
 
     def get_latest_quote_time(self):
-        if len(self.webs.data) > 0:
-            return arrow.get(self.webs.data[-1].get('quote').get('quoteTime'))
+        # arrow and pandas are imported on first use : reading quotes does not need them
+        import arrow
+        latest = self.store.latest()
+        if latest:
+            return arrow.get(latest.get('quoteTime') / 1e9)
         else:
             return arrow.utcnow()
 
     def get_quote(self):
-        if len(self.webs.data) > 1:
-            quote = self.webs.data[-1]
-            if quote.get('ok'):
-                return quote.get('quote')
-            else:
-                return None
+        import pandas as pd
+        latest = self.store.latest()
+        if latest:
+            last_trade = latest.get('lastTrade')
+            latest['lastTrade'] = pd.Timestamp(last_trade, tz='UTC') if last_trade != NAT else pd.NaT
+            return pd.Series(latest, name=pd.Timestamp(latest.pop('quoteTime'), tz='UTC'))
+        else:
+            return None
 
     @staticmethod
-    def _update_spread_data(histo_data, quote):
-        histo_data['quoteTime'].append(arrow.get(quote.get('quoteTime')).datetime)
-        histo_data['ask'].append(quote.get('ask'))
-        histo_data['askSize'].append(quote.get('askSize'))
-        histo_data['bid'].append(quote.get('bid'))
-        histo_data['bidSize'].append(quote.get('bidSize'))
-        return histo_data
+    def _add_spread(df):
+        df['spread'] = df['ask'] - df['bid']
+        return df
 
     def get_spread(self, rows='all'):
-        histo_data = {
-            'quoteTime' : [],
-            'ask'  : [],
-            'askSize'  : [],
-            'bid' : [],
-            'bidSize' : [],
-        }
-
-        for item in reversed(self.webs.data):
-            if item.get('ok'):
-                histo_data = self._update_spread_data(histo_data, item.get('quote'))
-            if rows != 'all' and len(histo_data.get('quoteTime')) >  rows:
-                break
-
-        df = pd.DataFrame.from_dict(histo_data).set_index('quoteTime').drop_duplicates()
-        df['spread'] = df['ask'] - df['bid']
-        df.sort_index()
-        return df#.dropna(subset=['spread'])
+        rows = None if rows == 'all' else rows
+        return self._spread_frame.get(rows=rows)
 
-    @staticmethod
-    def _update_histo_data(histo_data, quote):
-        histo_data['lastTrade'].append(arrow.get(quote.get('lastTrade')).datetime)
-        histo_data['last'].append(quote.get('last'))
-        histo_data['lastSize'].append(quote.get('lastSize'))
-        return histo_data
+    def get_data(self, rows='all'):
+        rows = None if rows == 'all' else rows
+        return self._histo_frame.get(rows=rows)
 
-    def get_data(self):
-        histo_data = {
-            'lastTrade' : [],
-            'last'  : [],
-            'lastSize'  : [],
-        }
 
-        for item in self.ws.data:
-            if item.get('ok'):
-                histo_data = self._update_histo_data(histo_data, item.get('quote'))
+class WebSocketListenerQuotes(ThreadedWebSocket, QuoteReader):
+    """
+        - Listens to the tickertape websocket, in a thread
+        - Quotes are read through the QuoteReader methods
+    """
+    def __init__(self, mm, data=None, subscribers=None):
+        if data is None:
+            data = QuoteStore()
 
-        return pd.DataFrame.from_dict(histo_data).set_index('lastTrade').drop_duplicates()
+        url = '{base}/{account}/venues/{venue}/tickertape/stocks/{stock}'
+        url = url.format(base=ws_url(), account=mm._account, venue=mm._venue, stock=mm._stock)
+        QuoteReader.__init__(self, data)
+        ThreadedWebSocket.__init__(self, url, data, subscribers)
+
+    decode = staticmethod(decode_quote)
+
+    @staticmethod
+    def handle(webs, msg):
+        if msg.get('ok'):
+            webs.data.append(msg.get('quote'))
+        ThreadedWebSocket._dispatch(webs, msg)
 
 
 class WebSocketListenerFills(ThreadedWebSocket):
     """
         - Creates a websocket listener
         - Runs it into a thread
+        - Execution messages are kept in a FillLog (latest state per order, cursors for consumers),
+            and dispatched to subscribers as they arrive
     """
-    def __init__(self, mm, data=None):
+    def __init__(self, mm, data=None, subscribers=None):
         if data is None:
-            data = []
+            data = FillLog()
 
-        url = 'wss://api.stockfighter.io/ob/api/ws/{account}/venues/{venue}/executions/stocks/{stock}'
-        url = url.format(account=mm._account, venue=mm._venue, stock=mm._stock)
-        ThreadedWebSocket.__init__(self, url, data)
+        url = '{base}/{account}/venues/{venue}/executions/stocks/{stock}'
+        url = url.format(base=ws_url(), account=mm._account, venue=mm._venue, stock=mm._stock)
+        ThreadedWebSocket.__init__(self, url, data, subscribers)
 
 
 
@@ -0,0 +1,6 @@
+"""
+    Benchmarks of the client hot paths. Run :
+        python -m stockfighter.benchmarks --sizes 1e3 1e4 1e5 1e6
+    Results are saved as json (one file per run, named after the commit) and can be compared :
+        python -m stockfighter.benchmarks --compare old.json new.json
+"""
@@ -0,0 +1,53 @@
+import argparse
+import os
+import time
+
+from stockfighter import BASE_PATH
+from . import harness, hotpaths, startup
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the client hot paths')
+    parser.add_argument('--sizes', nargs='+', type=float, default=[1e3, 1e4, 1e5],
+                        help='number of tickertape messages (N), also used for orders (M) and fills (K)')
+    parser.add_argument('--calls', type=int, default=50, help='calls per latency measure')
+    parser.add_argument('--roundtrip', action='store_true',
+                        help='also measures order round trips, against the local exchange simulator')
+    parser.add_argument('--startup', action='store_true', help='also measures import times, in fresh interpreters')
+    parser.add_argument('--out', default=None, help='json file for the results')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compares two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        harness.compare(*args.compare)
+        return
+
+    commit = harness.git_commit(BASE_PATH)
+    results = {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'benchmarks': {}}
+    for size in args.sizes:
+        size = int(size)
+        print('N = M = K = {}'.format(size))
+        measures = hotpaths.bench_quotes(size, args.calls)
+        measures.update(hotpaths.bench_book(size, size, args.calls))
+        measures.update(hotpaths.bench_decoding(size))
+        for name, measure in measures.items():
+            results['benchmarks']['{}[{}]'.format(name, size)] = measure
+    if args.startup:
+        for name, measure in startup.bench_startup().items():
+            results['benchmarks'][name] = measure
+    if args.roundtrip:
+        for name, measure in hotpaths.bench_roundtrip(args.calls).items():
+            results['benchmarks'][name] = measure
+
+    for name, measure in sorted(results['benchmarks'].items()):
+        print('{:<45} {}'.format(name, ', '.join('{}={:.1f}'.format(k, v) if isinstance(v, float) else
+                                                  '{}={}'.format(k, v) for k, v in sorted(measure.items()))))
+
+    out = args.out or os.path.join(BASE_PATH, 'benchmarks', 'results', '{}_{}.json'.format(
+        time.strftime('%Y%m%d-%H%M%S'), commit))
+    harness.save(results, out)
+    print('Results saved to {}'.format(out))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+    Synthetic data for the benchmarks, in the same json format as stockfighter.io
+"""
+import json
+import random
+import time
+
+
+def _iso(ns):
+    seconds, nanos = divmod(int(ns), 10 ** 9)
+    return '{}.{:09d}Z'.format(time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)), nanos)
+
+
+def tickertape_messages(n, seed=0, start_ns=1451196749 * 10 ** 9, venue='TESTEX', stock='FOOBAR'):
+    """
+        n raw tickertape frames (json strings) : a random walk of the bid / ask,
+            one quote every ~10ms, a trade every ~5 quotes
+    """
+    rnd = random.Random(seed)
+    bid, ts, last = 5000, start_ns, None
+    frames = []
+    for i in range(int(n)):
+        ts += rnd.randint(1, 20) * 10 ** 6
+        bid = max(100, bid + rnd.choice((-1, 0, 1)))
+        ask = bid + rnd.randint(1, 10)
+        quote = {
+            'symbol': stock, 'venue': venue, 'bid': bid, 'ask': ask,
+            'bidSize': rnd.randint(1, 500), 'askSize': rnd.randint(1, 500),
+            'bidDepth': rnd.randint(500, 5000), 'askDepth': rnd.randint(500, 5000),
+            'quoteTime': _iso(ts),
+        }
+        if i % 5 == 0:
+            last = {'last': rnd.choice((bid, ask)), 'lastSize': rnd.randint(1, 100), 'lastTrade': _iso(ts)}
+        if last:
+            quote.update(last)
+        frames.append(json.dumps({'ok': True, 'quote': quote}))
+    return frames
+
+
+def orders(m, seed=0, start_id=1, account='EXB123456', venue='TESTEX', stock='FOOBAR'):
+    """
+        m order statuses (as stored in the `orders` table), some filled, some still open
+    """
+    rnd = random.Random(seed)
+    result = []
+    for oid in range(start_id, start_id + int(m)):
+        qty = rnd.randint(1, 100)
+        filled = rnd.choice((0, qty, rnd.randint(0, qty)))
+        result.append({
+            'ok': True, 'symbol': stock, 'venue': venue, 'account': account,
+            'direction': rnd.choice(('buy', 'sell')), 'orderType': 'limit',
+            'originalQty': qty, 'qty': qty - filled, 'totalFilled': filled,
+            'price': 5000 + rnd.randint(-50, 50), 'id': oid, 'ts': _iso(1451196749 * 10 ** 9 + oid * 10 ** 6),
+            'open': filled < qty and rnd.random() < 0.5,
+        })
+    return result
+
+
+def executions(k, order_list, seed=0):
+    """
+        k execution messages, filling the orders of `order_list` little by little
+    """
+    rnd = random.Random(seed)
+    filled = {}
+    result = []
+    for i in range(int(k)):
+        order = order_list[rnd.randrange(len(order_list))]
+        done = filled.get(order['id'], 0)
+        qty = min(order['originalQty'] - done, rnd.randint(1, 10)) or 0
+        filled[order['id']] = done + qty
+        status = dict(order, totalFilled=done + qty, qty=order['originalQty'] - done - qty,
+                      open=done + qty < order['originalQty'])
+        result.append({
+            'ok': True, 'account': order['account'], 'venue': order['venue'], 'symbol': order['symbol'],
+            'order': status, 'standingId': order['id'], 'incomingId': i + 10 ** 6,
+            'price': order['price'], 'filled': qty, 'filledAt': _iso(1451196749 * 10 ** 9 + i * 10 ** 6),
+            'standingComplete': not status['open'], 'incomingComplete': True,
+        })
+    return result
@@ -0,0 +1,90 @@
+import json
+import os
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+
+def percentiles(samples_ns):
+    # Latency percentiles, in microseconds
+    samples = np.asarray(samples_ns, dtype=np.float64) / 1e3
+    return {
+        'calls': len(samples),
+        'p50_us': float(np.percentile(samples, 50)),
+        'p90_us': float(np.percentile(samples, 90)),
+        'p99_us': float(np.percentile(samples, 99)),
+        'max_us': float(samples.max()),
+        'mean_us': float(samples.mean()),
+    }
+
+
+def time_calls(func, calls=20, setup=None):
+    """
+        Calls func() `calls` times, returns its latency percentiles.
+            setup() is called (untimed) before each call
+    """
+    samples = []
+    for _ in range(calls):
+        if setup is not None:
+            setup()
+        start = time.perf_counter_ns()
+        func()
+        samples.append(time.perf_counter_ns() - start)
+    return percentiles(samples)
+
+
+def peak_memory(func):
+    # (result of func(), peak memory allocated while it ran, in MB)
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak / 2. ** 20
+
+
+def throughput(func, items):
+    # Calls func(item) for every item, returns items per second
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    elapsed = time.perf_counter() - start
+    return len(items) / elapsed if elapsed else float('inf')
+
+
+def git_commit(path):
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=path, stderr=subprocess.DEVNULL)
+        return out.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def save(results, path):
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def compare(old_path, new_path):
+    """
+        Prints, for each benchmark present in both result files, new / old ratio of the
+            p50 latencies (or of the throughputs)
+    """
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    print('{:<45} {:>12} {:>12} {:>8}'.format('benchmark', 'old', 'new', 'ratio'))
+    for name in sorted(set(old['benchmarks']) & set(new['benchmarks'])):
+        before, after = old['benchmarks'][name], new['benchmarks'][name]
+        for key in ('p50_us', 'msgs_per_s'):
+            if key in before and key in after:
+                ratio = after[key] / before[key] if before[key] else float('nan')
+                print('{:<45} {:>12.1f} {:>12.1f} {:>8.2f}  {}'.format(name, before[key], after[key], ratio, key))
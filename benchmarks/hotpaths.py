@@ -0,0 +1,209 @@
+"""
+    Benchmarks of the client hot paths, on synthetic data (see fixtures)
+        - ingestion of tickertape frames through WebSocketListenerQuotes.on_message
+        - get_spread / get_histo : cold (first call), warm (nothing new), tick (one new quote), tail (rows=100)
+        - execution messages : FillLog + PositionLedger ingestion, get_own_book
+        - P&L : loading execution messages into columns, and PnLReport over them
+        - helpers.get_vwap, and helpers.StreamingAnalytics ingestion
+        - decoding of tickertape frames : stdlib json to dicts (as before) vs fast decoder to QuoteRecords,
+        and the socket thread's share of the work once decoding moves to a decoder thread
+    - order round trips, against the local exchange simulator
+"""
+import json
+import time
+
+from stockfighter.api import decoding
+from stockfighter.api.fills import FillLog
+from stockfighter.api.store import QuoteStore
+from stockfighter.api.websockets import QuoteReader, WebSocketListenerQuotes
+from stockfighter.trader import TraderBook
+from stockfighter.trader.pnl import PnLReport, fills_from_messages
+from stockfighter import helpers
+
+from . import fixtures
+from .harness import time_calls, peak_memory, throughput
+
+
+class _Webs(object):
+    # What on_message receives from websocket-client : the app, with what ThreadedWebSocket attaches to it
+    def __init__(self, data, listener=WebSocketListenerQuotes, frames=None):
+        self.data = data
+        self.subscribers = []
+        self.decode = listener.decode
+        self.handle = listener.handle
+        self.frames = frames
+        self.messages = 0
+        self.last_message = None
+
+
+class _DataBase(object):
+    # In memory stand-in for StockDataBase, so that get_own_book is measured without disk
+    def __init__(self, orders):
+        self.orders = orders
+
+    def iterate_table(self, table):
+        return iter(self.orders)
+
+    def update_order_batch(self, orders):
+        pass
+
+
+class _Broker(object):
+    # What TraderBook needs from a MarketBroker
+    def __init__(self, orders, fills, quotes):
+        self._db = _DataBase(orders)
+        self._fills = fills
+        self._quotes = quotes
+        self._callbacks = []
+        self.all_orders_in_stock = None
+
+    def subscribe_fills(self, callback):
+        self._callbacks.append(callback)
+        return callback
+
+    def subscribe_quotes(self, callback):
+        return callback
+
+    def current_quote(self):
+        return self._quotes.get_quote()
+
+    def _get_fills_ws(self):
+        return self._fills
+
+    def receive_fill(self, msg):
+        self._fills.append(msg)
+        for callback in self._callbacks:
+            callback(msg)
+
+    def get_histo(self):
+        return self._quotes.get_data()
+
+
+def bench_quotes(n, calls):
+    results = {}
+    frames = fixtures.tickertape_messages(n)
+    # quotes at most 20ms apart : the extra ones start after the last of `frames`
+    extra = iter(fixtures.tickertape_messages(calls * 4, seed=1, start_ns=1451196749 * 10 ** 9 + int(n) * 2 * 10 ** 7))
+
+    store = QuoteStore(capacity=int(n) + calls * 4)
+    webs = _Webs(store)
+    _, peak = peak_memory(lambda: [WebSocketListenerQuotes.on_message(webs, frame) for frame in frames])
+    results['ingest_peak_mb'] = {'n': n, 'peak_mb': peak}
+
+    store = QuoteStore(capacity=int(n) + calls * 4)
+    webs = _Webs(store)
+    rate = throughput(lambda frame: WebSocketListenerQuotes.on_message(webs, frame), frames)
+    results['ingest'] = {'n': n, 'msgs_per_s': rate}
+
+    reader = QuoteReader(store)
+    tick = lambda: WebSocketListenerQuotes.on_message(webs, next(extra))
+    for name, method in (('get_spread', 'get_spread'), ('get_histo', 'get_data')):
+        results[name + '_cold'] = time_calls(lambda: getattr(QuoteReader(store), method)(), calls=max(3, calls // 10))
+        getattr(reader, method)()
+        results[name + '_warm'] = time_calls(lambda: getattr(reader, method)(), calls=calls)
+        results[name + '_tick'] = time_calls(lambda: getattr(reader, method)(), calls=calls, setup=tick)
+        results[name + '_tail100'] = time_calls(lambda: getattr(reader, method)(rows=100), calls=calls)
+
+    results['get_vwap'] = _bench_vwap(reader, calls)
+    messages = [json.loads(frame) for frame in frames]
+    results['analytics_ingest'] = {'n': n, 'msgs_per_s': throughput(helpers.StreamingAnalytics().on_quote, messages)}
+    return results
+
+
+def _bench_vwap(reader, calls):
+    class _MarketBroker(object):
+        get_histo = staticmethod(reader.get_data)
+    try:
+        helpers.get_vwap(_MarketBroker())
+    except Exception as e:
+        return {'error': repr(e)}
+    return time_calls(lambda: helpers.get_vwap(_MarketBroker()), calls=max(3, calls // 10))
+
+
+def bench_decoding(n):
+    """
+        Throughput on a burst of n tickertape frames :
+            - decode_json_dict      : stdlib json.loads, quote dicts stored, on the socket thread
+            - decode_<fast>_record  : fast decoder, QuoteRecords stored, on the socket thread
+            - socket_thread_handoff : what is left on the socket thread with a decoder thread (queueing)
+            - decoder_thread_drain  : burst fully decoded and stored by the decoder thread
+    """
+    results = {}
+    frames = fixtures.tickertape_messages(n)
+
+    store = QuoteStore(capacity=int(n))
+    def stdlib(frame):
+        msg = json.loads(frame)
+        if msg.get('ok'):
+            store.append(msg.get('quote'))
+    results['decode_json_dict'] = {'n': n, 'msgs_per_s': throughput(stdlib, frames)}
+
+    store = QuoteStore(capacity=int(n))
+    webs = _Webs(store)
+    results['decode_{}_record'.format(decoding.decoder_name())] = {
+        'n': n, 'msgs_per_s': throughput(lambda frame: WebSocketListenerQuotes.on_message(webs, frame), frames)}
+
+    store = QuoteStore(capacity=int(n))
+    webs = _Webs(store)
+    webs.frames = decoding.FrameQueue(lambda frame: webs.handle(webs, webs.decode(frame)))
+    start = time.perf_counter()
+    results['socket_thread_handoff'] = {
+        'n': n, 'msgs_per_s': throughput(lambda frame: WebSocketListenerQuotes.on_message(webs, frame), frames)}
+    while webs.frames.decoded < len(frames):
+        time.sleep(0.0005)
+    results['decoder_thread_drain'] = {'n': n, 'msgs_per_s': len(frames) / (time.perf_counter() - start)}
+    webs.frames.close()
+    return results
+
+
+def bench_book(m, k, calls):
+    results = {}
+    orders = fixtures.orders(m)
+    fills = fixtures.executions(k, orders)
+
+    quotes = QuoteReader(QuoteStore(capacity=10))
+    broker = _Broker(orders, FillLog(), quotes)
+    book = TraderBook(broker)
+    results['fills_ingest'] = {'n': k, 'msgs_per_s': throughput(broker.receive_fill, fills)}
+    results['get_own_book'] = time_calls(book.get_own_book, calls=calls)
+    results['pnl_load'] = time_calls(lambda: fills_from_messages(fills), calls=max(3, calls // 10))
+    columns = fills_from_messages(fills)
+    results['pnl_report'] = time_calls(lambda: PnLReport(columns).summary(), calls=max(3, calls // 10))
+    results['traderbook_recovery'] = time_calls(lambda: TraderBook(_Broker(orders, FillLog(), quotes)),
+                                                calls=max(3, calls // 10))
+    return results
+
+
+def bench_roundtrip(calls):
+    """
+        buy / cancel round trips through MarketBroker, against the exchange simulator.
+            config.ini [urls] must point to localhost : the simulator is started on that port
+    """
+    from urllib.parse import urlparse
+    from stockfighter.api.urls import api_url
+    from stockfighter.api import MarketBroker
+    from stockfighter.sim import ExchangeServer, OrderFlowGenerator
+
+    url = urlparse(api_url())
+    if url.hostname not in ('localhost', '127.0.0.1'):
+        return {'skipped': 'config.ini [urls] api does not point to localhost'}
+
+    server = ExchangeServer(url.hostname, url.port or 80)
+    server.serve_in_thread()
+    flow = OrderFlowGenerator(server.exchange.engine('TESTEX', 'FOOBAR'), rate=100, seed=0)
+    flow.start()
+    try:
+        time.sleep(0.5)
+        broker = MarketBroker()
+        price = flow.price - 500
+        oids = []
+        results = {
+            'order_roundtrip_buy': time_calls(lambda: oids.append(broker._buy(10, price)['id']), calls=calls),
+            'order_roundtrip_cancel': time_calls(lambda: broker._cancel(oids.pop()), calls=calls),
+        }
+        orders = [{'direction': 'buy', 'qty': 1, 'price': price} for _ in range(20)]
+        results['order_batch_20'] = time_calls(lambda: broker._submit_many(orders), calls=max(3, calls // 10))
+        return results
+    finally:
+        flow.stop()
+        server.close()
@@ -0,0 +1,44 @@
+"""
+    Startup time : each import is timed in a fresh interpreter, with the heavy modules it loaded
+"""
+import os
+import subprocess
+import sys
+
+from .harness import percentiles
+
+HEAVY = ('pandas', 'numpy', 'arrow', 'dataset', 'sqlalchemy', 'websocket', 'requests', 'aiohttp')
+
+IMPORTS = (
+    ('import_package', 'import stockfighter'),
+    ('import_scheduler', 'from stockfighter.lib.scheduler import get_scheduler'),
+    ('import_marketbroker', 'from stockfighter import MarketBroker, TraderBook'),
+    ('import_database', 'from stockfighter import StockDataBase'),
+    ('import_helpers', 'import stockfighter.helpers'),
+)
+
+_PROBE = '''
+import sys, time
+start = time.perf_counter_ns()
+{statement}
+elapsed = time.perf_counter_ns() - start
+print(elapsed, ','.join(name for name in {heavy!r} if name in sys.modules))
+'''
+
+
+def bench_startup(runs=5):
+    """
+        For every statement of IMPORTS : import time (measured in the child, interpreter startup excluded),
+            and the heavy modules it loaded
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    results = {}
+    for name, statement in IMPORTS:
+        samples, loaded = [], ''
+        for _ in range(runs):
+            out = subprocess.check_output([sys.executable, '-c', _PROBE.format(statement=statement, heavy=HEAVY)],
+                                          env=env)
+            elapsed, _, loaded = out.decode().strip().partition(' ')
+            samples.append(int(elapsed))
+        results[name] = dict(percentiles(samples), loaded=loaded or '-')
+    return results
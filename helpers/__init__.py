@@ -1,2 +1,3 @@
 from .printers import *
 from .analytics import *
+from .streaming import StreamingAnalytics
@@ -1,19 +1,23 @@
 import pandas as pd
 
+# Both helpers rebuild the statistics from the whole history on every call :
+#   StreamingAnalytics (helpers/streaming.py) keeps them up to date tick by tick
+
 def get_avg_price(mm):
     # VWAP as of now
     df = mm.get_histo()
     if not df.empty:
-        df['prod'] = df['last'] * df['lastSize']
-        return df['prod'].sum() / df['lastSize'].sum()
+        prod = df['last'] * df['lastSize']
+        return prod.sum() / df['lastSize'].sum()
     else:
         return pd.DataFrame()
 
 def get_vwap(mm):
+    # get_histo returns a cached frame, it is not modified in place
     df = mm.get_histo()
     if not df.empty:
-        df['prod'] = df['last'] * df['lastSize']
-        df = df.resample('10S', how='sum')
+        df = df.assign(prod=df['last'] * df['lastSize'])
+        df = df.resample('10s').sum()
         return  df['prod'].cumsum() / df['lastSize'].cumsum()
     else:
         return pd.DataFrame()
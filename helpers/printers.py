@@ -6,7 +6,7 @@
 
 def format_order_book(order_book):
     """
-        ob : dict containing order book info, as returned by MarketMaket.order_book()
+        ob : OrderBook as returned by MarketMaket.order_book (or dict from the REST order book)
     """
     print('Type - Price -   Qty')
     # If you are buying a stock you are going to get the ask price
@@ -0,0 +1,214 @@
+"""
+    Streaming market analytics, updated in O(1) (amortized) per tickertape message
+
+    Usage :
+        analytics = StreamingAnalytics(window=60, volume_window=1000)
+        analytics.attach(MB)            # subscribes to the tickertape of a MarketBroker / ReplayBroker
+        ...
+        analytics.vwap, analytics.ewma_mid, analytics.toxicity
+        analytics.values()              # dict of every current value
+        analytics.to_frame()            # DataFrame of the values after each tick, for research
+"""
+import math
+import threading
+from collections import deque
+
+import pandas as pd
+
+from stockfighter.lib.timestamps import one_to_ns
+
+
+class _TimeWindow(object):
+    # Sums of values over the last `seconds` seconds
+    def __init__(self, seconds, width):
+        self._span = int(seconds * 1e9)
+        self._items = deque()
+        self.sums = [0.] * width
+
+    def add(self, ts, values):
+        self._items.append((ts, values))
+        for i, value in enumerate(values):
+            self.sums[i] += value
+        self.expire(ts)
+
+    def expire(self, now):
+        items, sums = self._items, self.sums
+        while items and items[0][0] < now - self._span:
+            _, values = items.popleft()
+            for i, value in enumerate(values):
+                sums[i] -= value
+
+
+class _VolumeWindow(object):
+    # Price x volume and volume of the last `volume` shares traded
+    def __init__(self, volume):
+        self._volume = volume
+        self._items = deque()
+        self.pv = 0.
+        self.v = 0
+
+    def add(self, price, qty):
+        self._items.append([price, qty])
+        self.pv += price * qty
+        self.v += qty
+        items = self._items
+        while self.v > self._volume:
+            # the oldest trade only partly stays in the window
+            excess = min(self.v - self._volume, items[0][1])
+            self.pv -= items[0][0] * excess
+            self.v -= excess
+            items[0][1] -= excess
+            if not items[0][1]:
+                items.popleft()
+
+
+class StreamingAnalytics(object):
+    """
+        Incremental analytics of the tickertape, fed one message at a time (on_quote).
+            Trades are detected when lastTrade changes, and classified as buyer / seller initiated
+            by the quote rule (at the ask / at the bid), then the tick rule.
+
+        Parameters :
+            - window        : seconds, for the windowed vwap, realized volatility and trade imbalance
+            - volume_window : shares, for the vwap over the last `volume_window` shares
+            - halflife      : seconds, half life of the ewma of the mid and the spread
+            - bucket_volume : shares per volume bucket of the toxicity estimate (VPIN)
+            - buckets       : number of buckets the toxicity is averaged over
+            - history       : number of ticks kept for to_frame()
+
+        Public Attributes (current values, None until known) :
+            - vwap, window_vwap, volume_vwap            : running, over `window` seconds, over `volume_window` shares
+            - ewma_mid, ewma_spread                     : exponentially weighted mid / spread
+            - realized_vol                              : sqrt of the sum of squared log returns of the mid, over `window`
+            - imbalance                                 : (buy - sell) / (buy + sell) volume, over `window`
+            - toxicity                                  : VPIN, mean |buy - sell| / volume over the last `buckets` buckets
+    """
+    _COLUMNS = ('mid', 'spread', 'vwap', 'window_vwap', 'volume_vwap', 'ewma_mid', 'ewma_spread',
+                'realized_vol', 'imbalance', 'toxicity')
+
+    def __init__(self, window=60, volume_window=1000, halflife=10, bucket_volume=500, buckets=50, history=100000):
+        self._halflife_ns = halflife * 1e9
+        self._bucket_volume = bucket_volume
+        self._lock = threading.Lock()
+
+        # running vwap
+        self._pv = 0.
+        self._v = 0
+        # windowed sums : (price x qty, qty) of trades, (buy qty, sell qty), squared log returns
+        self._trades = _TimeWindow(window, 2)
+        self._flow = _TimeWindow(window, 2)
+        self._returns = _TimeWindow(window, 1)
+        self._volume = _VolumeWindow(volume_window)
+        # VPIN : imbalance of the completed buckets, and the bucket being filled
+        self._buckets = deque(maxlen=buckets)
+        self._bucket_sum = 0.
+        self._bucket = [0, 0]
+
+        self._last_trade = None
+        self._last_price = None
+        self._last_sign = 1
+        self._last_ts = None
+        self._history = deque(maxlen=history)
+        self._index = deque(maxlen=history)
+
+        self.mid = self.spread = None
+        self.vwap = self.window_vwap = self.volume_vwap = None
+        self.ewma_mid = self.ewma_spread = None
+        self.realized_vol = self.imbalance = self.toxicity = None
+
+    def attach(self, mm):
+        # Subscribes to the tickertape of a MarketBroker (or anything with subscribe_quotes)
+        return mm.subscribe_quotes(self.on_quote)
+
+    def on_quote(self, msg):
+        if not msg.get('ok'):
+            return
+        quote = msg.get('quote')
+        ts = one_to_ns(quote.get('quoteTime'))
+        with self._lock:
+            self._on_book(ts, quote.get('bid'), quote.get('ask'))
+            if quote.get('lastTrade') and quote.get('lastTrade') != self._last_trade:
+                self._last_trade = quote.get('lastTrade')
+                self._on_trade(ts, quote.get('last'), quote.get('lastSize') or 0, quote.get('bid'), quote.get('ask'))
+            self._expire(ts)
+            self._history.append(tuple(getattr(self, name) for name in self._COLUMNS))
+            self._index.append(ts)
+
+    """
+        Updates
+    """
+    def _on_book(self, ts, bid, ask):
+        if bid is None or ask is None:
+            return
+        mid, spread = (bid + ask) / 2., ask - bid
+        if self.mid is not None and mid > 0 and self.mid > 0:
+            self._returns.add(ts, (math.log(mid / self.mid) ** 2,))
+
+        if self.ewma_mid is None:
+            self.ewma_mid, self.ewma_spread = mid, spread
+        else:
+            alpha = 1 - 2 ** (-max(ts - self._last_ts, 0) / self._halflife_ns) if self._halflife_ns else 1.
+            self.ewma_mid += alpha * (mid - self.ewma_mid)
+            self.ewma_spread += alpha * (spread - self.ewma_spread)
+        self.mid, self.spread, self._last_ts = mid, spread, ts
+
+    def _on_trade(self, ts, price, qty, bid, ask):
+        if price is None or not qty:
+            return
+        if ask is not None and price >= ask:
+            sign = 1
+        elif bid is not None and price <= bid:
+            sign = -1
+        elif self._last_price is not None and price != self._last_price:
+            sign = 1 if price > self._last_price else -1
+        else:
+            sign = self._last_sign
+        self._last_price, self._last_sign = price, sign
+
+        self._pv += price * qty
+        self._v += qty
+        self.vwap = self._pv / self._v
+        self._trades.add(ts, (price * qty, qty))
+        self._flow.add(ts, (qty, 0) if sign > 0 else (0, qty))
+        self._volume.add(price, qty)
+        self.volume_vwap = self._volume.pv / self._volume.v
+        self._fill_buckets(qty, sign)
+
+    def _fill_buckets(self, qty, sign):
+        side = 0 if sign > 0 else 1
+        while qty:
+            room = self._bucket_volume - self._bucket[0] - self._bucket[1]
+            take = min(room, qty)
+            self._bucket[side] += take
+            qty -= take
+            if take == room:
+                if len(self._buckets) == self._buckets.maxlen:
+                    self._bucket_sum -= self._buckets[0]
+                imbalance = abs(self._bucket[0] - self._bucket[1]) / float(self._bucket_volume)
+                self._buckets.append(imbalance)
+                self._bucket_sum += imbalance
+                self._bucket = [0, 0]
+                self.toxicity = self._bucket_sum / len(self._buckets)
+
+    def _expire(self, now):
+        for window in (self._trades, self._flow, self._returns):
+            window.expire(now)
+        pv, v = self._trades.sums
+        self.window_vwap = pv / v if v > 0 else None
+        buys, sells = self._flow.sums
+        self.imbalance = (buys - sells) / (buys + sells) if buys + sells > 0 else None
+        if self.mid is not None:
+            self.realized_vol = math.sqrt(max(self._returns.sums[0], 0.))
+
+    """
+        Reading
+    """
+    def values(self):
+        with self._lock:
+            return {name: getattr(self, name) for name in self._COLUMNS}
+
+    def to_frame(self):
+        # Values after each tick, indexed on quoteTime
+        with self._lock:
+            rows, index = list(self._history), list(self._index)
+        return pd.DataFrame(rows, columns=self._COLUMNS, index=pd.to_datetime(index, utc=True))
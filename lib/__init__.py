@@ -1,2 +1,10 @@
-from .configreader import config
-from .database import StockDataBase
+from stockfighter import lazy_import
+
+_EXPORTS = {
+    'config': '.configreader',
+    'StockDataBase': '.database',
+}
+
+
+def __getattr__(name):
+    return lazy_import(__name__, _EXPORTS, (), name)
@@ -5,16 +5,33 @@ from stockfighter import BASE_PATH
 
 config_fname = 'lib/config.ini'
 config_path = os.path.join(BASE_PATH, config_fname)
-config = None
+_parser = None
+
 
 def ensure_config_is_read():
-    global config
-    if not config:
-        config = configparser.ConfigParser()
+    global _parser
+    if not _parser:
+        parser = configparser.ConfigParser()
         if os.path.isfile(config_path):
-            config.read(config_path)
+            parser.read(config_path)
         else:
             raise Exception('no config file at {}. Aborting.'.format(config_path))
+        _parser = parser
+    return _parser
+
+
+class _LazyConfig(object):
+    """
+        The ConfigParser of config.ini, read the first time a setting is looked up
+    """
+    def __getattr__(self, name):
+        return getattr(ensure_config_is_read(), name)
+
+    def __getitem__(self, section):
+        return ensure_config_is_read()[section]
+
+    def __contains__(self, section):
+        return section in ensure_config_is_read()
 
 
-ensure_config_is_read()
+config = _LazyConfig()
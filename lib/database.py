@@ -1,35 +1,325 @@
+import atexit
 import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from .configreader import config
+
+# WAL lets the writer thread commit without blocking readers, synchronous=NORMAL only fsyncs at checkpoints
+_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',
+]
+
+# PRAGMA user_version of the current schema. 0 : tables created by `dataset`, from whatever dict arrived
+#   1 : fills keyed on (oid, ts), which merged the fills of an order sharing a timestamp
+SCHEMA_VERSION = 2
+
+ORDER_COLUMNS = ('id', 'account', 'venue', 'symbol', 'direction', 'orderType', 'originalQty', 'qty', 'price',
+                 'totalFilled', 'open', 'ts')
+FILL_COLUMNS = ('oid', 'seq', 'ts', 'price', 'qty')
+QUOTE_COLUMNS = ('venue', 'symbol', 'quoteTime', 'bid', 'ask', 'bidSize', 'askSize', 'bidDepth', 'askDepth',
+                 'last', 'lastSize', 'lastTrade')
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY,
+        account TEXT, venue TEXT, symbol TEXT, direction TEXT, "orderType" TEXT,
+        "originalQty" INTEGER, qty INTEGER, price INTEGER, "totalFilled" INTEGER, open INTEGER, ts TEXT
+    )""",
+    'CREATE INDEX IF NOT EXISTS orders_open_direction ON orders (open, direction)',
+    """CREATE TABLE IF NOT EXISTS fills (
+        oid INTEGER NOT NULL, seq INTEGER NOT NULL, ts TEXT, price INTEGER, qty INTEGER,
+        PRIMARY KEY (oid, seq)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS quotes (
+        venue TEXT NOT NULL, symbol TEXT NOT NULL, "quoteTime" INTEGER NOT NULL,
+        bid INTEGER, ask INTEGER, "bidSize" INTEGER, "askSize" INTEGER, "bidDepth" INTEGER, "askDepth" INTEGER,
+        last INTEGER, "lastSize" INTEGER, "lastTrade" INTEGER,
+        PRIMARY KEY (venue, symbol, "quoteTime")
+    ) WITHOUT ROWID""",
+]
+
+
+def _quoted(columns):
+    return ', '.join('"{}"'.format(column) for column in columns)
+
+
+def _upsert(table, columns, keys, update=True):
+    """
+        Prepared bulk upsert : one INSERT ... ON CONFLICT statement, run with executemany.
+            Columns missing from a row (NULL) keep the value stored.
+    """
+    statement = 'INSERT INTO {} ({}) VALUES ({}) ON CONFLICT ({}) DO '.format(
+        table, _quoted(columns), ', '.join('?' * len(columns)), _quoted(keys))
+    if not update:
+        return statement + 'NOTHING'
+    return statement + 'UPDATE SET ' + ', '.join('"{0}" = COALESCE(excluded."{0}", {1}."{0}")'.format(column, table)
+                                                 for column in columns if column not in keys)
+
+
+_UPSERT_ORDERS = _upsert('orders', ORDER_COLUMNS, ('id',))
+_UPSERT_FILLS = _upsert('fills', FILL_COLUMNS, ('oid', 'seq'))
+_INSERT_QUOTES = _upsert('quotes', QUOTE_COLUMNS, ('venue', 'symbol', 'quoteTime'), update=False)
 
-import dataset
 
 class StockDataBase(object):
+    """
+        SQLite persistence of the orders, their fills, and (optionally) the tickertape.
+
+        Explicit schema (version SCHEMA_VERSION, in PRAGMA user_version) :
+            - orders    : primary key on id, index on (open, direction)
+            - fills     : primary key on (order id, seq) : the `fills` of every order status saved,
+                            seq being the position of the fill in the order's `fills` list
+            - quotes    : primary key on (venue, symbol, quoteTime), times in nanoseconds since epoch
+        A database written by an older version is migrated when opened : the known columns of the orders
+            of a `dataset` database are copied to the new table, the fills of a version 1 database are
+            numbered in time order.
+
+        Writes are write-behind : save_order / save_order_batch / update_order_batch / on_quote only queue
+            the rows, a writer thread upserts them (prepared INSERT ... ON CONFLICT, one executemany per
+            table) in one transaction, once `batch_size` rows are pending or every `flush_interval` seconds
+            ([database] section of config.ini). Several writes of the same order before a flush are
+            coalesced in one row. Orders without an id are not stored.
+
+        Public Methods :
+            - save_order(order) / save_order_batch(orders) / update_order_batch(orders)
+            - on_quote(msg)         : tickertape subscriber, stores the quotes (MB.subscribe_quotes(db.on_quote))
+            - iterate_table(table)  : flushes, then iterates over the rows of 'orders', 'fills' or 'quotes' (dicts)
+            - get_order(oid)        : stored order, or None (primary key lookup)
+            - open_orders(direction): stored open orders ((open, direction) index)
+            - get_fills(oid)        : stored fills of an order, in the order of its `fills` list
+            - flush()               : writes the pending rows now
+            - close()               : flushes and stops the writer thread. Also called at exit.
+    """
     _db_path = os.path.join(os.path.dirname(os.path.realpath(__file__)))
     _name = 'stockfighter.db'
 
-    def __init__(self, destroy=False):
+    def __init__(self, destroy=False, batch_size=None, flush_interval=None):
         abs_path = os.path.join(self._db_path, self._name)
         if destroy:
             print('Removing Old StockDataBase.')
-            if os.path.isfile(abs_path):
-                os.remove(abs_path)
+            for path in (abs_path, abs_path + '-wal', abs_path + '-shm'):
+                if os.path.isfile(path):
+                    os.remove(path)
 
         print('Connecting to Database at : {}'.format(abs_path))
-        self.db = dataset.connect('sqlite:///{}'.format(abs_path))
+        # Transactions are explicit (BEGIN / COMMIT), the connection is shared under self._flush_lock
+        self.db = sqlite3.connect(abs_path, isolation_level=None, check_same_thread=False)
+        for pragma in _PRAGMAS:
+            self.db.execute(pragma)
+        self.__migrate()
+
+        self.batch_size = batch_size or config.getint('database', 'batch_size', fallback=500)
+        self.flush_interval = flush_interval or config.getfloat('database', 'flush_interval', fallback=0.5)
+
+        # order id -> row, in arrival order
+        self._pending = OrderedDict()
+        # (order id, seq) -> row
+        self._pending_fills = OrderedDict()
+        self._pending_quotes = []
+        self._lock = threading.Lock()
+        # Serializes the use of the connection : flushes (writer thread, explicit flush()) and reads
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
 
+        self._writer = threading.Thread(target=self.__loop)
+        self._writer.daemon = True
+        self._writer.start()
+        atexit.register(self.close)
+
+    """
+        Schema
+    """
+    def __migrate(self):
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        db = self.db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            tables = set(row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+            old_orders = version < 1 and 'orders' in tables
+            old_fills = 'fills' in tables
+            if old_orders or old_fills:
+                print('Migrating StockDataBase to schema version {}'.format(SCHEMA_VERSION))
+            if old_orders:
+                db.execute('ALTER TABLE orders RENAME TO orders_old')
+            if old_fills:
+                db.execute('ALTER TABLE fills RENAME TO fills_old')
+            for statement in _SCHEMA:
+                db.execute(statement)
+            if old_orders:
+                existing = set(row[1] for row in db.execute('PRAGMA table_info(orders_old)'))
+                columns = _quoted(column for column in ORDER_COLUMNS if column in existing)
+                db.execute('INSERT OR REPLACE INTO orders ({0}) SELECT {0} FROM orders_old WHERE id IS NOT NULL'.format(
+                    columns))
+                db.execute('DROP TABLE orders_old')
+            if old_fills:
+                db.execute('INSERT INTO fills (oid, seq, ts, price, qty) '
+                           'SELECT oid, ROW_NUMBER() OVER (PARTITION BY oid ORDER BY ts) - 1, ts, price, qty FROM fills_old')
+                db.execute('DROP TABLE fills_old')
+            db.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    """
+        Write-behind queue
+    """
+    @staticmethod
+    def __order_row(order):
+        row = tuple(order.get(column) for column in ORDER_COLUMNS)
+        is_open = order.get('open')
+        return row[:10] + (None if is_open is None else int(bool(is_open)),) + row[11:]
+
+    def __enqueue(self, orders):
+        with self._lock:
+            for order in orders:
+                oid = order.get('id')
+                if oid is None:
+                    continue
+                # the fills list of an order only grows : a fill keeps its position in it
+                for seq, fill in enumerate(order.get('fills') or []):
+                    self._pending_fills[(oid, seq)] = (oid, seq, fill.get('ts'), fill.get('price'), fill.get('qty'))
+                row = self.__order_row(order)
+                if oid in self._pending:
+                    # coalesced : the latest status wins, fields missing from it are kept
+                    row = tuple(old if new is None else new for old, new in zip(self._pending[oid], row))
+                self._pending[oid] = row
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def __loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print('StockDataBase : flush failed, will retry. {}'.format(e))
+
+    @staticmethod
+    def __quote_rows(quotes):
+        # Times are converted in one batch, to nanoseconds
+        from .timestamps import to_ns, NAT
+        times = {name: to_ns([quote.get(name) for quote in quotes]).tolist() for name in ('quoteTime', 'lastTrade')}
+        rows = []
+        for i, quote in enumerate(quotes):
+            row = [quote.get(column) for column in QUOTE_COLUMNS]
+            row[2] = times['quoteTime'][i]
+            row[-1] = times['lastTrade'][i] if times['lastTrade'][i] != NAT else None
+            if row[2] != NAT:
+                rows.append(row)
+        return rows
+
+    def flush(self):
+        # Upserts all pending rows, in one transaction
+        with self._flush_lock:
+            with self._lock:
+                if not (self._pending or self._pending_fills or self._pending_quotes):
+                    return
+                batch, self._pending = self._pending, OrderedDict()
+                fills, self._pending_fills = self._pending_fills, OrderedDict()
+                quotes, self._pending_quotes = self._pending_quotes, []
+            try:
+                self.db.execute('BEGIN')
+                try:
+                    self.db.executemany(_UPSERT_ORDERS, batch.values())
+                    self.db.executemany(_UPSERT_FILLS, fills.values())
+                    if quotes:
+                        self.db.executemany(_INSERT_QUOTES, self.__quote_rows(quotes))
+                    self.db.execute('COMMIT')
+                except Exception:
+                    self.db.execute('ROLLBACK')
+                    raise
+            except Exception:
+                # Puts the rows back, behind any newer status queued in the meantime
+                with self._lock:
+                    for oid, row in batch.items():
+                        if oid in self._pending:
+                            row = tuple(old if new is None else new for old, new in zip(row, self._pending[oid]))
+                        self._pending[oid] = row
+                    for key, row in fills.items():
+                        self._pending_fills.setdefault(key, row)
+                    self._pending_quotes[:0] = quotes
+                raise
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._writer.join()
+        self.flush()
+
+    """
+        Orders
+    """
     def save_orders(self, list_orders):
-        with self.db as tsx:
-            for order in list_orders.values():
-                order_copy = order.get('order')
-                if 'fills' in order_copy.keys():
-                    order_copy.pop('fills')
-                tsx['orders'].insert(order_copy)
+        self.__enqueue(order.get('order') for order in list_orders.values())
 
     def save_order(self, order):
-        order_copy = order.copy()
-        order_copy.pop('fills')
-        self.db['orders'].insert(order_copy)
+        self.__enqueue([order])
+
+    def save_order_batch(self, orders):
+        # Saves several order responses
+        self.__enqueue(orders)
+
+    def update_order_batch(self, orders):
+        # Updates several orders (matched on id)
+        self.__enqueue(orders)
+
+    """
+        Quotes
+    """
+    def on_quote(self, msg):
+        if not msg.get('ok'):
+            return
+        with self._lock:
+            self._pending_quotes.append(msg.get('quote'))
+            full = len(self._pending_quotes) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    """
+        Reads
+    """
+    _TABLES = {'orders': ORDER_COLUMNS, 'fills': FILL_COLUMNS, 'quotes': QUOTE_COLUMNS}
+
+    def __rows(self, table, where='', args=()):
+        columns = self._TABLES[table]
+        with self._flush_lock:
+            rows = self.db.execute('SELECT {} FROM {} {}'.format(_quoted(columns), table, where), args).fetchall()
+        for row in rows:
+            item = dict(zip(columns, row))
+            if table == 'orders' and item['open'] is not None:
+                item['open'] = bool(item['open'])
+            yield item
 
     def iterate_table(self, table):
-        for item in self.db[table]:
+        if table not in self._TABLES:
+            raise Exception('Unknown table {}, must be one of : [{}]'.format(table, ', '.join(self._TABLES)))
+        self.flush()
+        for item in self.__rows(table):
             yield item
 
+    def get_order(self, oid):
+        self.flush()
+        return next(self.__rows('orders', 'WHERE id = ?', (oid,)), None)
+
+    def open_orders(self, direction=None):
+        self.flush()
+        if direction is None:
+            return list(self.__rows('orders', 'WHERE open = 1'))
+        return list(self.__rows('orders', 'WHERE open = 1 AND direction = ?', (direction,)))
+
+    def get_fills(self, oid):
+        self.flush()
+        return list(self.__rows('fills', 'WHERE oid = ? ORDER BY seq', (oid,)))
@@ -0,0 +1,263 @@
+"""
+    End to end order latency instrumentation
+
+    Each order is timestamped at every stage of its life :
+        build       : order requested (MarketBroker._buy / _sell)
+        sent        : order built, request about to be encoded and sent
+        response    : response received and decoded
+        persisted   : response saved in the StockDataBase
+        first_fill  : first execution message seen on the fills websocket
+        filled      : execution message closing the order
+
+    Time spent between consecutive stages (and in total, build to last stage seen) goes into log-linear (HDR style) histograms,
+        one per order type and direction. Recording is off by default ([latency] enabled in config.ini) :
+        when off, each instrumentation point is a single attribute check.
+
+    Usage :
+        from stockfighter.lib.latency import recorder
+        recorder.enable()
+        ...
+        recorder.snapshot(reset=True)
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from stockfighter import config
+
+STAGES = ('build', 'sent', 'response', 'persisted', 'first_fill', 'filled')
+
+
+class LatencyHistogram(object):
+    """
+        Log-linear histogram of values in nanoseconds, HDR style
+            - values below 2 ** bits are exact, above the relative error is below 2 ** (1 - bits)
+            - record is O(1), memory is fixed
+    """
+    def __init__(self, bits=7, max_value_bits=44):
+        self._bits = bits
+        self._sub = 1 << bits
+        self._half = self._sub >> 1
+        self._counts = [0] * (self._sub + (max_value_bits - bits + 1) * self._half)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        if value < self._sub:
+            return value
+        shift = value.bit_length() - self._bits
+        return min(self._sub + (shift - 1) * self._half + ((value >> shift) - self._half), len(self._counts) - 1)
+
+    def _value(self, index):
+        # Middle of the range of values counted in bucket `index`
+        if index < self._sub:
+            return index
+        shift, mantissa = divmod(index - self._sub, self._half)
+        shift += 1
+        mantissa += self._half
+        return (mantissa << shift) + (1 << (shift - 1))
+
+    def record(self, value):
+        value = max(int(value), 0)
+        self._counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, pct):
+        if not self.count:
+            return None
+        target, seen = pct / 100. * self.count, 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if count and seen >= target:
+                return max(min(self._value(index), self.max), self.min)
+        return self.max
+
+    def snapshot(self):
+        # dict of the statistics, in microseconds
+        if not self.count:
+            return {'count': 0}
+        us = lambda value: value / 1e3
+        return {
+            'count': self.count, 'mean_us': us(self.total / self.count),
+            'min_us': us(self.min), 'max_us': us(self.max),
+            'p50_us': us(self.percentile(50)), 'p90_us': us(self.percentile(90)),
+            'p99_us': us(self.percentile(99)), 'p999_us': us(self.percentile(99.9)),
+        }
+
+
+class LatencyRecorder(object):
+    """
+        Collects the stage timestamps of the orders, and records the latencies when an order is done
+
+        enabled : None reads the [latency] section of config.ini (enabled, dump_interval, dump_path)
+            on the first start() or enable(), not on import
+
+        Public Methods / Attributes:
+            - enabled               : bool (None until the config is read)
+            - enable() / disable()
+            - start(order_type, direction)  : returns a token (None when disabled)
+            - mark(token, stage)    : timestamps a stage
+            - bind(token, oid, closed) : the order got its id : later stages are marked by id. Executions seen
+                                      before (the response can come after them) are applied, and the order is done
+                                      if it is filled, or `closed` by its response
+            - mark_order(oid, stage), on_fill(msg), forget(oid)
+            - snapshot(reset)       : dict (order_type, direction) -> interval -> statistics
+            - start_dump(interval, path) : dumps the snapshot every `interval` seconds (json file or stdout)
+    """
+    _MAX_PENDING = 10000
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._configured = enabled is not None
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()
+        # oid -> stages of the executions seen before the order was bound
+        self._early = OrderedDict()
+        self._histograms = {}
+        self._dump_thread = None
+
+    def _configure(self):
+        # [latency] section of config.ini, read once, on first use
+        with self._lock:
+            if self._configured:
+                return
+            self._configured = True
+        if self.enabled is None:
+            self.enabled = config.getboolean('latency', 'enabled', fallback=False)
+        interval = config.getint('latency', 'dump_interval', fallback=0)
+        if self.enabled and interval > 0 and self._dump_thread is None:
+            self.start_dump(interval, config.get('latency', 'dump_path', fallback=None))
+
+    def enable(self):
+        self.enabled = True
+        self._configure()
+
+    def disable(self):
+        self._configured = True
+        self.enabled = False
+
+    """
+        Instrumentation points
+    """
+    def start(self, order_type, direction):
+        if not self.enabled:
+            if self._configured:
+                return None
+            self._configure()
+            if not self.enabled:
+                return None
+        return {'key': '{} {}'.format(order_type, direction), 'build': time.perf_counter_ns()}
+
+    @staticmethod
+    def mark(token, stage):
+        if token is not None and stage not in token:
+            token[stage] = time.perf_counter_ns()
+
+    def bind(self, token, oid, closed=False):
+        if token is None or oid is None:
+            return
+        with self._lock:
+            for stage, ns in self._early.pop(oid, {}).items():
+                token.setdefault(stage, ns)
+            self._pending[oid] = token
+            while len(self._pending) > self._MAX_PENDING:
+                self._pending.popitem(last=False)
+        if closed or 'filled' in token:
+            self.finish(oid)
+
+    def mark_order(self, oid, stage):
+        if not self.enabled:
+            return
+        token = self._pending.get(oid)
+        self.mark(token, stage)
+
+    def on_fill(self, msg):
+        # Subscriber of the fills websocket
+        if not self.enabled:
+            return
+        order = msg.get('order') or {}
+        oid = order.get('id')
+        token = self._pending.get(oid)
+        if token is None:
+            if oid is None:
+                return
+            with self._lock:
+                token = self._pending.get(oid)
+                if token is None:
+                    # execution of an order not bound yet : kept for bind()
+                    early = self._early.setdefault(oid, {})
+                    self.mark(early, 'first_fill')
+                    if not order.get('open'):
+                        self.mark(early, 'filled')
+                    while len(self._early) > self._MAX_PENDING:
+                        self._early.popitem(last=False)
+                    return
+        self.mark(token, 'first_fill')
+        if not order.get('open'):
+            self.mark(token, 'filled')
+            self.finish(order.get('id'))
+
+    def forget(self, oid):
+        # Order cancelled : records what was measured, drops it
+        if self.enabled:
+            with self._lock:
+                self._early.pop(oid, None)
+            self.finish(oid)
+
+    def finish(self, oid):
+        with self._lock:
+            token = self._pending.pop(oid, None)
+            if token is None:
+                return
+            intervals = self._histograms.setdefault(token['key'], {})
+            # Stages in the order they happened : the fill can be seen before the order is persisted
+            stages = sorted((token[stage], stage) for stage in STAGES if stage in token)
+            for (start, first), (end, second) in zip(stages, stages[1:]):
+                intervals.setdefault('{}->{}'.format(first, second), LatencyHistogram()).record(end - start)
+            intervals.setdefault('total', LatencyHistogram()).record(stages[-1][0] - token['build'])
+
+    """
+        Reading the results
+    """
+    def snapshot(self, reset=False):
+        with self._lock:
+            snap = {key: {name: hist.snapshot() for name, hist in intervals.items()}
+                    for key, intervals in self._histograms.items()}
+            if reset:
+                self._histograms = {}
+        return snap
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._pending.clear()
+            self._early.clear()
+
+    def _dump_loop(self, interval, path):
+        while self._dump_thread is not None:
+            time.sleep(interval)
+            snap = self.snapshot()
+            if path:
+                with open(path, 'w') as f:
+                    json.dump(snap, f, indent=2, sort_keys=True)
+            else:
+                print(json.dumps(snap, indent=2, sort_keys=True))
+
+    def start_dump(self, interval=60, path=None):
+        thrd = threading.Thread(target=self._dump_loop, args=(interval, path))
+        thrd.daemon = True
+        self._dump_thread = thrd
+        thrd.start()
+
+    def stop_dump(self):
+        self._dump_thread = None
+
+
+# Settings from config.ini, read on the first order (or enable())
+recorder = LatencyRecorder(enabled=None)
@@ -0,0 +1,205 @@
+"""
+    Shared scheduler of the periodic jobs (REST polling, websocket supervision...)
+
+    One thread keeps the jobs in a heap, by next run time, and hands the due ones to a small
+        pool of workers :
+        - a job never runs concurrently with itself
+        - a job can return the number of seconds until its next run (adaptive polling),
+            otherwise it runs again after its interval
+        - trigger(job, delay) asks for an earlier run. Triggers are coalesced : many triggers
+            before the job runs give one run
+        - a failing job is retried with exponential backoff (up to max_backoff), and keeps running
+        - REST jobs are held back while the API is rate limiting us (429, see api.http.throttled_for)
+
+    Usage :
+        job = get_scheduler().add('gm-status', gm._update, interval=5)
+        get_scheduler().trigger(job)
+        get_scheduler().remove(job)
+"""
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .configreader import config
+
+
+class Job(object):
+    """
+        A periodic job. Statistics are public : runs, errors, last_duration, last_error
+    """
+    def __init__(self, name, func, interval, rest):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.rest = rest
+        self.runs = 0
+        self.errors = 0
+        self.last_duration = None
+        self.last_error = None
+        self._errors_in_row = 0
+        self._version = 0
+        self._next = None
+        self._running = False
+        self._triggered = None      # time of a run asked for while the job was running
+        self._removed = False
+
+    def __repr__(self):
+        return 'Job({})'.format(self.name)
+
+
+class Scheduler(object):
+    """
+        Public Methods :
+            - add(name, func, interval, delay, rest)    : returns the Job
+            - remove(job)
+            - trigger(job, delay)                       : runs the job within `delay` seconds
+            - start() / stop()
+            - stats()                                   : dict name -> statistics of the job
+    """
+    def __init__(self, workers=None, max_backoff=None):
+        self._workers = workers or config.getint('scheduler', 'workers', fallback=4)
+        self.max_backoff = max_backoff or config.getfloat('scheduler', 'max_backoff', fallback=60)
+        self._heap = []
+        self._jobs = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = None
+        self._thread = None
+        self._running = False
+
+    """
+        Jobs
+    """
+    def add(self, name, func, interval, delay=0, rest=True):
+        """
+            name    : label, for stats()
+            func    : called without arguments. May return the seconds until its next run
+            interval: seconds between runs, when func returns None
+            delay   : seconds before the first run
+            rest    : the job calls the REST api : it is held back while the api rate limits
+        """
+        job = Job(name, func, interval, rest)
+        with self._cond:
+            self._jobs.append(job)
+            self._schedule(job, time.time() + delay)
+        return job
+
+    def remove(self, job):
+        with self._cond:
+            job._removed = True
+            job._version += 1
+            if job in self._jobs:
+                self._jobs.remove(job)
+
+    def trigger(self, job, delay=0):
+        with self._cond:
+            when = time.time() + delay
+            if job._removed:
+                return
+            if job._running:
+                job._triggered = when if job._triggered is None else min(job._triggered, when)
+            elif job._next is None or when < job._next:
+                self._schedule(job, when)
+
+    def _schedule(self, job, when):
+        # Called with the lock held. Older heap entries of the job become stale
+        job._version += 1
+        job._next = when
+        heapq.heappush(self._heap, (when, next(self._seq), job, job._version))
+        self._cond.notify()
+
+    """
+        Running
+    """
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._executor = ThreadPoolExecutor(max_workers=self._workers)
+            self._thread = threading.Thread(target=self.__loop, name='scheduler')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def __loop(self):
+        # imported here : lib does not depend on api at import time
+        from stockfighter.api.http import throttled_for
+
+        with self._cond:
+            while self._running:
+                now = time.time()
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                when, _, job, version = self._heap[0]
+                if version != job._version or job._removed:
+                    heapq.heappop(self._heap)
+                    continue
+                if when > now:
+                    self._cond.wait(when - now)
+                    continue
+                heapq.heappop(self._heap)
+                wait = throttled_for() if job.rest else 0
+                if wait > 0:
+                    self._schedule(job, now + wait)
+                    continue
+                job._next = None
+                job._running = True
+                self._executor.submit(self.__run, job)
+
+    def __run(self, job):
+        start = time.time()
+        next_in = None
+        try:
+            next_in = job.func()
+            job._errors_in_row = 0
+        except Exception as e:
+            job.errors += 1
+            job._errors_in_row += 1
+            job.last_error = repr(e)
+            next_in = min(job.interval * 2 ** job._errors_in_row, self.max_backoff)
+            print('Scheduler : job {} failed ({} in a row) : {}'.format(job.name, job._errors_in_row, e))
+        finally:
+            job.runs += 1
+            job.last_duration = time.time() - start
+
+        with self._cond:
+            job._running = False
+            if job._removed:
+                return
+            when = time.time() + (job.interval if next_in is None else next_in)
+            if job._triggered is not None:
+                when, job._triggered = min(when, job._triggered), None
+            self._schedule(job, when)
+
+    def stats(self):
+        now = time.time()
+        with self._cond:
+            return {job.name: {
+                'runs': job.runs, 'errors': job.errors, 'last_error': job.last_error,
+                'last_duration': job.last_duration, 'interval': job.interval,
+                'next_in': job._next - now if job._next is not None else None,
+            } for job in self._jobs}
+
+
+_scheduler = None
+_lock = threading.Lock()
+
+
+def get_scheduler():
+    # Scheduler shared by every object of the package, started on first use
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+            _scheduler.start()
+    return _scheduler
@@ -0,0 +1,66 @@
+"""
+    Batch conversion of ISO timestamps to int64 nanoseconds since epoch (UTC)
+
+    Timestamps are kept as raw strings when messages arrive, and converted in batches when needed.
+        - fast path : the Stockfighter format (2015-12-27T06:12:29.105297235Z) is parsed by numpy
+                      as datetime64[ns] in a single vectorized call
+        - anything else (offsets, odd formats) goes through pandas.to_datetime (imported then)
+        - missing timestamps are returned as NAT
+"""
+import time
+
+import numpy as np
+
+NAT = np.iinfo(np.int64).min
+
+
+def to_ns(values):
+    """
+        values : iterable of ISO strings (None / '' for missing)
+        returns : int64 numpy array of nanoseconds since epoch
+    """
+    raw = np.asarray(values, dtype=object)
+    out = np.full(len(raw), NAT, dtype=np.int64)
+    present = raw.astype(bool)
+    if not present.any():
+        return out
+
+    strings = raw[present].astype(str)
+    fast = np.char.endswith(strings, 'Z') & (np.char.find(strings, '+') < 0)
+    parsed = np.empty(len(strings), dtype=np.int64)
+
+    if fast.any():
+        naive = np.char.rstrip(strings[fast], 'Z')
+        parsed[fast] = naive.astype('datetime64[ns]').astype(np.int64)
+    if not fast.all():
+        import pandas as pd
+        slow = pd.to_datetime(strings[~fast], utc=True, format='ISO8601').values
+        parsed[~fast] = slow.astype('datetime64[ns]').astype(np.int64)
+
+    out[present] = parsed
+    return out
+
+
+def one_to_ns(value):
+    # Single ISO timestamp -> nanoseconds since epoch
+    if value and value.endswith('Z') and '+' not in value:
+        return int(np.datetime64(value[:-1], 'ns').astype(np.int64))
+    return int(to_ns([value])[0])
+
+
+def now_ns():
+    return int(time.time() * 10 ** 9)
+
+
+def to_iso(values):
+    """
+        values : int64 nanoseconds since epoch (NAT for missing)
+        returns : numpy array of ISO strings in the Stockfighter format (None for missing)
+    """
+    ns = np.asarray(values, dtype=np.int64)
+    out = np.full(len(ns), None, dtype=object)
+    present = ns != NAT
+    if present.any():
+        strings = np.datetime_as_string(ns[present].astype('datetime64[ns]'), unit='ns')
+        out[present] = np.char.add(strings, 'Z')
+    return out
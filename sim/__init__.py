@@ -0,0 +1,3 @@
+from .exchange import Exchange, MatchingEngine
+from .server import ExchangeServer
+from .flow import OrderFlowGenerator
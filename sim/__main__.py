@@ -0,0 +1,38 @@
+"""
+    Runs the local exchange simulator :
+        python -m stockfighter.sim --port 8000 --rate 50
+"""
+import argparse
+import time
+
+from .server import ExchangeServer
+from .flow import OrderFlowGenerator
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for stockfighter.io')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--venue', default='TESTEX')
+    parser.add_argument('--stock', default='FOOBAR')
+    parser.add_argument('--account', default='EXB123456')
+    parser.add_argument('--rate', type=float, default=10., help='synthetic orders per second, 0 for none')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    server = ExchangeServer(args.host, args.port, args.venue, args.stock, args.account, verbose=args.verbose)
+    server.serve_in_thread()
+    if args.rate > 0:
+        OrderFlowGenerator(server.exchange.engine(args.venue, args.stock), rate=args.rate, seed=args.seed).start()
+
+    print('Exchange simulator on http://{}:{} - venue {} stock {}'.format(args.host, args.port, args.venue, args.stock))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+import itertools
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+ORDER_TYPE = ('limit', 'market', 'fill-or-kill', 'immediate-or-cancel')
+
+
+def iso_now():
+    # Stockfighter timestamp format, with nanoseconds
+    now = time.time()
+    seconds = int(now)
+    return '{}.{:09d}Z'.format(time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)), int((now - seconds) * 1e9))
+
+
+def _snapshot(order):
+    # Copy of an order status, safe to serialize while the engine keeps matching
+    return dict(order, fills=list(order['fills']))
+
+
+class _Side(object):
+    """
+        Resting orders of one side : price levels sorted best first (bisect), a FIFO queue per level
+    """
+    def __init__(self, is_bid):
+        self._sign = -1 if is_bid else 1
+        self._keys = []
+        self.levels = {}
+
+    def best(self):
+        return self._sign * self._keys[0] if self._keys else None
+
+    def add(self, order):
+        price = order['price']
+        if price not in self.levels:
+            key = self._sign * price
+            self._keys.insert(bisect_left(self._keys, key), key)
+            self.levels[price] = deque()
+        self.levels[price].append(order)
+
+    def remove(self, order):
+        price = order['price']
+        level = self.levels.get(price)
+        if level is not None and order in level:
+            level.remove(order)
+            if not level:
+                self._drop_level(price)
+
+    def _drop_level(self, price):
+        del self.levels[price]
+        del self._keys[bisect_left(self._keys, self._sign * price)]
+
+    def pop_front(self, price):
+        level = self.levels[price]
+        level.popleft()
+        if not level:
+            self._drop_level(price)
+
+    def prices(self):
+        return [self._sign * key for key in self._keys]
+
+    def qty_at(self, price):
+        return sum(order['qty'] for order in self.levels.get(price, ()))
+
+    def depth(self):
+        return sum(order['qty'] for level in self.levels.values() for order in level)
+
+
+class MatchingEngine(object):
+    """
+        Price / time priority matching engine for one stock of a venue
+            - supports the four Stockfighter order types :
+                limit               : fills what crosses, the rest stays on the book
+                market              : fills against the book, whatever the price. Never rests
+                fill-or-kill        : fills entirely right now, or not at all
+                immediate-or-cancel : fills what crosses, the rest is cancelled
+            - orders, fills, quotes and order books use the same json format as stockfighter.io
+            - on_quote(quote) / on_execution(execution) callbacks are called after each change
+    """
+    def __init__(self, venue, symbol, ids=None, on_quote=None, on_execution=None):
+        self.venue = venue
+        self.symbol = symbol
+        self._ids = ids if ids is not None else itertools.count()
+        self._lock = threading.RLock()
+        self._sides = {'buy': _Side(is_bid=True), 'sell': _Side(is_bid=False)}
+        self.orders = {}
+        self._last = None
+        self.on_quote = on_quote
+        self.on_execution = on_execution
+
+    """
+        Orders
+    """
+    def submit(self, account, direction, qty, price, order_type):
+        """
+            Submits an order, returns its status (dict, as returned by the order api)
+        """
+        if order_type not in ORDER_TYPE:
+            return {'ok': False, 'error': 'Unknown orderType {}'.format(order_type)}
+        if direction not in ('buy', 'sell'):
+            return {'ok': False, 'error': 'Unknown direction {}'.format(direction)}
+        if qty <= 0 or price < 0:
+            return {'ok': False, 'error': 'qty must be positive and price not negative'}
+
+        with self._lock:
+            order = {
+                'ok': True, 'symbol': self.symbol, 'venue': self.venue, 'direction': direction,
+                'originalQty': qty, 'qty': qty, 'price': price, 'orderType': order_type,
+                'id': next(self._ids), 'account': account, 'ts': iso_now(),
+                'fills': [], 'totalFilled': 0, 'open': True,
+            }
+            self.orders[order['id']] = order
+
+            if order_type != 'fill-or-kill' or self._available(order) >= qty:
+                self._match(order)
+
+            if order['qty'] and order_type == 'limit':
+                self._sides[direction].add(order)
+            else:
+                order['qty'] = 0
+                order['open'] = False
+
+            self._publish_quote()
+            return _snapshot(order)
+
+    def cancel(self, oid):
+        with self._lock:
+            order = self.orders.get(oid)
+            if order is None:
+                return {'ok': False, 'error': 'Unknown order {}'.format(oid)}
+            if order['open']:
+                self._sides[order['direction']].remove(order)
+                order['qty'] = 0
+                order['open'] = False
+                self._publish_quote()
+            return _snapshot(order)
+
+    def status(self, oid):
+        with self._lock:
+            order = self.orders.get(oid)
+            if order is None:
+                return {'ok': False, 'error': 'Unknown order {}'.format(oid)}
+            return _snapshot(order)
+
+    def account_orders(self, account):
+        with self._lock:
+            return [_snapshot(order) for order in self.orders.values() if order['account'] == account]
+
+    @staticmethod
+    def _crosses(order, price):
+        if order['orderType'] == 'market':
+            return True
+        return price <= order['price'] if order['direction'] == 'buy' else price >= order['price']
+
+    def _opposite(self, order):
+        return self._sides['sell' if order['direction'] == 'buy' else 'buy']
+
+    def _available(self, order):
+        # Quantity the order could fill right now
+        side, total = self._opposite(order), 0
+        for price in side.prices():
+            if not self._crosses(order, price) or total >= order['qty']:
+                break
+            total += side.qty_at(price)
+        return total
+
+    def _match(self, incoming):
+        side = self._opposite(incoming)
+        while incoming['qty']:
+            price = side.best()
+            if price is None or not self._crosses(incoming, price):
+                break
+            standing = side.levels[price][0]
+            qty = min(incoming['qty'], standing['qty'])
+            ts = iso_now()
+            for order in (standing, incoming):
+                order['qty'] -= qty
+                order['totalFilled'] += qty
+                order['fills'].append({'price': price, 'qty': qty, 'ts': ts})
+            if not standing['qty']:
+                standing['open'] = False
+                side.pop_front(price)
+            if not incoming['qty']:
+                incoming['open'] = False
+
+            self._last = {'last': price, 'lastSize': qty, 'lastTrade': ts}
+            self._publish_execution(standing, incoming, price, qty, ts)
+
+    """
+        Market data
+    """
+    def quote(self):
+        with self._lock:
+            quote = {'symbol': self.symbol, 'venue': self.venue, 'quoteTime': iso_now()}
+            for direction, prefix in (('buy', 'bid'), ('sell', 'ask')):
+                side = self._sides[direction]
+                best = side.best()
+                if best is not None:
+                    quote[prefix] = best
+                    quote[prefix + 'Size'] = side.qty_at(best)
+                else:
+                    quote[prefix + 'Size'] = 0
+                quote[prefix + 'Depth'] = side.depth()
+            if self._last:
+                quote.update(self._last)
+            return quote
+
+    def order_book(self):
+        with self._lock:
+            book = {'ok': True, 'venue': self.venue, 'symbol': self.symbol, 'ts': iso_now()}
+            for direction, key in (('buy', 'bids'), ('sell', 'asks')):
+                side = self._sides[direction]
+                book[key] = [{'price': price, 'qty': side.qty_at(price), 'isBuy': direction == 'buy'}
+                             for price in side.prices()]
+            return book
+
+    def _publish_quote(self):
+        if self.on_quote:
+            self.on_quote(self.quote())
+
+    def _publish_execution(self, standing, incoming, price, qty, ts):
+        if not self.on_execution:
+            return
+        for order in (standing, incoming):
+            self.on_execution({
+                'ok': True, 'account': order['account'], 'venue': self.venue, 'symbol': self.symbol,
+                'order': _snapshot(order),
+                'standingId': standing['id'], 'incomingId': incoming['id'],
+                'price': price, 'filled': qty, 'filledAt': ts,
+                'standingComplete': not standing['open'], 'incomingComplete': not incoming['open'],
+            })
+
+
+class Exchange(object):
+    """
+        All the venues / stocks of the simulator. Order ids are unique per venue, as on stockfighter.io
+
+        Public Methods :
+            - engine(venue, stock)  : MatchingEngine of a stock (created on first use)
+            - subscribe(callback)   : callback(channel, message) for every quote ('tickertape')
+                                        and execution ('executions')
+    """
+    def __init__(self, venues=None):
+        self._lock = threading.Lock()
+        self._engines = {}
+        self._ids = {}
+        self._subscribers = []
+        for venue, stocks in (venues or {}).items():
+            for stock in stocks:
+                self.engine(venue, stock)
+
+    def venues(self):
+        return set(venue for venue, _ in self._engines)
+
+    def stocks(self, venue):
+        return [stock for v, stock in self._engines if v == venue]
+
+    def engine(self, venue, stock):
+        with self._lock:
+            key = (venue, stock)
+            if key not in self._engines:
+                ids = self._ids.setdefault(venue, itertools.count(1))
+                self._engines[key] = MatchingEngine(
+                    venue, stock, ids,
+                    on_quote=lambda quote: self._publish('tickertape', {'ok': True, 'quote': quote}),
+                    on_execution=lambda execution: self._publish('executions', execution))
+            return self._engines[key]
+
+    def find_order(self, venue, oid):
+        # MatchingEngine holding order `oid` on the venue, None if unknown
+        for (v, _), engine in list(self._engines.items()):
+            if v == venue and oid in engine.orders:
+                return engine
+        return None
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def _publish(self, channel, message):
+        for callback in list(self._subscribers):
+            callback(channel, message)
@@ -0,0 +1,82 @@
+import random
+import threading
+import time
+from collections import deque
+
+
+class OrderFlowGenerator(object):
+    """
+        Synthetic order flow on one stock, at a configurable rate
+            - the reference price follows a random walk, in cents
+            - limit orders are placed around it, with a mix of the other order types
+            - the oldest resting orders of the generator are cancelled, so that the book stays bounded
+
+        Public Methods :
+            - start() / stop()
+            - step()    : sends one order (used by start, usefull for deterministic runs)
+    """
+    _MIX = (('limit', 0.8), ('immediate-or-cancel', 0.1), ('market', 0.05), ('fill-or-kill', 0.05))
+
+    def __init__(self, engine, rate=10., price=5000, spread=20, max_qty=100, max_open=200,
+                 account='SIMFLOW01', seed=None):
+        """
+            engine      : MatchingEngine
+            rate        : orders per second
+            price       : starting reference price, in cents
+            spread      : limit orders are placed up to `spread` cents away from the reference price
+        """
+        self.engine = engine
+        self.rate = rate
+        self.price = price
+        self.spread = spread
+        self.max_qty = max_qty
+        self.max_open = max_open
+        self.account = account
+        self.sent = 0
+        self._random = random.Random(seed)
+        self._open = deque()
+        self._running = False
+
+    def _order_type(self):
+        draw, total = self._random.random(), 0
+        for order_type, weight in self._MIX:
+            total += weight
+            if draw < total:
+                return order_type
+        return 'limit'
+
+    def step(self):
+        rnd = self._random
+        self.price = max(100, self.price + rnd.choice((-1, 0, 1)) * rnd.randint(0, 5))
+        direction = rnd.choice(('buy', 'sell'))
+        offset = rnd.randint(0, self.spread)
+        price = self.price - offset if direction == 'buy' else self.price + offset
+        order_type = self._order_type()
+
+        res = self.engine.submit(self.account, direction, rnd.randint(1, self.max_qty), price, order_type)
+        self.sent += 1
+        if res.get('open'):
+            self._open.append(res.get('id'))
+        while len(self._open) > self.max_open:
+            self.engine.cancel(self._open.popleft())
+        return res
+
+    def _loop(self):
+        interval = 1. / self.rate
+        next_send = time.time()
+        while self._running:
+            self.step()
+            next_send += interval
+            delay = next_send - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+    def start(self):
+        self._running = True
+        thrd = threading.Thread(target=self._loop)
+        thrd.daemon = True
+        thrd.start()
+        return thrd
+
+    def stop(self):
+        self._running = False
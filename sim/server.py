@@ -0,0 +1,304 @@
+import base64
+import hashlib
+import itertools
+import json
+import queue
+import re
+import select
+import socket
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from .exchange import Exchange
+
+_WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def ws_frame(text, opcode=0x1):
+    # Unmasked, single frame websocket message (server -> client). Text by default
+    payload = text.encode('utf-8') if isinstance(text, str) else text
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def read_ws_frame(rfile):
+    # (opcode, payload) of a client frame (always masked)
+    first, second = struct.unpack('!BB', rfile.read(2))
+    length = second & 0x7f
+    if length == 126:
+        length = struct.unpack('!H', rfile.read(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', rfile.read(8))[0]
+    mask = rfile.read(4) if second & 0x80 else b'\x00' * 4
+    payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(rfile.read(length)))
+    return first & 0x0f, payload
+
+
+class _WebSocketClient(object):
+    """
+        One websocket connection : messages matching its filter are queued,
+            and written to the socket by the handler thread
+    """
+    def __init__(self, channel, account, venue, stock):
+        self.channel = channel
+        self.account = account
+        self.venue = venue
+        self.stock = stock
+        self.messages = queue.Queue()
+
+    def wants(self, channel, message):
+        if channel != self.channel:
+            return False
+        if channel == 'tickertape':
+            quote = message.get('quote', {})
+            return quote.get('venue') == self.venue and self.stock in (None, quote.get('symbol'))
+        return (message.get('account') == self.account and message.get('venue') == self.venue
+                and self.stock in (None, message.get('symbol')))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+        Routes of the venue api (/ob/api), the websockets (/ob/api/ws) and the GameMaster api (/gm)
+    """
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately : without this, every response waits for a delayed ack
+    disable_nagle_algorithm = True
+
+    _ROUTES = (
+        ('GET', r'^/ob/api/heartbeat$', '_heartbeat'),
+        ('GET', r'^/ob/api/venues/(?P<venue>\w+)/heartbeat$', '_venue_heartbeat'),
+        ('GET', r'^/ob/api/venues/(?P<venue>\w+)/stocks/?$', '_stocks'),
+        ('GET', r'^/ob/api/venues/(?P<venue>\w+)/stocks/(?P<stock>\w+)$', '_order_book'),
+        ('GET', r'^/ob/api/venues/(?P<venue>\w+)/stocks/(?P<stock>\w+)/quote$', '_quote'),
+        ('POST', r'^/ob/api/venues/(?P<venue>\w+)/stocks/(?P<stock>\w+)/orders$', '_new_order'),
+        ('GET', r'^/ob/api/venues/(?P<venue>\w+)/stocks/(?P<stock>\w+)/orders/(?P<oid>\d+)$', '_order_status'),
+        ('DELETE', r'^/ob/api/venues/(?P<venue>\w+)/stocks/(?P<stock>\w+)/orders/(?P<oid>\d+)$', '_cancel'),
+        ('POST', r'^/ob/api/venues/(?P<venue>\w+)/stocks/(?P<stock>\w+)/orders/(?P<oid>\d+)/cancel$', '_cancel'),
+        ('GET', r'^/ob/api/venues/(?P<venue>\w+)/accounts/(?P<account>\w+)/orders$', '_account_orders'),
+        ('GET', r'^/ob/api/venues/(?P<venue>\w+)/accounts/(?P<account>\w+)/stocks/(?P<stock>\w+)/orders$',
+         '_account_orders'),
+        ('GET', r'^/ob/api/ws/(?P<account>\w+)/venues/(?P<venue>\w+)/(?P<channel>tickertape|executions)'
+                r'(/stocks/(?P<stock>\w+))?$', '_websocket'),
+        ('POST', r'^/gm/levels/(?P<level>\w+)$', '_gm_start'),
+        ('POST', r'^/gm/instances/(?P<instance>\d+)/(?P<action>stop|restart|resume)$', '_gm_action'),
+        ('GET', r'^/gm/instances/(?P<instance>\d+)$', '_gm_status'),
+    )
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _dispatch(self, method):
+        path = self.path.split('?')[0]
+        for route_method, pattern, name in self._ROUTES:
+            match = re.match(pattern, path)
+            if route_method == method and match:
+                kwargs = {key: value for key, value in match.groupdict().items() if value is not None}
+                return getattr(self, name)(**kwargs)
+        self._reply({'ok': False, 'error': 'Not found : {} {}'.format(method, path)}, status=404)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def _reply(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+
+    """
+        Venue api
+    """
+    @property
+    def _exchange(self):
+        return self.server.exchange
+
+    def _heartbeat(self):
+        self._reply({'ok': True, 'error': ''})
+
+    def _venue_heartbeat(self, venue):
+        if venue in self._exchange.venues():
+            self._reply({'ok': True, 'venue': venue})
+        else:
+            self._reply({'ok': False, 'error': 'No venue exists with the symbol {}'.format(venue)}, status=404)
+
+    def _stocks(self, venue):
+        symbols = [{'name': stock, 'symbol': stock} for stock in self._exchange.stocks(venue)]
+        self._reply({'ok': True, 'symbols': symbols})
+
+    def _order_book(self, venue, stock):
+        self._reply(self._exchange.engine(venue, stock).order_book())
+
+    def _quote(self, venue, stock):
+        quote = self._exchange.engine(venue, stock).quote()
+        quote['ok'] = True
+        self._reply(quote)
+
+    def _new_order(self, venue, stock):
+        order = self._body()
+        res = self._exchange.engine(venue, stock).submit(
+            order.get('account'), order.get('direction'), int(order.get('qty') or 0),
+            int(order.get('price') or 0), order.get('orderType'))
+        self._reply(res, status=200 if res.get('ok') else 400)
+
+    def _order_status(self, venue, stock, oid):
+        self._reply(self._exchange.engine(venue, stock).status(int(oid)))
+
+    def _cancel(self, venue, stock, oid):
+        self._reply(self._exchange.engine(venue, stock).cancel(int(oid)))
+
+    def _account_orders(self, venue, account, stock=None):
+        stocks = [stock] if stock else self._exchange.stocks(venue)
+        orders = []
+        for symbol in stocks:
+            orders.extend(self._exchange.engine(venue, symbol).account_orders(account))
+        self._reply({'ok': True, 'venue': venue, 'orders': orders})
+
+    """
+        Websockets
+    """
+    def _websocket(self, account, venue, channel, stock=None):
+        key = self.headers.get('Sec-WebSocket-Key')
+        if not key:
+            self._reply({'ok': False, 'error': 'Expected a websocket upgrade'}, status=400)
+            return
+
+        accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode('ascii')).digest()).decode('ascii')
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        client = _WebSocketClient(channel, account, venue, stock)
+        self.server.add_client(client)
+        try:
+            while not self.server.closing:
+                # answers pings (client heartbeats), stops on close frames
+                if select.select([self.connection], [], [], 0)[0]:
+                    opcode, payload = read_ws_frame(self.rfile)
+                    if opcode == 0x8:
+                        break
+                    if opcode == 0x9:
+                        self.wfile.write(ws_frame(payload, opcode=0xA))
+                        self.wfile.flush()
+                try:
+                    message = client.messages.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                self.wfile.write(ws_frame(json.dumps(message)))
+                self.wfile.flush()
+        except (socket.error, ValueError, struct.error):
+            pass
+        finally:
+            self.server.remove_client(client)
+            self.close_connection = True
+
+    """
+        GameMaster api
+    """
+    def _gm_start(self, level):
+        self._reply(self.server.start_instance(level))
+
+    def _gm_action(self, instance, action):
+        if action == 'stop':
+            self._reply({'ok': True})
+        else:
+            self._reply(self.server.start_instance(self.server.instances.get(int(instance), 'sim'), int(instance)))
+
+    def _gm_status(self, instance):
+        self._reply({
+            'ok': True, 'done': False, 'id': int(instance), 'state': 'open',
+            'details': {'endOfTheWorldDay': 1000, 'tradingDay': 0},
+        })
+
+
+class ExchangeServer(ThreadingMixIn, HTTPServer):
+    """
+        Local stand-in for stockfighter.io : venue api, GameMaster api, tickertape / executions websockets.
+            Point config.ini [urls] to it :
+                api = http://localhost:8000/ob/api
+                ws  = ws://localhost:8000/ob/api/ws
+                gm  = http://localhost:8000/gm
+
+        Public Methods / Attributes :
+            - exchange                  : Exchange, the matching engines
+            - serve_in_thread()         : starts serving in a daemon thread
+            - close()                   : stops serving
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='localhost', port=8000, venue='TESTEX', stock='FOOBAR', account='EXB123456',
+                 exchange=None, verbose=False):
+        HTTPServer.__init__(self, (host, port), _Handler)
+        self.exchange = exchange if exchange is not None else Exchange({venue: [stock]})
+        self.venue = venue
+        self.stock = stock
+        self.account = account
+        self.verbose = verbose
+        self.closing = False
+        self.instances = {}
+        self._instance_ids = itertools.count(1)
+        self._clients = []
+        self._clients_lock = threading.Lock()
+        self.exchange.subscribe(self._broadcast)
+
+    def add_client(self, client):
+        with self._clients_lock:
+            self._clients.append(client)
+
+    def remove_client(self, client):
+        with self._clients_lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+    def _broadcast(self, channel, message):
+        with self._clients_lock:
+            clients = list(self._clients)
+        for client in clients:
+            if client.wants(channel, message):
+                client.messages.put(message)
+
+    def start_instance(self, level, instance=None):
+        # GameMaster : every level trades the simulator's venue / stock
+        if instance is None:
+            instance = next(self._instance_ids)
+        self.instances[instance] = level
+        return {
+            'ok': True, 'account': self.account, 'instanceId': instance,
+            'tickers': [self.stock], 'venues': [self.venue],
+            'instructions': {}, 'secondsPerTradingDay': 5,
+        }
+
+    def serve_in_thread(self):
+        thrd = threading.Thread(target=self.serve_forever)
+        thrd.daemon = True
+        thrd.start()
+        return thrd
+
+    def close(self):
+        self.closing = True
+        self.shutdown()
+        self.server_close()
@@ -1 +1,18 @@
-from .trader import TraderBook
+from stockfighter import lazy_import
+
+_EXPORTS = {
+    'TraderBook': '.trader',
+    'RiskEngine': '.risk',
+    'RiskLimitExceeded': '.risk',
+    'Strategy': '.strategy',
+    'StrategyRunner': '.strategy',
+    'MarketMakerStrategy': '.strategy',
+    'OrderIndex': '.orderindex',
+    'Backtest': '.backtest',
+    'sweep': '.backtest',
+    'PnLReport': '.pnl',
+}
+
+
+def __getattr__(name):
+    return lazy_import(__name__, _EXPORTS, (), name)
@@ -0,0 +1,228 @@
+"""
+    Backtests : a Strategy, on a TraderBook, run offline over a recorded session
+
+    The TraderBook is the one used live, over a BacktestBroker (api.backtest) : recorded quotes, simulated
+        fills (queue position model), and a simulated clock. Nothing waits for the wall clock, a session of
+        several hours replays in seconds.
+
+    Usage :
+        bt = Backtest(SessionReader.open('TESTEX', 'FOOBAR', 'local'), MarketMakerStrategy(spread=40), timer=1)
+        bt.run()            # dict : pnl, position, fills, volume...
+
+        # every combination of parameters, on all the cores
+        sweep(session_path, MarketMakerStrategy, {'spread': [20, 40, 80], 'qty': [10, 50]}, timer=1)
+"""
+import contextlib
+import itertools
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from stockfighter.api.backtest import BacktestBroker
+from stockfighter.api.tickdata import SessionReader
+from .pnl import PnLReport, fills_from_messages
+from .risk import RiskLimitExceeded
+from .trader import TraderBook
+
+
+class _Discard(object):
+    # stdout of a quiet backtest
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+class Backtest(object):
+    """
+        Runs a Strategy on a TraderBook over a BacktestBroker
+            session     : SessionReader, or path of a recorded session
+            strategy    : Strategy
+            timer       : seconds of simulated time between on_timer calls (None : no timer)
+            risk        : dict of risk limits (see RiskEngine), replacing the ones of config.ini
+            quiet       : discards what the TraderBook prints (one line per cancel...) while running
+
+        Callbacks are called on the calling thread, in the order of the session : each quote (none is
+            coalesced, the strategy takes no simulated time), then the fills and acks it led to, before
+            the next quote. Timers fire at their simulated time, between quotes.
+            An order refused by the risk engine is counted in errors, any other exception stops the run.
+
+        Public Methods / Attributes:
+            - run()         : replays the whole session, returns results()
+            - results()     : dict, pnl (cash + position at the mark, price x 100), realized, unrealized, cash,
+                                max_drawdown (at the fills), position, max_position, orders, fills, volume, quotes,
+                                rejections, errors, sim_seconds, wall_seconds
+            - pnl_report()  : PnLReport of the simulated fills (series per fill, per order...)
+            - broker / tb / strategy
+    """
+    def __init__(self, session, strategy, timer=1., risk=None, quiet=True):
+        if not isinstance(session, SessionReader):
+            session = SessionReader(session)
+        self.quiet = quiet
+        self.timer = timer
+        self.broker = BacktestBroker(session)
+        with self.__output():
+            self.tb = TraderBook(self.broker)
+        if risk:
+            self.tb.risk.set_limits(**risk)
+
+        self.strategy = strategy
+        strategy.runner, strategy.tb, strategy.mb, strategy.ledger = self, self.tb, self.broker, self.tb.ledger
+        self._events = deque()
+        self._last_trade = None
+        self._next_timer = None
+        self.errors = 0
+        self.max_position = 0
+        self._started = self._finished = None
+        self._first = None
+        self.broker.subscribe_quotes(self._on_quote_message)
+        self.broker.subscribe_fills(self._on_fill_message)
+
+    def __output(self):
+        if self.quiet:
+            return contextlib.redirect_stdout(_Discard())
+        return contextlib.nullcontext()
+
+    """
+        Events
+    """
+    def _on_quote_message(self, msg):
+        quote = msg.get('quote')
+        self._events.append(('quote', quote))
+        trade = quote.get('lastTrade')
+        if trade is not None and trade != self._last_trade:
+            if self._last_trade is not None:
+                self._events.append(('trade', quote))
+            self._last_trade = trade
+
+    def _on_fill_message(self, msg):
+        self.max_position = max(self.max_position, abs(self.tb.ledger.position))
+        self._events.append(('fill', msg))
+
+    def _ack(self, res):
+        if res:
+            self._events.append(('ack', res))
+        return res
+
+    def __call(self, name, *args):
+        try:
+            getattr(self.strategy, name)(*args)
+        except RiskLimitExceeded:
+            self.errors += 1
+
+    def __drain(self):
+        strategy, events = self.strategy, self._events
+        while events:
+            kind, payload = events.popleft()
+            if kind == 'quote':
+                strategy.quote = payload
+                self.__call('on_quote', payload)
+            elif kind == 'trade':
+                self.__call('on_trade', payload)
+            elif kind == 'fill':
+                self.__call('on_fill', payload)
+            elif kind == 'ack':
+                self.__call('on_order_ack', payload)
+
+    def __timers(self, until):
+        # on_timer at each simulated time due before `until`
+        if self._next_timer is None:
+            self._next_timer = until + int(self.timer * 10 ** 9)
+        while self._next_timer <= until:
+            self.broker.advance(self._next_timer)
+            self.__call('on_timer')
+            self.__drain()
+            self._next_timer += int(self.timer * 10 ** 9)
+
+    """
+        Running
+    """
+    def run(self):
+        broker = self.broker
+        self._started = time.perf_counter()
+        with self.__output():
+            self.__call('on_start')
+            self.__drain()
+            for recv, msg in broker.session.quotes():
+                if self._first is None:
+                    self._first = recv
+                if self.timer:
+                    self.__timers(recv)
+                broker.deliver(recv, msg)
+                self.__drain()
+            self.__call('on_stop')
+            self.__drain()
+        self._finished = time.perf_counter()
+        return self.results()
+
+    def pnl_report(self):
+        return PnLReport(fills_from_messages(self.broker._get_fills_ws()))
+
+    def results(self):
+        broker, ledger = self.broker, self.tb.ledger
+        pnl = self.pnl_report().summary(mark=broker.mark_price())
+        return {
+            'pnl': broker.cash + ledger.position * broker.mark_price(),
+            'realized': pnl['realized'],
+            'unrealized': pnl['unrealized'],
+            'max_drawdown': pnl['max_drawdown'],
+            'cash': broker.cash,
+            'position': ledger.position,
+            'max_position': self.max_position,
+            'orders': broker.orders_sent,
+            'fills': broker.executions,
+            'volume': broker.volume,
+            'quotes': broker.quotes,
+            'rejections': dict(self.tb.risk.rejections),
+            'errors': self.errors,
+            'sim_seconds': (broker.clock() - self._first) / 1e9 if self._first is not None else 0.,
+            'wall_seconds': (self._finished or time.perf_counter()) - (self._started or time.perf_counter()),
+        }
+
+
+def _run_one(path, strategy, params, kwargs):
+    # One configuration of a sweep, in a worker process
+    return Backtest(path, strategy(**params), **kwargs).run()
+
+
+def sweep(session, strategy, grid, processes=None, **kwargs):
+    """
+        Backtests every combination of parameters, on a pool of processes (one per core by default)
+            session     : SessionReader, or path of a recorded session
+            strategy    : Strategy class (or any picklable callable returning a Strategy), called with
+                            the parameters of each combination
+            grid        : dict parameter -> list of values
+            processes   : size of the pool. 1 : runs in this process, one combination after the other
+            kwargs      : given to Backtest (timer, risk...)
+        returns a list of dicts, one per combination in grid order : Backtest.results() and 'params',
+            or 'params' and 'error' (repr of the exception raised)
+
+        Workers are spawned, not forked : the strategy must be importable by them (a module, or the
+            __main__ of a script run with `if __name__ == '__main__':`)
+    """
+    path = session.path if isinstance(session, SessionReader) else session
+    names = sorted(grid)
+    combinations = [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+    if processes == 1:
+        outcomes = []
+        for params in combinations:
+            try:
+                outcomes.append((_run_one(path, strategy, params, kwargs), None))
+            except Exception as e:
+                outcomes.append((None, e))
+    else:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [pool.submit(_run_one, path, strategy, params, kwargs) for params in combinations]
+            outcomes = [(None, future.exception()) if future.exception() else (future.result(), None)
+                        for future in futures]
+
+    results = []
+    for params, (result, error) in zip(combinations, outcomes):
+        if error is not None:
+            result = {'error': repr(error)}
+        result['params'] = params
+        results.append(result)
+    return results
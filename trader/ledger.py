@@ -0,0 +1,154 @@
+import threading
+
+
+class PositionLedger(object):
+    """
+        Position and open orders, maintained incrementally from order events
+            - on_ack(res)       : response of a buy / sell. Registers the order
+            - on_fill(msg)      : message from the executions websocket
+            - on_order(order)   : any order status (cancel response, REST status...)
+        Each update is O(1) (the fills of an order are only walked the first time it is seen),
+            and book() is a constant time read.
+
+        Fills are applied as the increase of the order's totalFilled, so replaying a message,
+            or receiving the response after the fills, never counts a fill twice.
+
+        Public Methods / Attributes:
+            - book()        : dict, same format as TraderBook.book
+            - position      : int, current number of owned / short shares
+            - is_open(oid) / open_orders() / open_qty(side) / open_notional(side)
+            - from_orders() : classmethod, rebuilds a ledger from stored orders (recovery)
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        # oid -> [direction (+1 / -1), limit price, originalQty, filled, open]
+        self._orders = {}
+        self.position = 0
+        self._net_cost = 0.
+        # side -> [open qty, sum of open qty x limit price]
+        self._open = {'buy': [0, 0.], 'sell': [0, 0.]}
+
+    @classmethod
+    def from_orders(cls, orders):
+        """
+            Rebuilds a ledger from order statuses, as stored in the `orders` table, with their `fills` (stored
+                in the `fills` table). The filled shares of an order stored without fills are valued at its limit price.
+        """
+        ledger = cls()
+        for order in orders:
+            ledger.on_order(order)
+        return ledger
+
+    @staticmethod
+    def _side(sign):
+        return 'buy' if sign > 0 else 'sell'
+
+    def _register(self, order):
+        oid = order.get('id')
+        state = self._orders.get(oid)
+        if state is None:
+            sign = 1 if order.get('direction') == 'buy' else -1
+            state = [sign, order.get('price') or 0, order.get('originalQty') or 0, 0, True]
+            self._orders[oid] = state
+            side = self._open[self._side(sign)]
+            side[0] += state[2]
+            side[1] += state[2] * state[1]
+        return state
+
+    def _fill(self, state, total_filled, price):
+        """
+            Moves the order to `total_filled` shares filled, the new shares being valued at `price`
+        """
+        qty = total_filled - state[3]
+        if qty <= 0:
+            return
+
+        sign = state[0]
+        state[3] = total_filled
+        self.position += sign * qty
+        self._net_cost += sign * qty * price
+
+        if state[4]:
+            side = self._open[self._side(sign)]
+            side[0] -= qty
+            side[1] -= qty * state[1]
+
+    def _close(self, state):
+        if state[4]:
+            remaining = state[2] - state[3]
+            side = self._open[self._side(state[0])]
+            side[0] -= remaining
+            side[1] -= remaining * state[1]
+            state[4] = False
+
+    @staticmethod
+    def _avg_fill_price(order):
+        fills = order.get('fills') or []
+        qty = sum(fill.get('qty') for fill in fills)
+        if qty:
+            return sum(fill.get('qty') * fill.get('price') for fill in fills) / qty
+        return order.get('price') or 0
+
+    def on_order(self, order):
+        """
+            Applies an order status : new shares filled (valued at the average of its fills),
+                and closes it if it is not open anymore
+        """
+        with self._lock:
+            state = self._register(order)
+            if (order.get('totalFilled') or 0) > state[3]:
+                self._fill(state, order.get('totalFilled'), self._avg_fill_price(order))
+            if not order.get('open', True):
+                self._close(state)
+
+    def on_ack(self, res):
+        if res:
+            self.on_order(res)
+
+    def on_fill(self, msg):
+        """
+            Applies one execution message. The fill itself is valued at its own price.
+        """
+        order = msg.get('order') or {}
+        if order.get('id') is None:
+            return
+        with self._lock:
+            state = self._register(order)
+            total_filled = order.get('totalFilled')
+            if total_filled is None:
+                total_filled = state[3] + (msg.get('filled') or 0)
+            self._fill(state, total_filled, msg.get('price', state[1]))
+            if not order.get('open', True):
+                self._close(state)
+
+    """
+        Reads
+    """
+    def is_open(self, oid):
+        state = self._orders.get(oid)
+        return state is not None and state[4]
+
+    def open_orders(self):
+        # [(oid, direction, limit price)] of the orders still open
+        with self._lock:
+            return [(oid, self._side(state[0]), state[1]) for oid, state in self._orders.items() if state[4]]
+
+    def open_qty(self, side):
+        # shares of the open orders on one side ('buy' / 'sell')
+        return self._open[side][0]
+
+    def open_notional(self, side):
+        # sum of open shares x limit price, on one side
+        return self._open[side][1]
+
+    @staticmethod
+    def _qty_pps(qty, value):
+        return {'qty': qty, 'pps': value / qty if qty else 0}
+
+    def book(self):
+        with self._lock:
+            return {
+                'position':     self._qty_pps(self.position, self._net_cost),
+                'open_buy':     self._qty_pps(*self._open['buy']),
+                'open_sell':    self._qty_pps(*self._open['sell']),
+            }
@@ -0,0 +1,149 @@
+import heapq
+import threading
+
+from stockfighter.lib.timestamps import one_to_ns, now_ns
+
+
+class OrderIndex(object):
+    """
+        Our orders, indexed in memory : no REST call, no scan of the polled orders
+            - on_ack(res)       : response of a buy / sell
+            - on_fill(msg)      : message from the executions websocket
+            - on_order(order)   : any order status (cancel response, REST status, stored order...)
+            - forget(oid)       : drops an order the venue does not know (refused cancel)
+
+        Open orders are kept per side, per (side, price), and in a heap per side by placement time.
+            Orders closed since are only dropped from a heap when they reach its top,
+            so every update and lookup is O(1) (heap : O(log n)).
+
+        Public Methods / Attributes:
+            - get(oid)                  : latest status seen of an order (dict), or None
+            - is_open(oid)
+            - open_ids(side)            : set of the ids of the open orders (side : 'buy', 'sell', None for both)
+            - at_price(price, side)     : set of the ids of the open orders at a price
+            - oldest(side)              : (placed ns, oid) of the oldest open order, or None
+            - older_than(seconds)       : ids of the open orders placed more than `seconds` ago, oldest first
+        clock : nanoseconds since epoch (defaults to the wall clock ; a backtest gives its simulated one)
+    """
+    def __init__(self, clock=None):
+        self._clock = clock or now_ns
+        self._lock = threading.RLock()
+        self._orders = {}
+        self._open = {'buy': set(), 'sell': set()}
+        self._prices = {}
+        # side -> heap of (placed ns, oid)
+        self._placed = {'buy': [], 'sell': []}
+
+    def _placed_ns(self, order):
+        ts = order.get('ts')
+        return one_to_ns(ts) if ts else self._clock()
+
+    def on_order(self, order):
+        oid = order.get('id')
+        if oid is None:
+            return
+        with self._lock:
+            known = self._orders.get(oid)
+            if known is None:
+                known = dict(order)
+                known.pop('fills', None)
+                self._orders[oid] = known
+                if known.get('open', True):
+                    self._add(oid, known)
+                return
+            if (order.get('totalFilled') or 0) < (known.get('totalFilled') or 0):
+                # older than the status we have
+                return
+            was_open = known.get('open', True)
+            known.update((key, value) for key, value in order.items() if key != 'fills')
+            if not was_open:
+                known['open'] = False
+            elif not known.get('open', True):
+                self._remove(oid, known)
+
+    def on_ack(self, res):
+        if res:
+            self.on_order(res)
+
+    def on_fill(self, msg):
+        order = msg.get('order')
+        if order:
+            self.on_order(order)
+
+    def forget(self, oid):
+        with self._lock:
+            order = self._orders.pop(oid, None)
+            if order is not None:
+                self._remove(oid, order)
+
+    def _add(self, oid, order):
+        side, price = order.get('direction'), order.get('price')
+        self._open[side].add(oid)
+        self._prices.setdefault((side, price), set()).add(oid)
+        heapq.heappush(self._placed[side], (self._placed_ns(order), oid))
+
+    def _remove(self, oid, order):
+        side, price = order.get('direction'), order.get('price')
+        self._open[side].discard(oid)
+        at_price = self._prices.get((side, price))
+        if at_price is not None:
+            at_price.discard(oid)
+            if not at_price:
+                del self._prices[(side, price)]
+
+    """
+        Reads
+    """
+    def get(self, oid):
+        return self._orders.get(oid)
+
+    def is_open(self, oid):
+        order = self._orders.get(oid)
+        return order is not None and order.get('open', True)
+
+    def open_ids(self, side=None):
+        with self._lock:
+            if side is None:
+                return self._open['buy'] | self._open['sell']
+            return set(self._open[side])
+
+    def at_price(self, price, side=None):
+        with self._lock:
+            sides = ('buy', 'sell') if side is None else (side,)
+            return set().union(*(self._prices.get((s, price), ()) for s in sides))
+
+    def _top(self, side):
+        # oldest open order of a side, once the closed ones are dropped from the top of its heap
+        heap = self._placed[side]
+        while heap and not self.is_open(heap[0][1]):
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def oldest(self, side=None):
+        with self._lock:
+            tops = [self._top(s) for s in (('buy', 'sell') if side is None else (side,))]
+            tops = [top for top in tops if top is not None]
+            return min(tops) if tops else None
+
+    def older_than(self, seconds):
+        """
+            Ids of the open orders placed before now - seconds, oldest first. Only the orders
+                returned (and the closed ones met on the way) are looked at.
+        """
+        cutoff = self._clock() - int(seconds * 10 ** 9)
+        stale = []
+        with self._lock:
+            for heap in self._placed.values():
+                kept = []
+                while heap and heap[0][0] < cutoff:
+                    entry = heapq.heappop(heap)
+                    if self.is_open(entry[1]):
+                        kept.append(entry)
+                # they stay indexed until a cancel (or fill) closes them
+                for entry in kept:
+                    heapq.heappush(heap, entry)
+                stale.extend(kept)
+        return [oid for _, oid in sorted(stale)]
+
+    def __len__(self):
+        return len(self._open['buy']) + len(self._open['sell'])
@@ -0,0 +1,240 @@
+"""
+    P&L and inventory analytics over the fills history, vectorized
+
+    Fills are loaded in bulk into numpy columns (ts, oid, sign, qty, price), then every series is computed
+        with whole-array operations, in one pass over the history :
+        - FIFO matching : the k-th share bought is matched with the k-th share sold, whatever the order they
+            came in (a position flipping sides included). With B / S the shares bought / sold so far, and
+            cost(x) the cost of the first x shares of a side (piecewise linear, np.interp over the cumulated
+            lots), realized = sells(min(B, S)) - buys(min(B, S)), and the open inventory is what is left
+            of the side ahead.
+        - unrealized : position x mark - cost of the open inventory. The mark is the mid of the latest quote
+            before the fill when quotes are given, the fill price otherwise
+        - spread capture : shares x (mid - price), signed so that buying below / selling above the mid is positive
+        - drawdown : from the running maximum of realized + unrealized
+    Prices are price x 100, as everywhere else.
+
+    Usage :
+        report = TB.pnl_report()        # or PnLReport(fills_from_orders(orders, messages), marks_from_store(store))
+        report.summary()                # realized, unrealized, total, position, cost_basis, max_drawdown...
+        report.realized, report.position, report.drawdown     # one value per fill
+        report.by_order()               # per order : shares, vwap, realized, spread capture
+        report.to_frame()
+"""
+from collections import Counter
+
+import numpy as np
+
+from stockfighter.lib.timestamps import one_to_ns, to_ns
+
+FILL_FIELDS = (
+    ('ts', np.int64),
+    ('oid', np.int64),
+    ('sign', np.int8),
+    ('qty', np.int64),
+    ('price', np.float64),
+)
+
+
+def _columns(ts, oid, sign, qty, price):
+    return {
+        'ts': to_ns(ts),
+        'oid': np.asarray(oid, dtype=np.int64),
+        'sign': np.asarray(sign, dtype=np.int8),
+        'qty': np.asarray(qty, dtype=np.int64),
+        'price': np.asarray(price, dtype=np.float64),
+    }
+
+
+def _sign(order):
+    return 1 if order.get('direction') == 'buy' else -1
+
+
+def fills_from_messages(messages):
+    """
+        Fill columns of execution messages (FillLog, websocket format) : one fill per message
+    """
+    messages = [msg for msg in messages if msg.get('filled') and (msg.get('order') or {}).get('id') is not None]
+    orders = [msg.get('order') for msg in messages]
+    return _columns([msg.get('filledAt') for msg in messages],
+                    [order.get('id') for order in orders],
+                    [_sign(order) for order in orders],
+                    [msg.get('filled') for msg in messages],
+                    [msg.get('price') for msg in messages])
+
+
+def fills_from_orders(orders, messages=()):
+    """
+        Fill columns of our orders, as complete as the sources allow
+            orders      : order statuses (orders table, REST responses...), several per order are fine
+            messages    : execution messages. An order's fills come from its messages first
+        The shares of an order not covered by messages come from its own `fills` list (REST statuses, stored
+            fills), less the fills a message already gave (same ts, qty and price), or are valued at its limit
+            price, at its placement time (orders stored without their fills)
+    """
+    fills = fills_from_messages(messages)
+    covered = {}
+    # (oid, ts, qty, price) -> number of messages
+    seen = Counter()
+    if len(fills['oid']):
+        oids, inverse = np.unique(fills['oid'], return_inverse=True)
+        covered = dict(zip(oids.tolist(), np.bincount(inverse, weights=fills['qty']).tolist()))
+        seen = Counter(zip(fills['oid'].tolist(), fills['ts'].tolist(), fills['qty'].tolist(), fills['price'].tolist()))
+
+    latest = {}
+    for order in orders:
+        oid = order.get('id')
+        known = latest.get(oid)
+        if oid is not None and (known is None or (order.get('totalFilled') or 0) >= (known.get('totalFilled') or 0)):
+            latest[oid] = order
+
+    ts, oid, sign, qty, price = [], [], [], [], []
+    for order_id, order in latest.items():
+        missing = (order.get('totalFilled') or 0) - covered.get(order_id, 0)
+        if missing <= 0:
+            continue
+        side = _sign(order)
+        for fill in order.get('fills') or []:
+            if missing <= 0:
+                break
+            key = (order_id, one_to_ns(fill.get('ts')), fill.get('qty'), float(fill.get('price') or 0))
+            if seen[key]:
+                seen[key] -= 1
+                continue
+            take = min(missing, fill.get('qty') or 0)
+            if take <= 0:
+                continue
+            ts.append(fill.get('ts'))
+            oid.append(order_id)
+            sign.append(side)
+            qty.append(take)
+            price.append(fill.get('price'))
+            missing -= take
+        if missing > 0:
+            ts.append(order.get('ts'))
+            oid.append(order_id)
+            sign.append(side)
+            qty.append(missing)
+            price.append(order.get('price') or 0)
+
+    if not ts:
+        return fills
+    extra = _columns(ts, oid, sign, qty, price)
+    return {name: np.concatenate([fills[name], extra[name]]) for name, _ in FILL_FIELDS}
+
+
+def marks_from_store(store):
+    """
+        (quote times ns, mids) of the quotes held in a QuoteStore, for the marks and the spread capture
+    """
+    cols = store.columns(['quoteTime', 'bid', 'ask'])
+    mid = (cols['bid'] + cols['ask']) / 2.
+    keep = mid == mid
+    return cols['quoteTime'][keep], mid[keep]
+
+
+def _cost(x, cum_qty, cum_value):
+    # cost of the first x shares of a side : linear within each lot
+    return np.interp(x, np.concatenate(([0], cum_qty)), np.concatenate(([0.], cum_value)))
+
+
+class PnLReport(object):
+    """
+        P&L, inventory and cost basis after each fill (see the module docstring)
+            fills   : dict of columns (fills_from_orders / fills_from_messages)
+            marks   : (times ns, mids), optional (marks_from_store)
+
+        Public Methods / Attributes, arrays with one value per fill, in time order :
+            - ts / oid / sign / qty / price             : the fills
+            - position / cost_basis                     : inventory, and average price of its FIFO lots (NaN when flat)
+            - realized / unrealized / total / drawdown  : cumulated P&L (price x 100 x shares)
+            - mid / spread_capture                      : mid at the fill (NaN without quotes), and what it captured
+            - summary(mark)     : dict of the final values. mark : price to value the position at, defaults to the last one
+            - by_order()        : dict of arrays : oid, qty, vwap, realized, spread_capture
+            - to_frame()        : DataFrame of the series, indexed on the fill times
+    """
+    def __init__(self, fills, marks=None):
+        order = np.argsort(fills['ts'], kind='stable')
+        keep = order[fills['qty'][order] > 0]
+        self.ts = fills['ts'][keep]
+        self.oid = fills['oid'][keep]
+        self.sign = fills['sign'][keep].astype(np.int64)
+        self.qty = fills['qty'][keep]
+        self.price = fills['price'][keep]
+        self.__compute(marks)
+
+    def __compute(self, marks):
+        buys = self.sign > 0
+        value = self.qty * self.price
+        bought = np.cumsum(np.where(buys, self.qty, 0))
+        sold = np.cumsum(np.where(buys, 0, self.qty))
+        # cost of all the shares bought / sold so far : no interpolation needed
+        bought_value = np.cumsum(np.where(buys, value, 0.))
+        sold_value = np.cumsum(np.where(buys, 0., value))
+        matched = np.minimum(bought, sold)
+
+        buy_matched = _cost(matched, bought[buys], bought_value[buys])
+        sell_matched = _cost(matched, sold[~buys], sold_value[~buys])
+
+        self.position = bought - sold
+        self.realized = sell_matched - buy_matched
+        # signed : cost of the long lots, minus the proceeds of the short ones
+        self._open_cost = (bought_value - buy_matched) - (sold_value - sell_matched)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.cost_basis = np.where(self.position != 0, self._open_cost / self.position, np.nan)
+
+        self.mid = np.full(len(self.ts), np.nan)
+        if marks is not None and len(marks[0]):
+            times, mids = marks
+            idx = np.searchsorted(times, self.ts, side='right') - 1
+            found = idx >= 0
+            self.mid[found] = mids[idx[found]]
+        self.mark = np.where(self.mid == self.mid, self.mid, self.price)
+        self.spread_capture = self.sign * (self.mid - self.price) * self.qty
+
+        self.unrealized = self.position * self.mark - self._open_cost
+        self.total = self.realized + self.unrealized
+        self.drawdown = np.maximum.accumulate(self.total) - self.total if len(self.total) else self.total
+
+    def __len__(self):
+        return len(self.ts)
+
+    def summary(self, mark=None):
+        if not len(self):
+            return {'fills': 0, 'volume': 0, 'position': 0, 'realized': 0., 'unrealized': 0., 'total': 0.,
+                    'cost_basis': None, 'max_drawdown': 0., 'spread_capture': 0.}
+        mark = self.mark[-1] if mark is None else mark
+        unrealized = self.position[-1] * mark - self._open_cost[-1]
+        return {
+            'fills': len(self),
+            'volume': int(self.qty.sum()),
+            'position': int(self.position[-1]),
+            'realized': float(self.realized[-1]),
+            'unrealized': float(unrealized),
+            'total': float(self.realized[-1] + unrealized),
+            'cost_basis': None if self.position[-1] == 0 else float(self.cost_basis[-1]),
+            'max_drawdown': float(self.drawdown.max()),
+            'spread_capture': float(np.nansum(self.spread_capture)),
+        }
+
+    def by_order(self):
+        # The realized P&L of a fill is attributed to its order : the one closing the position
+        oids, inverse = np.unique(self.oid, return_inverse=True)
+        realized = np.diff(self.realized, prepend=0.)
+        qty = np.bincount(inverse, weights=self.qty)
+        return {
+            'oid': oids,
+            'qty': qty.astype(np.int64),
+            'vwap': np.bincount(inverse, weights=self.qty * self.price) / qty,
+            'realized': np.bincount(inverse, weights=realized),
+            'spread_capture': np.bincount(inverse, weights=np.nan_to_num(self.spread_capture)),
+        }
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame({
+            'oid': self.oid, 'sign': self.sign, 'qty': self.qty, 'price': self.price,
+            'position': self.position, 'cost_basis': self.cost_basis, 'realized': self.realized,
+            'unrealized': self.unrealized, 'total': self.total, 'drawdown': self.drawdown,
+            'mid': self.mid, 'spread_capture': self.spread_capture,
+        }, index=pd.to_datetime(self.ts, utc=True))
@@ -0,0 +1,232 @@
+import heapq
+import numbers
+import threading
+import time
+from collections import Counter
+
+from stockfighter import config
+
+
+class RiskLimitExceeded(Exception):
+    """
+        An order refused by the RiskEngine. `check` is the name of the limit it breaks
+    """
+    def __init__(self, check, message):
+        Exception.__init__(self, '{} : {}'.format(check, message))
+        self.check = check
+        self.message = message
+
+    def __reduce__(self):
+        # raised again as is in the process calling an OrderGateway
+        return type(self), (self.check, self.message)
+
+
+class RiskEngine(object):
+    """
+        Pre-trade checks, between TraderBook and MarketBroker
+            - max_position  : |position| once every open order (and this one) is filled
+            - max_open      : open shares per side, this order included
+            - max_notional  : open shares x limit price per side (price x 100), this order included
+            - max_rate      : orders per second (token bucket, bursts up to max_rate orders)
+            - price_band    : limit price within price_band (0.05 : 5%) of the mid (or last) quote
+            - self_cross    : refuses an order that would trade against one of our own open orders
+            - invalid       : direction other than buy / sell, qty not a non negative integer, price not a number
+        A limit set to 0 (or False) is not checked. Limits not given (None) are read from the [risk] section of config.ini.
+
+        Every check reads counters maintained as events arrive : the PositionLedger (position, open
+            shares), the latest quote (a quotes subscriber), orders in flight (reserved by check(),
+            released by done()), and the best of our open buys / sells (heaps, whose closed orders
+            are only popped when they reach the top). A check is O(1), amortized.
+
+        Usage (TraderBook does it on every order) :
+            risk.check('buy', qty, price, 'limit')      # raises RiskLimitExceeded
+            res = mb._buy(qty, price)
+            risk.done('buy', qty, price, res)
+
+        Public Methods / Attributes:
+            - check(direction, qty, price, order_type)
+            - done(direction, qty, price, res)  : response (or None on failure) of a checked order
+            - on_quote(msg)                 : tickertape subscriber
+            - kill(reason) / revive()       : kill switch. Once killed, every order is refused
+                                                and on_kill() is called (TraderBook : cancel all)
+            - killed, rejections (Counter check -> orders refused)
+            - status()                      : dict, limits and current usage
+            - set_limits(**limits)          : changes limits (same names as the arguments)
+        clock : nanoseconds, for the rate limit (defaults to time.monotonic_ns ; a backtest gives its simulated one)
+    """
+    _LIMITS = ('max_position', 'max_open', 'max_notional', 'max_rate', 'price_band', 'self_cross')
+
+    def __init__(self, ledger, max_position=None, max_open=None, max_notional=None, max_rate=None,
+                 price_band=None, self_cross=None, on_kill=None, clock=None):
+        self._ledger = ledger
+        # None : the [risk] section of config.ini. An explicit 0 turns the limit off
+        self.max_position = max_position if max_position is not None else \
+            config.getint('risk', 'max_position', fallback=0)
+        self.max_open = max_open if max_open is not None else config.getint('risk', 'max_open', fallback=0)
+        self.max_notional = max_notional if max_notional is not None else \
+            config.getint('risk', 'max_notional', fallback=0)
+        self.max_rate = max_rate if max_rate is not None else config.getfloat('risk', 'max_rate', fallback=0)
+        self.price_band = price_band if price_band is not None else \
+            config.getfloat('risk', 'price_band', fallback=0)
+        self.self_cross = self_cross if self_cross is not None else \
+            config.getboolean('risk', 'self_cross', fallback=False)
+        self.on_kill = on_kill
+        self._clock = clock or time.monotonic_ns
+
+        self._lock = threading.Lock()
+        # shares / notional of the orders checked, not answered yet
+        self._in_flight = {'buy': [0, 0.], 'sell': [0, 0.]}
+        # token bucket
+        self._tokens = self.max_rate
+        self._refilled = self._clock()
+        # latest quote
+        self._reference = None
+        # our open orders, best first : (-price, oid) for buys, (price, oid) for sells
+        self._bids = []
+        self._asks = []
+        for oid, direction, price in ledger.open_orders():
+            self._push(oid, direction, price)
+
+        self.killed = None
+        self.rejections = Counter()
+
+    """
+        Events
+    """
+    def on_quote(self, msg):
+        quote = msg.get('quote') if msg.get('ok') else None
+        if quote is None:
+            return
+        # (x == x) is False for the NaNs of a quote read from the store
+        bid, ask, last = quote.get('bid'), quote.get('ask'), quote.get('last')
+        if bid and ask and bid == bid and ask == ask:
+            self._reference = (bid + ask) / 2.
+        elif last and last == last:
+            self._reference = last
+
+    def _push(self, oid, direction, price):
+        if direction == 'buy':
+            heapq.heappush(self._bids, (-price, oid))
+        else:
+            heapq.heappush(self._asks, (price, oid))
+
+    def done(self, direction, qty, price, res):
+        with self._lock:
+            flight = self._in_flight[direction]
+            flight[0] -= qty
+            flight[1] -= qty * (price or 0)
+            if res and res.get('open') and res.get('price'):
+                self._push(res.get('id'), direction, res.get('price'))
+
+    """
+        Checks
+    """
+    def _best(self, heap):
+        # top of the heap, once the orders closed since are popped
+        is_open = self._ledger.is_open
+        while heap and not is_open(heap[0][1]):
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def _reject(self, check, message):
+        self.rejections[check] += 1
+        raise RiskLimitExceeded(check, message)
+
+    def check(self, direction, qty, price=None, order_type='limit'):
+        """
+            Raises RiskLimitExceeded if the order breaks a limit. Otherwise reserves it as in flight,
+                until done() is called with its response.
+        """
+        if self.killed:
+            self._reject('killed', self.killed)
+        if direction not in self._in_flight:
+            self._reject('invalid', 'direction must be buy or sell, got {}'.format(direction))
+        if not isinstance(qty, numbers.Integral) or isinstance(qty, bool) or qty < 0:
+            self._reject('invalid', 'qty must be a non negative integer, got {}'.format(qty))
+        if price is not None and (not isinstance(price, numbers.Real) or isinstance(price, bool) or price < 0):
+            self._reject('invalid', 'price must be a non negative number, got {}'.format(price))
+        market = order_type == 'market' or not price
+        price = price or 0
+
+        with self._lock:
+            ledger, flight = self._ledger, self._in_flight[direction]
+            sign = 1 if direction == 'buy' else -1
+
+            if self.max_rate:
+                now = self._clock()
+                self._tokens = min(self.max_rate, self._tokens + (now - self._refilled) / 1e9 * self.max_rate)
+                self._refilled = now
+                if self._tokens < 1:
+                    self._reject('max_rate', 'more than {} orders / second'.format(self.max_rate))
+
+            open_qty = ledger.open_qty(direction) + flight[0] + qty
+            if self.max_open and open_qty > self.max_open:
+                self._reject('max_open', '{} shares open on the {} side, limit {}'.format(
+                    open_qty, direction, self.max_open))
+
+            if self.max_position:
+                position = ledger.position + sign * open_qty
+                if abs(position) > self.max_position:
+                    self._reject('max_position', 'position up to {}, limit {}'.format(position, self.max_position))
+
+            if self.max_notional and not market:
+                notional = ledger.open_notional(direction) + flight[1] + qty * price
+                if notional > self.max_notional:
+                    self._reject('max_notional', '{:.0f} open on the {} side, limit {}'.format(
+                        notional, direction, self.max_notional))
+
+            if self.price_band and not market and self._reference:
+                deviation = abs(price - self._reference) / self._reference
+                if deviation > self.price_band:
+                    self._reject('price_band', 'price {} is {:.1%} away from {:.0f}'.format(
+                        price, deviation, self._reference))
+
+            if self.self_cross:
+                if direction == 'buy':
+                    best = self._best(self._asks)
+                    crosses = best is not None and (market or price >= best)
+                else:
+                    best = self._best(self._bids)
+                    crosses = best is not None and (market or price <= -best)
+                if crosses:
+                    self._reject('self_cross', '{} at {} would trade against our own order at {}'.format(
+                        direction, 'market' if market else price, abs(best)))
+
+            if self.max_rate:
+                self._tokens -= 1
+            flight[0] += qty
+            flight[1] += qty * price
+
+    def set_limits(self, **limits):
+        for name, value in limits.items():
+            if name not in self._LIMITS:
+                raise Exception('Unknown risk limit {}, must be one of : [{}]'.format(name, ', '.join(self._LIMITS)))
+            setattr(self, name, value)
+        with self._lock:
+            self._tokens = self.max_rate
+
+    """
+        Kill switch
+    """
+    def kill(self, reason='kill switch'):
+        self.killed = reason
+        print('Risk : trading killed ({})'.format(reason))
+        if self.on_kill is not None:
+            return self.on_kill()
+
+    def revive(self):
+        self.killed = None
+
+    def status(self):
+        ledger = self._ledger
+        return {
+            'killed': self.killed,
+            'position': ledger.position,
+            'open_buy': ledger.open_qty('buy') + self._in_flight['buy'][0],
+            'open_sell': ledger.open_qty('sell') + self._in_flight['sell'][0],
+            'reference': self._reference,
+            'limits': {'max_position': self.max_position, 'max_open': self.max_open,
+                       'max_notional': self.max_notional, 'max_rate': self.max_rate,
+                       'price_band': self.price_band, 'self_cross': self.self_cross},
+            'rejections': dict(self.rejections),
+        }
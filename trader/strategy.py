@@ -0,0 +1,324 @@
+"""
+    Event-driven strategies
+
+    A Strategy reacts to events instead of polling current_quote() / get_own_book() in a loop :
+        on_quote(quote)     : latest tickertape quote (QuoteRecord)
+        on_trade(quote)     : a quote reporting a new trade (last / lastSize / lastTrade)
+        on_fill(msg)        : execution message of one of our orders (the ledger is already up to date)
+        on_order_ack(res)   : response of an order sent by the strategy
+        on_timer()          : every `timer` seconds
+        on_start() / on_stop()
+
+    A StrategyRunner subscribes to the websocket listeners of the TraderBook's MarketBroker, and calls
+        the callbacks one at a time, in order, on its own thread. Quotes are coalesced : while the strategy
+        is busy, a newer quote replaces the one waiting, so it never works on a stale quote. Trades, fills,
+        acks and timers are all delivered.
+
+    Usage :
+        runner = StrategyRunner(MarketMakerStrategy(spread=40, qty=50), TB, timer=1)
+        runner.start()
+        ...
+        runner.stats()      # per callback : calls, errors, run time and queue delay percentiles
+        runner.stop()
+"""
+import threading
+import time
+from collections import deque
+
+from stockfighter.lib.latency import LatencyHistogram
+from stockfighter.lib.scheduler import get_scheduler
+from .risk import RiskLimitExceeded
+
+CALLBACKS = ('on_quote', 'on_trade', 'on_fill', 'on_order_ack', 'on_timer', 'on_start', 'on_stop')
+
+
+class Strategy(object):
+    """
+        Base class of the strategies : override the callbacks needed.
+            Orders sent through buy / sell / submit_many get their response back in on_order_ack.
+
+        Public Attributes, once attached to a StrategyRunner :
+            - tb / mb / ledger  : TraderBook, its MarketBroker and PositionLedger
+            - quote             : latest quote seen
+    """
+    runner = None
+    tb = mb = ledger = None
+    quote = None
+
+    def on_start(self):
+        pass
+
+    def on_stop(self):
+        pass
+
+    def on_quote(self, quote):
+        pass
+
+    def on_trade(self, quote):
+        pass
+
+    def on_fill(self, msg):
+        pass
+
+    def on_order_ack(self, res):
+        pass
+
+    def on_timer(self):
+        pass
+
+    """
+        Orders
+    """
+    def buy(self, qty, price=None, order_type='limit'):
+        return self.runner._ack(self.tb.buy(qty, price, order_type))
+
+    def sell(self, qty, price=None, order_type='limit'):
+        return self.runner._ack(self.tb.sell(qty, price, order_type))
+
+    def submit_many(self, orders):
+        results = self.tb.submit_many(orders)
+        for result in results:
+            self.runner._ack(result.response)
+        return results
+
+    def cancel_many(self, oids):
+        return self.tb.cancel_many(oids)
+
+
+class _Timing(object):
+    # Run time and queue delay (event received -> callback called) of one callback
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.run = LatencyHistogram()
+        self.delay = LatencyHistogram()
+
+    def snapshot(self):
+        run, delay = self.run.snapshot(), self.delay.snapshot()
+        stats = {'calls': self.calls, 'errors': self.errors}
+        for prefix, snapshot in (('run', run), ('delay', delay)):
+            for key in ('mean_us', 'p50_us', 'p99_us', 'max_us'):
+                if key in snapshot:
+                    stats['{}_{}'.format(prefix, key)] = snapshot[key]
+        return stats
+
+
+class StrategyRunner(object):
+    """
+        Drives a Strategy from the websockets of a TraderBook's MarketBroker
+            strategy    : Strategy
+            traderbook  : TraderBook
+            timer       : seconds between on_timer calls (None : no timer)
+
+        Public Methods / Attributes:
+            - start() / stop() / wait(timeout)
+            - stats()       : dict callback -> calls, errors, run / delay (mean, p50, p99, max in µs),
+                                and the number of quotes coalesced
+            - coalesced     : quotes replaced by a newer one before the strategy saw them
+    """
+    def __init__(self, strategy, traderbook, timer=1.):
+        self.strategy = strategy
+        self.tb = traderbook
+        self.mb = traderbook.mb
+        self.timer = timer
+        strategy.runner, strategy.tb, strategy.mb, strategy.ledger = self, traderbook, self.mb, traderbook.ledger
+
+        self._cond = threading.Condition()
+        self._events = deque()
+        # latest quote not delivered yet, and its arrival time : one 'quote' event stands for it
+        self._quote = None
+        self._timer_pending = False
+        self._last_trade = None
+        self.coalesced = 0
+        self._timings = {name: _Timing() for name in CALLBACKS}
+
+        self._running = False
+        self._thread = None
+        self._job = None
+        self._quote_callback = None
+        self._fill_callback = None
+        self.stopped = threading.Event()
+
+    """
+        Events, from the websocket / scheduler threads
+    """
+    def __push(self, kind, payload):
+        with self._cond:
+            self._events.append((kind, payload, time.perf_counter_ns()))
+            self._cond.notify()
+
+    def _on_quote_message(self, msg):
+        if not self._running or not msg.get('ok'):
+            return
+        quote, now = msg.get('quote'), time.perf_counter_ns()
+        trade = quote.get('lastTrade')
+        with self._cond:
+            if self._quote is None:
+                self._events.append(('quote', None, now))
+            else:
+                self.coalesced += 1
+            self._quote = (quote, now)
+            if trade is not None and trade != self._last_trade:
+                if self._last_trade is not None:
+                    self._events.append(('trade', quote, now))
+                self._last_trade = trade
+            self._cond.notify()
+
+    def _on_fill_message(self, msg):
+        if self._running and msg.get('ok', True):
+            self.__push('fill', msg)
+
+    def _on_timer(self):
+        with self._cond:
+            if self._running and not self._timer_pending:
+                self._timer_pending = True
+                self._events.append(('timer', None, time.perf_counter_ns()))
+                self._cond.notify()
+
+    def _ack(self, res):
+        if res:
+            self.__push('ack', res)
+        return res
+
+    """
+        Running
+    """
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self.stopped.clear()
+        self._quote_callback = self.mb.subscribe_quotes(self._on_quote_message)
+        self._fill_callback = self.mb.subscribe_fills(self._on_fill_message)
+        if self.timer:
+            self._job = get_scheduler().add('strategy-{}'.format(type(self.strategy).__name__),
+                                            self._on_timer, interval=self.timer, delay=self.timer, rest=False)
+        self._thread = threading.Thread(target=self.__loop, name='strategy')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._job is not None:
+            get_scheduler().remove(self._job)
+            self._job = None
+        # stop() before start(), or twice : nothing to unsubscribe
+        for callback in (self._quote_callback, self._fill_callback):
+            if callback is not None:
+                self.mb.unsubscribe(callback)
+        self._quote_callback = self._fill_callback = None
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    def wait(self, timeout=None):
+        return self.stopped.wait(timeout)
+
+    def __call(self, name, arg=(), received=None):
+        timing = self._timings[name]
+        start = time.perf_counter_ns()
+        if received is not None:
+            timing.delay.record(start - received)
+        try:
+            getattr(self.strategy, name)(*arg)
+        except RiskLimitExceeded as e:
+            timing.errors += 1
+            print('Strategy {} : order refused, {}'.format(name, e))
+        except Exception as e:
+            timing.errors += 1
+            print('Strategy {} failed : {!r}'.format(name, e))
+        timing.calls += 1
+        timing.run.record(time.perf_counter_ns() - start)
+
+    def __next(self):
+        # next event, None once stopped
+        with self._cond:
+            while self._running and not self._events:
+                self._cond.wait()
+            if not self._running:
+                return None
+            kind, payload, received = self._events.popleft()
+            if kind == 'quote':
+                (payload, received), self._quote = self._quote, None
+            elif kind == 'timer':
+                self._timer_pending = False
+            return kind, payload, received
+
+    def __loop(self):
+        strategy = self.strategy
+        self.__call('on_start')
+        while True:
+            event = self.__next()
+            if event is None:
+                break
+            kind, payload, received = event
+            if kind == 'quote':
+                strategy.quote = payload
+                self.__call('on_quote', (payload,), received)
+            elif kind == 'trade':
+                self.__call('on_trade', (payload,), received)
+            elif kind == 'fill':
+                self.__call('on_fill', (payload,), received)
+            elif kind == 'ack':
+                self.__call('on_order_ack', (payload,), received)
+            elif kind == 'timer':
+                self.__call('on_timer', (), received)
+        self.__call('on_stop')
+        self.stopped.set()
+
+    def stats(self):
+        stats = {name: timing.snapshot() for name, timing in self._timings.items() if timing.calls}
+        stats['coalesced'] = self.coalesced
+        return stats
+
+
+class MarketMakerStrategy(Strategy):
+    """
+        Example : quotes both sides around the mid (sell_side level)
+            - spread        : width of our quotes (price x 100)
+            - qty           : shares per quote
+            - max_position  : quotes are skewed against the position, the side adding to it
+                                stops quoting at max_position
+            - requote       : the quotes are replaced once the mid moved by more than `requote`
+            - stale         : open orders older than `stale` seconds are cancelled by the timer
+        Quotes are replaced on the quote that moves the mid, and right after a fill.
+    """
+    def __init__(self, spread=40, qty=50, max_position=500, requote=10, stale=10):
+        self.spread = spread
+        self.qty = qty
+        self.max_position = max_position
+        self.requote = requote
+        self.stale = stale
+        self._quoted_mid = None
+
+    def on_quote(self, quote):
+        bid, ask = quote.get('bid'), quote.get('ask')
+        if not (bid and ask):
+            return
+        mid = (bid + ask) / 2.
+        if self._quoted_mid is None or abs(mid - self._quoted_mid) > self.requote:
+            self._quote_around(mid)
+
+    def on_fill(self, msg):
+        # our quote was hit : requote at once, on the latest quote seen
+        self._quoted_mid = None
+        if self.quote is not None:
+            self.on_quote(self.quote)
+
+    def on_timer(self):
+        self.tb.flush_old_orders(self.stale)
+        self.tb.get_own_book()
+
+    def _quote_around(self, mid):
+        position = self.ledger.position
+        skew = - position / float(self.max_position) * self.spread / 2.
+        orders = []
+        if position + self.qty <= self.max_position:
+            orders.append({'direction': 'buy', 'qty': self.qty, 'price': int(mid - self.spread / 2. + skew)})
+        if position - self.qty >= -self.max_position:
+            orders.append({'direction': 'sell', 'qty': self.qty, 'price': int(mid + self.spread / 2. + skew)})
+
+        oids = sorted(self.tb.orders.open_ids())
+        if oids:
+            self.cancel_many(oids)
+        self.submit_many(orders)
+        self._quoted_mid = mid
@@ -1,6 +1,14 @@
-import arrow
-import numpy as np
-import pandas as pd
+from collections import namedtuple
+
+from stockfighter.lib.latency import recorder
+from .ledger import PositionLedger
+from .orderindex import OrderIndex
+from .pnl import PnLReport, fills_from_orders, marks_from_store
+from .risk import RiskEngine, RiskLimitExceeded
+
+
+# Outcome of one order in a batch : the request sent, the API response, the exception raised (if any)
+BatchResult = namedtuple('BatchResult', ['request', 'response', 'error'])
 
 
 class TraderBook(object):
@@ -10,24 +18,65 @@ class TraderBook(object):
             - open orders
             - current position
 
+        The book is kept by a PositionLedger, updated once per order response / execution message.
+            The `orders` and `fills` tables are only written to (persistence), and read once on construction
+            (recovery), for the orders of the MarketBroker's venue, stock and account.
+
+        Every order goes through a RiskEngine first (limits from the [risk] section of config.ini,
+            or the `risk` given) : an order breaking a limit raises RiskLimitExceeded, and is not sent.
+            kill(reason) refuses every new order and cancels the open ones.
+
+        The order index and the risk engine follow the `clock` of the MarketBroker when it has one
+            (simulated time of a BacktestBroker), the wall clock otherwise.
     """
 
-    def __init__(self, marketbroker):
+    def __init__(self, marketbroker, risk=None):
         self.mb = marketbroker
         self._db = marketbroker._db
-        self.book = {
-            'position': {'qty': 0, 'pps': 0},
-            'open_buy': {'qty': 0, 'pps': 0},
-            'open_sell': {'qty': 0, 'pps': 0}
-        }
+        clock = getattr(marketbroker, 'clock', None)
+        stored = list(self._stored_orders())
+        self.ledger = PositionLedger.from_orders(stored)
+        self.book = self.ledger.book()
+        # Our orders by id, open ones by side / price / age
+        self.orders = OrderIndex(clock=clock)
+        for order in stored + (self.mb.all_orders_in_stock or []):
+            self.orders.on_order(order)
+
+        self.risk = risk if risk is not None else RiskEngine(self.ledger, clock=clock)
+        if self.risk.on_kill is None:
+            self.risk.on_kill = self.__cancel_open
+        self.mb.subscribe_quotes(self.risk.on_quote)
+        quote = self.mb.current_quote()
+        if quote is not None:
+            self.risk.on_quote({'ok': True, 'quote': quote})
+
+        # Execution messages update the ledger as they arrive. The ones received before are replayed
+        #   (applying a message twice is a no-op for the ledger)
+        self.mb.subscribe_fills(self.ledger.on_fill)
+        self.mb.subscribe_fills(self.orders.on_fill)
+        for msg in self.mb._get_fills_ws():
+            self.ledger.on_fill(msg)
+            self.orders.on_fill(msg)
+        self._fills_cursor = 0  # number of execution messages already persisted
 
         print('TraderBook Ready')
 
+    def _stored_orders(self):
+        # Stored orders of this venue / stock / account (the table also keeps those of earlier levels),
+        #   with their stored fills
+        scope = {'venue': getattr(self.mb, '_venue', None), 'symbol': getattr(self.mb, '_stock', None),
+                 'account': getattr(self.mb, '_account', None)}
+        stored_fills = {}
+        for fill in self._db.iterate_table('fills'):
+            stored_fills.setdefault(fill.get('oid'), []).append(fill)
+        for order in self._db.iterate_table('orders'):
+            if all(order.get(key) == value for key, value in scope.items() if value is not None):
+                yield dict(order, fills=stored_fills.get(order.get('id'), []))
+
     def seconds_without_trading(self):
-        # How many seconds since the last trade
-        last_trade = arrow.get(self.mb.current_quote().name)
-        last_quote = self.mb.get_latest_quote_time()
-        return (last_quote - last_trade).total_seconds()
+        # How many seconds between the last trade and the latest quote
+        quote = self.mb.current_quote()
+        return (quote.name - quote.get('lastTrade')).total_seconds()
 
     """
         Orders related
@@ -41,89 +90,49 @@ class TraderBook(object):
 
     def _update_orders(self):
         """
-            Update status of orders - in database
-                - get fills from websocket
-                - find latest status for all the fills
-                - for each record that exists in db, updates it.
+            Persists the latest status of the orders filled since the last call.
+                (the ledger itself is updated by the fills websocket, as messages arrive)
         """
-        orders = self.mb._get_fills_ws()
-        latest_only = self._find_latest(orders)
+        fills = self.mb._get_fills_ws()
+        new_fills, self._fills_cursor = fills.since(self._fills_cursor)
 
-        for oid, order in latest_only.items():
-            oid_record = self._db.db['orders'].find_one(id=oid)
-            if oid_record:
-                update_data = order.get('order')
-                if 'fills' in update_data:
-                    update_data.pop('fills')
-                self._db.db['orders'].update(update_data, keys=['id'])
+        oids = set(msg.get('order', {}).get('id') for msg in new_fills)
+        oids.discard(None)
+        if oids:
+            self._db.update_order_batch([fills.latest(oid).get('order') for oid in oids])
 
     def flush_old_orders(self, seconds=120):
-        # Cancel all open orders older than seconds
-        all_orders = self.mb.all_orders_in_stock
-        if all_orders:
-            for order in all_orders:
-                if order.get('open'):
-                    if arrow.get(order.get('ts')) < arrow.utcnow().replace(seconds=-seconds):
-                        self.cancel(order.get('id'))
+        # Cancel all open orders older than seconds (oldest first, from the order index)
+        oids = self.orders.older_than(seconds)
+        if oids:
+            self.cancel_many(oids)
 
-    @staticmethod
-    def _pos_and_price(data):
+    def get_order(self, oid):
         """
-            From a dataframe of qty & prices, returns the total qty, and the price per share
+            Latest status of one of our orders : from the order index, or from the api if it is unknown
         """
-        df = pd.DataFrame(data=data, columns=['qty', 'price'])
-
-        if not df.empty:
-            position = df.qty.sum()
-            pps = np.average(df.price, weights=df.qty)
-        else:
-            position, pps = 0, 0
-
-        return {'qty': position, 'pps': pps}
+        order = self.orders.get(oid)
+        if order is None:
+            order = self.mb._get_order_status(oid)
+            self.orders.on_order(order)
+        return order
 
     def get_own_book(self):
         """
-            Returns a tuple containing :
-                - position : current number of owned / short shares
-                - buy       : number of shares with open buy orders
-                - sell      : number of shares with open sell orders
+            Returns a dict containing :
+                - position  : current number of owned / short shares, and price per share
+                - open_buy  : number of shares with open buy orders, and their average price
+                - open_sell : number of shares with open sell orders, and their average price
         """
         self._update_orders()
-
-        filled_orders = []
-        unfilled_orders = {
-            'buy':   [],
-            'sell':  [],
-
-        }
-
-        for order in self._db.iterate_table('orders'):
-            # direction
-            direction = 1 if order.get('direction') == 'buy' else -1
-            # filled / unfilled
-            filled = order.get('totalFilled')
-            unfilled = order.get('originalQty') - filled
-            price = order.get('price')
-            ## Filled orders
-            if filled > 0:
-                filled_orders.append([filled * direction, price])
-
-            if unfilled > 0 and order.get('open'):
-                unfilled_orders[order.get('direction')].append([unfilled, price])
-
-        self.book = {
-            'position':     self._pos_and_price(filled_orders),
-            'open_buy':     self._pos_and_price(unfilled_orders['buy']),
-            'open_sell':    self._pos_and_price(unfilled_orders['sell']),
-        }
-
+        self.book = self.ledger.book()
         return self.book
 
     def compute_pnl(self):
         qty = self.book.get('position').get('qty')
         pps = self.book.get('position').get('pps')
         if qty:
-            self._market_value = (self.mb.get_histo().iloc[-1]['last'] / 100) * qty
+            self._market_value = (self.mb.current_quote().get('last') / 100) * qty
             value = qty * pps / 100
             self.pnl = self._market_value - value
         else:
@@ -131,6 +140,34 @@ class TraderBook(object):
 
         return self.pnl
 
+    def pnl_report(self, quotes=True):
+        """
+            P&L over the whole history : FIFO realized / unrealized, inventory, cost basis, drawdown,
+                spread capture, per fill and per order (see trader.pnl.PnLReport)
+                Fills come from the executions websocket, the polled orders, then the stored orders and fills.
+            quotes : marks the position, and measures spread capture, at the mids of the quotes held in memory
+        """
+        orders = list(self._stored_orders())
+        orders += list(self.mb.all_orders_in_stock or [])
+        fills = fills_from_orders(orders, self.mb._get_fills_ws())
+        return PnLReport(fills, marks_from_store(self.mb.store) if quotes else None)
+
+    def __send(self, send, direction, qty, price, order_type):
+        # Risk check, order, then the ledger before the order leaves the in flight counters
+        self.risk.check(direction, qty, price, order_type)
+        res = None
+        try:
+            res = send(qty, price, order_type)
+            if res:
+                self.ledger.on_ack(res)
+                self.orders.on_ack(res)
+        finally:
+            self.risk.done(direction, qty, price, res)
+        if res:
+            self._db.save_order(res)
+            recorder.mark_order(res.get('id'), 'persisted')
+        return res
+
     def buy(self, qty, price=None, order_type='limit'):
         """
             Buy this MarketMaker's stock
@@ -138,11 +175,9 @@ class TraderBook(object):
                 qty     : int, how many shares you want to buy
                 price   : int, price x 100
                 order_type : string, limit, market, fill-or-kill, immediate-or-cancel
+            raises RiskLimitExceeded if the order breaks a risk limit
         """
-        res = self.mb._buy(qty, price, order_type)
-        if res:
-            self._db.save_order(res)
-        return res
+        return self.__send(self.mb._buy, 'buy', qty, price, order_type)
 
     def sell(self, qty, price=None, order_type='limit'):
         """
@@ -151,11 +186,9 @@ class TraderBook(object):
                 qty     : int, how many shares you want to buy
                 price   : int, price x 100
                 order_type : string, limit, market, fill-or-kill, immediate-or-cancel
+            raises RiskLimitExceeded if the order breaks a risk limit
         """
-        res = self.mb._sell(qty, price, order_type)
-        if res:
-            self._db.save_order(res)
-        return res
+        return self.__send(self.mb._sell, 'sell', qty, price, order_type)
 
     def cancel(self, oid):
         """
@@ -165,34 +198,90 @@ class TraderBook(object):
         """
         res = self.mb._cancel(oid)
         if res.get('ok') and not res.get('open'):
+            self.ledger.on_order(res)
+            self.orders.on_order(res)
             print('Order {} cancelled successfully'.format(oid))
         else:
+            if res.get('ok') is False:
+                self.__forget(oid)
             raise Exception('Couldnt cancel order')
 
-    """
-        Fills related
-    """
-    @staticmethod
-    def _find_latest(orders):
-        """
-            From a dictionnary of fills (returned by the fills websocket)
-                filters, and return only the latest information
-                (the fills dictionnary will contain one entry for each partial fill
-                of an orderid )
-        """
-        latest_only = {}
-
-        for order in orders:
-            inid = order.get('incomingId')
-            oid = order.get('order').get('id')
-
-            if oid:
-                soid = str(oid)
-                if soid in latest_only.keys():
-                    current_inid = latest_only.get(soid).get('incomingId')
-                    if inid > current_inid:
-                        latest_only[soid] = order
-                else:
-                    latest_only[soid] = order
-
-        return latest_only
+    def submit_many(self, orders):
+        """
+            Sends a batch of orders concurrently, and stores the results in one transaction
+            input :
+                orders  : list of dicts, with keys direction ('buy' / 'sell'), qty, price
+                            and order_type (defaults to limit)
+            returns a list of BatchResult(request, response, error), in the same order as `orders`.
+                Orders refused by the risk engine are not sent, their error is the RiskLimitExceeded.
+        """
+        results, accepted = [None] * len(orders), []
+        for i, order in enumerate(orders):
+            try:
+                self.risk.check(order.get('direction'), order.get('qty'), order.get('price'),
+                                order.get('order_type', 'limit'))
+                accepted.append(i)
+            except RiskLimitExceeded as e:
+                results[i] = BatchResult(order, None, e)
+
+        sent = self.mb._submit_many([orders[i] for i in accepted]) if accepted else []
+        for i, (res, err) in zip(accepted, sent):
+            order = orders[i]
+            results[i] = BatchResult(order, res, err)
+            self.ledger.on_ack(res)
+            self.orders.on_ack(res)
+            self.risk.done(order.get('direction'), order.get('qty'), order.get('price'), res)
+        self._db.save_order_batch([result.response for result in results if result.response])
+        for result in results:
+            if result.response:
+                recorder.mark_order(result.response.get('id'), 'persisted')
+        return results
+
+    def cancel_many(self, oids):
+        """
+            Cancels a batch of orders concurrently, and stores their final status in one transaction
+            returns a list of BatchResult(oid, response, error), in the same order as `oids`
+        """
+        results = []
+        for oid, (res, err) in zip(oids, self.mb._cancel_many(oids)):
+            if err is None and not (res.get('ok') and not res.get('open')):
+                err = Exception('Couldnt cancel order {}'.format(oid))
+                if res.get('ok') is False:
+                    self.__forget(oid)
+            results.append(BatchResult(oid, res, err))
+
+        cancelled = [result.response for result in results if result.error is None]
+        for res in cancelled:
+            self.ledger.on_order(res)
+            self.orders.on_order(res)
+        self._db.update_order_batch(cancelled)
+        print('{}/{} orders cancelled successfully'.format(len(cancelled), len(results)))
+        return results
+
+    def __forget(self, oid):
+        # The venue does not know the order (refused cancel) : it is not tracked, nor counted as open, anymore
+        self.orders.forget(oid)
+        if self.ledger.is_open(oid):
+            self.ledger.on_order({'id': oid, 'open': False})
+
+    def kill(self, reason='kill switch'):
+        """
+            Kill switch : every new order is refused (until self.risk.revive()), the open ones are cancelled
+        """
+        return self.risk.kill(reason)
+
+    def __cancel_open(self):
+        # Open orders of the index (up to date with the fills websocket), and of the last REST poll
+        oids = self.orders.open_ids()
+        oids.update(order.get('id') for order in self.mb.all_orders_in_stock or [] if order.get('open'))
+        return self.cancel_many(sorted(oids))
+
+    def cancel_all(self, side=None):
+        """
+            Cancels all our open orders in the stock
+                side : 'buy' / 'sell' to only cancel one side. Defaults to both
+        """
+        oids = self.orders.open_ids(side)
+        oids.update(order.get('id') for order in self.mb.all_orders_in_stock or []
+                    if order.get('open') and side in (None, order.get('direction')))
+        return self.cancel_many(sorted(oids))